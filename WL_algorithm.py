@@ -1,153 +1,421 @@
-"""Computes a reaction signature using a Weisfeiler-Lehman-based graph kernel."""
-from synkit.IO import rsmi_to_its, rsmi_to_graph
-from synkit.Vis import GraphVisualizer
-import matplotlib.pyplot as plt
-import networkx as nx
-import hashlib
-import pandas as pd
-
-def get_hash(data: str):
-    """Returns a stable 64-bit integer from a string."""
-    return int(hashlib.blake2b(data.encode(), digest_size=8).hexdigest(), 16)
+"""Computes a reaction signature using a Weisfeiler-Lehman-based graph kernel.
 
-# Example reaction SMILES string
-rsmi = '[CH3:1][CH:2]=[O:3].[CH:4]([H:7])([H:8])[CH:5]=[O:6]>>[CH3:1][CH:2]=[CH:4][CH:5]=[O:6].[O:3]([H:7])([H:8])'
+Importing the module does no work, run it (or cli.py precompute) to featurize the dataset.
+"""
+from synkit.IO import rsmi_to_graph
+from synkit.Graph.ITS import ITSConstruction
+import logging
+from functools import partial
+import numpy as np
+from shortest_paths import ShortestPathForest
+from feature_ids import get_hash
+from compact_graph import as_compact_graph
+from wl_labels import WLLabelCompressor, edge_label
+from batch_wl import batch_wl
+from reaction_center import localized_drf
+from instrumentation import stage, count
+from feature_store import FEATURE_COLUMNS, DEFAULT_STORE
+from feature_cache import FeatureCache, DEFAULT_CACHE
+from feature_pipeline import read_reaction_chunks, map_chunks, iter_rows, write_shards
+
+logger = logging.getLogger(__name__)
 
+# Signature dictionary of the compressed WL relabeling, shared by all graphs processed in this process
+WL_LABELS = WLLabelCompressor()
 
-# Parse SMILES into educt and product graphs
-educt_graph, product_graph = rsmi_to_graph(rsmi)
-its_graph = rsmi_to_its(rsmi)
+# Example reaction SMILES string
+EXAMPLE_RSMI = '[CH3:1][CH:2]=[O:3].[CH:4]([H:7])([H:8])[CH:5]=[O:6]>>[CH3:1][CH:2]=[CH:4][CH:5]=[O:6].[O:3]([H:7])([H:8])'
 
 
-def getWL(graph, h_max):
+def getWL(graph, h_max, relabel="string", compressor=None, early_stop=True, max_distance=None, max_paths_per_source=None):
     """
     Computes node, edge, and shortest-path features for a graph using a WL-like algorithm.
 
     Args:
-        graph (nx.Graph): Input molecular graph.
+        graph (nx.Graph or CompactGraph): Input molecular graph.
         h_max (int): Number of WL iterations.
+        relabel (str): "string" concatenates the sorted neighbor labels to the node label,
+            "compressed" maps every (label, neighbor multiset) signature to a 64-bit integer
+            label (see wl_labels.py), so labels do not grow with the iterations.
+        compressor (WLLabelCompressor): Signature dictionary for relabel="compressed",
+            the module-wide WL_LABELS shared across the whole dataset if None.
+        early_stop (bool): For relabel="compressed", stop as soon as an iteration
+            no longer refines the label partition.
+        max_distance (int): Only emit shortest-path features for pairs at most this many hops apart.
+        max_paths_per_source (int): Only emit the shortest paths to the nearest this many targets of
+            every node, rounded up to whole BFS levels. Both bound the quadratic number of pairs for large molecules; the pairs left
+            out are counted as "skipped_pairs" (see shortest_paths.ShortestPathForest).
 
     Returns:
         tuple[set, set, set]: Node, edge, and shortest-path feature sets.
     """
+    if relabel == "compressed":
+        return getWL_compressed(graph, h_max, compressor or WL_LABELS, early_stop, max_distance, max_paths_per_source)
+    if relabel != "string":
+        raise ValueError(f"Unknown relabel mode '{relabel}'")
+
     feature_setN = set()
     feature_setE = set()
     feature_setSP = set()
-    shortest_pathsL = dict(nx.shortest_path_length(graph))
-    shortest_paths = dict(nx.shortest_path(graph))
+    # Array-backed graph, nodes are addressed by their position (see compact_graph.py)
+    graph = as_compact_graph(graph)
+    adjacency = graph.adjacency_lists()
+    edges = [(u, v, str(order)) for u, v, order in graph.edges()]
+    # BFS trees of all sources, built once and reused in every iteration
+    with stage("apsp"):
+        shortest_path_forest = ShortestPathForest(graph, max_distance, max_paths_per_source)
     # Initialize labels with element types
-    labels = {n: str(graph.nodes[n].get('element')) for n in graph.nodes()}
-    print(labels)
-    for label in labels.values():
-        feature_setN.add(get_hash(label))
+    labels = [str(element) for element in graph.element_symbols()]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Initial labels: %s", dict(zip(graph.node_ids, labels)))
+    with stage("hashing"):
+        for label in labels:
+            feature_setN.add(get_hash(label))
     for h in range(h_max+1):
-        # Generate edge features
-        for u,v,d in graph.edges(data=True):
-            l_a = labels[u]
-            l_b = labels[v]
-            l_ab = str(d.get('order'))
-
-            node_pair = sorted([l_a, l_b])
-            triplet = f"{node_pair[0]}{l_ab}{node_pair[1]}"
-            #print(triplet)
-            feature_setE.add(get_hash(triplet))
-
-        new_labels = {}
-        # Generate shortest-path features
-        for n in graph.nodes():
-            for m in shortest_pathsL[n]:
-                if n != m:
-                    # Keep the original Element-Distance-Element feature
-                    l_n = labels[n]
-                    l_m = labels[m]
-                    distance = shortest_pathsL[n][m]
-                    node_pair = sorted([l_m, l_n])
-                    sp_feature_dist = f"{node_pair[0]}-{distance}-{node_pair[1]}"
-                    #print(sp_feature_dist)
-                    feature_setSP.add(get_hash(sp_feature_dist))
-
-                    # Concatenated labels along the shortest path
-                    path_nodes = shortest_paths[n][m]
-                    path_labels = [labels[node] for node in path_nodes]
-                    sp_feature_forward = "".join(path_labels)
-                    sp_feature_backward = "".join(reversed(path_labels))
-                    # directional invariance of the paths
-                    sp_feature_path = min(sp_feature_forward, sp_feature_backward)
-                    #print(sp_feature_path)
-                    feature_setSP.add(get_hash(sp_feature_path))
+        with stage("wl_iteration"):
+            # Generate edge features
+            for u, v, l_ab in edges:
+                l_a = labels[u]
+                l_b = labels[v]
+
+                node_pair = sorted([l_a, l_b])
+                triplet = f"{node_pair[0]}{l_ab}{node_pair[1]}"
+                #print(triplet)
+                feature_setE.add(get_hash(triplet))
+
+            # Generate shortest-path features: Element-Distance-Element and the labels along the path,
+            # hashed from the prefix hashes of the BFS trees (see shortest_paths.py)
+            label_codes = [get_hash(label) for label in labels]
+            feature_setSP.update(shortest_path_forest.features(label_codes, include_distance=True))
 
             # Update node labels for the next iteration (WL aggregation)
             if h<h_max:
-                current = labels[n]
-                #print(current)
-                neighbor_labels = []
-                for neighbor in graph.neighbors(n):
-                    neighbor_labels.append(labels[neighbor])
-                    #print(neighbor_labels)
-                neighbor_labels.sort()
-                combined = current + "".join(neighbor_labels)
-                #print(combined)
-                new_labels[n] = combined
-
-        # Update labels and add new features
-        if h<h_max:
-            labels = new_labels
-            #print(labels)
-            for label in labels.values():
-                feature_setN.add(get_hash(label))
+                new_labels = []
+                for n, neighbors in enumerate(adjacency):
+                    current = labels[n]
+                    #print(current)
+                    neighbor_labels = sorted(labels[neighbor] for neighbor in neighbors)
+                    combined = current + "".join(neighbor_labels)
+                    #print(combined)
+                    new_labels.append(combined)
+
+                # Update labels and add new features
+                labels = new_labels
+                #print(labels)
+                for label in labels:
+                    feature_setN.add(get_hash(label))
+        count("wl_iterations")
         #print(labels)
-        print(len(feature_setSP))
+        logger.debug("Iteration %d: %d shortest-path features", h, len(feature_setSP))
 
-    print(f"Final feature set size: {len(feature_setN)}")
+    logger.debug("Final feature set size: %d", len(feature_setN))
     return feature_setN, feature_setSP, feature_setE
 
-# --- Main Execution ---
-# Generate features for educt and product graphs
-a1, a2, a3 = getWL(educt_graph, 4)
-b1, b2, b3 = getWL(product_graph, 4)
-c1, c2, c3 = getWL(its_graph, 4)
-
-# The reaction signature is the symmetric difference of the node features.
-signature1 = a1.symmetric_difference(b1)
-signature2 = a2.symmetric_difference(b2)
-signature3 = a3.symmetric_difference(b3)
-
-# Create dataframe consisting of 6 columns:
-df = pd.DataFrame(columns=[
-    "DRF Edges",
-    "DRF Shortest Paths",
-    "ITS Nodes",
-    "ITS Edges",
-    "ITS Shortest Paths"
-])
+def getWL_compressed(graph, h_max, compressor, early_stop=True, max_distance=None, max_paths_per_source=None):
+    """
+    WL features with classic label compression: the labels are 64-bit integers in every iteration.
 
-if __name__ == "__main__":
-    # For each SMILES execute the WL algorithm and add to dataframe
-    df_schneider = pd.read_csv("schneider50k_clean.tsv", sep="\t")
-    for index, row in df_schneider.iterrows():
-        rsmi = row["clean_rxn"]
-        try:
-            educt_graph, product_graph = rsmi_to_graph(rsmi)
-            its_graph = rsmi_to_its(rsmi)
-            nodes_e, sps_e, edges_e = getWL(educt_graph, 4)
-            nodes_p, sps_p, edges_p = getWL(product_graph, 4)
-            nodes_its, sps_its, edges_its = getWL(its_graph, 4)
-
-            drf_nodes = nodes_e.symmetric_difference(nodes_p)
-            drf_sps = sps_e.symmetric_difference(sps_p)
-            drf_edges = edges_e.symmetric_difference(edges_p)
-        except Exception as e:
-            print(f"Error processing reaction {index}: {e}")
-            drf_nodes = drf_edges = drf_sps = nodes_its = edges_its = sps_its = set()
+    Args:
+        graph (nx.Graph or CompactGraph): Input molecular graph.
+        h_max (int): Maximum number of WL iterations.
+        compressor (WLLabelCompressor): Signature dictionary shared across the dataset.
+        early_stop (bool): Stop once the number of distinct labels no longer grows, i.e. the
+            label partition is stable and further iterations would only rename it.
+        max_distance, max_paths_per_source (int): Bound the shortest-path features, see getWL.
+
+    Returns:
+        tuple[set, set, set]: Node, edge, and shortest-path feature sets.
+    """
+    return getWL_compressed_joint([graph], h_max, compressor, early_stop, max_distance, max_paths_per_source)[0]
+
+
+def getWL_compressed_joint(graphs, h_max, compressor, early_stop=True, max_distance=None, max_paths_per_source=None):
+    """
+    Compressed WL features of several graphs that are refined in lockstep.
+
+    With early stopping, all graphs stop at the same iteration, namely once the partition of
+    their joint label set is stable. Graphs whose features are compared with each other (educt
+    and product of a DRF) must be refined jointly, otherwise one of them could stop earlier and
+    the symmetric difference would contain the later-iteration features of unchanged regions.
+
+    Args:
+        graphs (list[nx.Graph or CompactGraph]): Input molecular graphs.
+        h_max (int): Maximum number of WL iterations.
+        compressor (WLLabelCompressor): Signature dictionary shared across the dataset.
+        early_stop (bool): Stop once the joint label partition no longer changes.
+        max_distance, max_paths_per_source (int): Bound the shortest-path features, see getWL.
+
+    Returns:
+        list[tuple[set, set, set]]: Node, edge, and shortest-path feature sets per graph.
+    """
+    states = []
+    for graph in graphs:
+        graph = as_compact_graph(graph)
+        with stage("apsp"):
+            forest = ShortestPathForest(graph, max_distance, max_paths_per_source)
+        states.append({
+            "forest": forest,
+            "neighbors": graph.adjacency_lists(),
+            "edges": [(u, v, compressor.order_code(order)) for u, v, order in graph.edges()],
+            "labels": [compressor.initial_label(element) for element in graph.element_symbols()],
+            "N": set(), "SP": set(), "E": set()
+        })
+    for state in states:
+        state["N"].update(state["labels"])
+
+    for h in range(h_max+1):
+        count("wl_iterations")
+        with stage("wl_iteration"):
+            for state in states:
+                labels = state["labels"]
+                for u, v, order_code in state["edges"]:
+                    state["E"].add(edge_label(labels[u], order_code, labels[v]))
+                state["SP"].update(state["forest"].features(labels, include_distance=True))
+
+            if h == h_max:
+                break
+            new_labels = []
+            for state in states:
+                labels = state["labels"]
+                new_labels.append([compressor.compress(labels[n], [labels[m] for m in neighbors]) for n, neighbors in enumerate(state["neighbors"])])
+
+        # Refinement never merges classes, so an unchanged number of distinct labels means a stable partition
+        if early_stop:
+            old_count = len(set().union(*(state["labels"] for state in states)))
+            new_count = len(set().union(*new_labels))
+            if new_count == old_count:
+                break
+        for state, labels in zip(states, new_labels):
+            state["labels"] = labels
+            state["N"].update(labels)
+
+    return [(state["N"], state["SP"], state["E"]) for state in states]
+
+def reaction_signature(rsmi:str = EXAMPLE_RSMI, h_max:int = 4) -> tuple:
+    """
+    Computes the reaction signature of one reaction: the symmetric differences of the node,
+    shortest-path and edge features of its educt and product graphs.
+
+    Returns:
+        tuple[set, set, set]: Node, shortest-path and edge signature.
+    """
+    # Parse SMILES into educt and product graphs
+    educt_graph, product_graph = rsmi_to_graph(rsmi)
+    # Generate features for educt and product graphs
+    a1, a2, a3 = getWL(educt_graph, h_max)
+    b1, b2, b3 = getWL(product_graph, h_max)
+
+    # The reaction signature is the symmetric difference of the node features.
+    signature1 = a1.symmetric_difference(b1)
+    signature2 = a2.symmetric_difference(b2)
+    signature3 = a3.symmetric_difference(b3)
+    return signature1, signature2, signature3
+
+def parse_reaction(rsmi:str) -> tuple:
+    """
+    Parses a reaction SMILES into its educt, product and ITS graph.
+
+    Raises:
+        ValueError: If the SMILES cannot be parsed (synkit only logs the error and returns no graphs).
+    """
+    with stage("parse"):
+        educt_graph, product_graph = rsmi_to_graph(rsmi)
+        if educt_graph is None or product_graph is None:
+            raise ValueError(f"Could not parse reaction {rsmi}")
+        # Build the ITS from the parsed graphs instead of parsing the SMILES a second time in rsmi_to_its
+        its_graph = ITSConstruction().ITSGraph(educt_graph, product_graph)
+    count("reactions_parsed")
+    return educt_graph, product_graph, its_graph
+
+
+def compute_reaction_features(rsmi:str, h_max:int = 4, relabel:str = "string", max_distance:int = None, max_paths_per_source:int = None,
+                              localized:bool = False) -> dict:
+    """
+    Computes the six DRF and ITS feature sets of one reaction.
+
+    Args:
+        rsmi (str): Atom-mapped reaction SMILES.
+        h_max (int): Number of WL iterations.
+        relabel (str): WL relabeling mode, see getWL.
+        max_distance, max_paths_per_source (int): Bound the shortest-path features, see getWL.
+        localized (bool): Compute the DRF columns with reaction_center.localized_drf, which only
+            recomputes the neighborhood of the reaction center in one of the graphs. Same features.
 
-        df = pd.concat([df, pd.DataFrame([{
+    Returns:
+        dict[str, set]: Feature set per column of FEATURE_COLUMNS.
+    """
+    educt_graph, product_graph, its_graph = parse_reaction(rsmi)
+    if localized:
+        drf_nodes, drf_sps, drf_edges = localized_drf(educt_graph, product_graph, its_graph, h_max, relabel, WL_LABELS,
+                                                      max_distance=max_distance, max_paths_per_source=max_paths_per_source)
+        nodes_its, sps_its, edges_its = getWL(its_graph, h_max, relabel, max_distance=max_distance, max_paths_per_source=max_paths_per_source)
+        return {
             "DRF Nodes": drf_nodes,
             "DRF Edges": drf_edges,
             "DRF Shortest Paths": drf_sps,
             "ITS Nodes": nodes_its,
             "ITS Edges": edges_its,
             "ITS Shortest Paths": sps_its
-        }])], ignore_index=True)
+        }
+    if relabel == "compressed":
+        # Educt and product are refined jointly so that both stop at the same iteration
+        (nodes_e, sps_e, edges_e), (nodes_p, sps_p, edges_p) = getWL_compressed_joint([educt_graph, product_graph], h_max, WL_LABELS,
+                                                                                      max_distance=max_distance, max_paths_per_source=max_paths_per_source)
+        nodes_its, sps_its, edges_its = getWL_compressed(its_graph, h_max, WL_LABELS, max_distance=max_distance, max_paths_per_source=max_paths_per_source)
+    else:
+        nodes_e, sps_e, edges_e = getWL(educt_graph, h_max, relabel, max_distance=max_distance, max_paths_per_source=max_paths_per_source)
+        nodes_p, sps_p, edges_p = getWL(product_graph, h_max, relabel, max_distance=max_distance, max_paths_per_source=max_paths_per_source)
+        nodes_its, sps_its, edges_its = getWL(its_graph, h_max, relabel, max_distance=max_distance, max_paths_per_source=max_paths_per_source)
+
+    with stage("set_algebra"):
+        return {
+            "DRF Nodes": nodes_e.symmetric_difference(nodes_p),
+            "DRF Edges": edges_e.symmetric_difference(edges_p),
+            "DRF Shortest Paths": sps_e.symmetric_difference(sps_p),
+            "ITS Nodes": nodes_its,
+            "ITS Edges": edges_its,
+            "ITS Shortest Paths": sps_its
+        }
+
+
+def batch_reaction_features(rsmis, h_max:int = 4, max_distance:int = None, max_paths_per_source:int = None) -> list:
+    """
+    Computes the compressed DRF and ITS feature sets of many reactions at once with the
+    vectorized engine of batch_wl.py. Same features as compute_reaction_features(rsmi, h_max, "compressed").
+
+    Args:
+        rsmis: Sequence of atom-mapped reaction SMILES.
+        h_max (int): Number of WL iterations.
+        max_distance, max_paths_per_source (int): Bound the shortest-path features, see getWL.
+
+    Returns:
+        list[dict[str, set] or None]: Feature sets per column of FEATURE_COLUMNS per reaction,
+            None for reactions that could not be parsed.
+    """
+    groups = []
+    parsed = []
+    for rsmi in rsmis:
+        try:
+            educt_graph, product_graph, its_graph = parse_reaction(rsmi)
+        except Exception as e:
+            print(f"Error parsing reaction {rsmi}: {e}")
+            parsed.append(False)
+            continue
+        # Educt and product form one group so that both stop at the same iteration
+        groups.append([educt_graph, product_graph])
+        groups.append([its_graph])
+        parsed.append(True)
+
+    results = iter(batch_wl(groups, h_max, max_distance=max_distance, max_paths_per_source=max_paths_per_source))
+    features = []
+    for ok in parsed:
+        if not ok:
+            features.append(None)
+            continue
+        (nodes_e, sps_e, edges_e), (nodes_p, sps_p, edges_p) = next(results)
+        [(nodes_its, sps_its, edges_its)] = next(results)
+        features.append({
+            "DRF Nodes": set(np.setxor1d(nodes_e, nodes_p, assume_unique=True).tolist()),
+            "DRF Edges": set(np.setxor1d(edges_e, edges_p, assume_unique=True).tolist()),
+            "DRF Shortest Paths": set(np.setxor1d(sps_e, sps_p, assume_unique=True).tolist()),
+            "ITS Nodes": set(nodes_its.tolist()),
+            "ITS Edges": set(edges_its.tolist()),
+            "ITS Shortest Paths": set(sps_its.tolist())
+        })
+    return features
+
+
+def feature_kind(relabel:str = "string", max_distance:int = None, max_paths_per_source:int = None) -> str:
+    """Returns the feature kind the cache keys WL features by: the relabeling mode and the shortest-path limits."""
+    kind = "wl" if relabel == "string" else f"wl_{relabel}"
+    if max_distance is not None or max_paths_per_source is not None:
+        kind += f"_d{max_distance}_p{max_paths_per_source}"
+    return kind
 
-    # Write to Excel
-    df.to_excel("pre-computed-feature_sets.xlsx", index=False)
+
+def featurization_settings(h_max:int = 4, relabel:str = "string", max_distance:int = None, max_paths_per_source:int = None) -> dict:
+    """Returns the featurization settings recorded in a precomputed store, see feature_store.featurization_settings."""
+    return {"h_max": h_max, "relabel": relabel, "max_distance": max_distance, "max_paths_per_source": max_paths_per_source}
+
+
+def _featurize_chunk(rsmis, first_row:int, h_max:int, relabel:str, cache, max_distance:int = None, max_paths_per_source:int = None) -> tuple:
+    """
+    Featurizes one chunk of reactions, looking every reaction up in the feature cache first.
+
+    Returns:
+        tuple[list[dict], int]: Feature sets per reaction (empty sets for failed reactions) and the number of failed reactions.
+    """
+    kind = feature_kind(relabel, max_distance, max_paths_per_source)
+    batched = {}
+    if relabel == "compressed":
+        # Cache misses of the chunk are featurized together by the batched engine
+        missing = [rsmi for rsmi in rsmis if cache.get(rsmi, kind, h_max) is None]
+        batched = dict(zip(missing, batch_reaction_features(missing, h_max, max_distance, max_paths_per_source)))
+        # Only the lookups below count towards the cache statistics
+        cache.hits = cache.misses = 0
+    features = []
+    errors = 0
+    for offset, rsmi in enumerate(rsmis):
+        # Known reactions (earlier runs or duplicates) are looked up instead of recomputed
+        value = cache.get(rsmi, kind, h_max)
+        if value is None:
+            # Reactions the batch failed on are recomputed alone to report their error. Only featurization
+            # errors mark a reaction as failed, cache and IO errors are raised
+            try:
+                value = batched.get(rsmi) or compute_reaction_features(rsmi, h_max, relabel, max_distance, max_paths_per_source)
+            except Exception as e:
+                print(f"Error processing reaction {first_row + offset}: {type(e).__name__}: {e}")
+                features.append({name: set() for name in FEATURE_COLUMNS})
+                errors += 1
+                continue
+            cache.put(rsmi, kind, value, h_max)
+        features.append(value)
+    return features, errors
+
+
+def _stream_chunk(chunk, h_max:int, relabel:str, cache_path:str, max_distance:int = None, max_paths_per_source:int = None) -> tuple:
+    """Worker of stream_precompute_features: returns the class labels and feature sets of one (first row, SMILES, classes) chunk."""
+    first_row, rsmis, rxn_classes = chunk
+    with FeatureCache(cache_path) as cache:
+        features, _ = _featurize_chunk(rsmis, first_row, h_max, relabel, cache, max_distance, max_paths_per_source)
+    return rxn_classes, features
+
+
+def stream_precompute_features(tsv_path:str, out_dir:str, h_max:int = 4, processes:int = None, chunk_size:int = 500, shard_size:int = 10000, cache_path:str = DEFAULT_CACHE, relabel:str = "string", minhash:dict = None,
+                               max_distance:int = None, max_paths_per_source:int = None) -> dict:
+    """
+    Featurizes a reaction TSV with bounded memory and writes a sharded feature store.
+
+    The TSV is read in chunks of chunk_size, the chunks are featurized on a process pool
+    with a bounded number of chunks in flight, and the rows are written in shards of
+    shard_size as soon as they are complete (see feature_pipeline.py). Peak memory does
+    not grow with the number of reactions.
+
+    Args:
+        tsv_path (str): TSV with 'clean_rxn' and 'rxn_class' columns.
+        out_dir (str): Directory of the sharded store.
+        h_max (int): Number of WL iterations.
+        processes (int): Number of worker processes, os.cpu_count() if None.
+        chunk_size (int): Number of reactions per worker task.
+        shard_size (int): Number of reactions per shard.
+        cache_path (str): Sqlite file of the feature cache.
+        relabel (str): WL relabeling mode, see getWL.
+        minhash (dict): Optional MinHash settings (num_perm, bits, seed), the signatures of
+            every column are stored next to the exact features (see minhash.py).
+        max_distance, max_paths_per_source (int): Bound the shortest-path features, see getWL.
+
+    Returns:
+        dict: The manifest of the written store.
+    """
+    # Create the cache table once before the workers open the file concurrently
+    FeatureCache(cache_path).close()
+    worker = partial(_stream_chunk, h_max=h_max, relabel=relabel, cache_path=cache_path, max_distance=max_distance, max_paths_per_source=max_paths_per_source)
+    chunks = read_reaction_chunks(tsv_path, chunk_size)
+    return write_shards(iter_rows(map_chunks(worker, chunks, processes)), out_dir, FEATURE_COLUMNS, shard_size, minhash=minhash,
+                        featurization=featurization_settings(h_max, relabel, max_distance, max_paths_per_source))
+
+
+if __name__ == "__main__":
+    # For each SMILES execute the WL algorithm in parallel and stream the features into the sharded store
+    # read by the experiment scripts
+    stream_precompute_features("schneider50k_clean.tsv", DEFAULT_STORE, h_max=4)
@@ -0,0 +1,196 @@
+"""Batched, vectorized WL refinement over many graphs at once.
+
+All graphs of a batch are packed into one disjoint union in array form. Each WL iteration then
+runs as a handful of NumPy operations over the whole batch instead of one Python-level
+getWL call per graph:
+    - new labels: order-independent aggregation of the neighbor labels with np.add.at,
+    - early stopping: distinct labels per group via one lexsort,
+    - edge and shortest-path features: vectorized over all edges and all BFS-tree entries.
+The features are split back per graph at the end.
+
+The labels and features are exactly those of WL_algorithm.getWL_compressed_joint (see
+wl_labels.py for the shared label function). Graphs are refined in groups: all graphs of a
+group stop at the same iteration, e.g. the educt and product graph of one reaction.
+"""
+import numpy as np
+from compact_graph import as_compact_graph
+from shortest_paths import ShortestPathForest, mix64
+from feature_ids import get_hash
+from wl_labels import _NODE_TAG, _EDGE_TAG
+from instrumentation import stage, count
+
+_NODE_TAG64 = np.uint64(_NODE_TAG)
+_EDGE_TAG64 = np.uint64(_EDGE_TAG)
+
+
+class GraphBatch:
+    """
+    Disjoint union of many CompactGraphs in array form.
+
+    Node i of the batch belongs to graph graph_of_node[i], graph g belongs to group group_of_graph[g].
+    """
+    __slots__ = ('n_graphs', 'n_groups', 'graph_of_node', 'group_of_graph', 'initial_labels',
+                 'owner', 'neighbor', 'edge_u', 'edge_v', 'edge_orders', 'forest')
+
+    def __init__(self, groups, shortest_paths:bool = True, max_distance:int = None, max_paths_per_source:int = None):
+        """
+        Args:
+            groups: List of groups, each a list of networkx graphs or CompactGraphs.
+            shortest_paths: Also build the BFS trees needed for shortest-path features.
+            max_distance, max_paths_per_source: Limits of the BFS trees, see shortest_paths.ShortestPathForest.
+        """
+        graphs = []
+        group_of_graph = []
+        for group_index, group in enumerate(groups):
+            for graph in group:
+                graphs.append(as_compact_graph(graph))
+                group_of_graph.append(group_index)
+
+        self.n_graphs = len(graphs)
+        self.n_groups = len(groups)
+        self.group_of_graph = np.asarray(group_of_graph, dtype=np.int64)
+        sizes = np.asarray([g.number_of_nodes() for g in graphs], dtype=np.int64)
+        node_offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        self.graph_of_node = np.repeat(np.arange(self.n_graphs, dtype=np.int64), sizes)
+
+        # Initial labels: the code of the element symbol, hashed once per distinct element
+        codes = {}
+        initial = []
+        for graph in graphs:
+            for element in graph.element_symbols():
+                code = codes.get(element)
+                if code is None:
+                    code = codes[element] = get_hash(str(element))
+                initial.append(code)
+        self.initial_labels = np.asarray(initial, dtype=np.uint64)
+
+        # Directed adjacency of the union: neighbor[k] is a neighbor of owner[k]
+        self.owner = np.concatenate([np.repeat(np.arange(g.number_of_nodes(), dtype=np.int64), np.diff(g.indptr)) + node_offsets[i] for i, g in enumerate(graphs)] or [np.empty(0, dtype=np.int64)])
+        self.neighbor = np.concatenate([g.indices.astype(np.int64) + node_offsets[i] for i, g in enumerate(graphs)] or [np.empty(0, dtype=np.int64)])
+
+        # Edges with the code of their bond order
+        order_codes = {}
+        edge_u, edge_v, edge_orders = [], [], []
+        for i, graph in enumerate(graphs):
+            edge_u.append(graph.edge_u.astype(np.int64) + node_offsets[i])
+            edge_v.append(graph.edge_v.astype(np.int64) + node_offsets[i])
+            for _, _, order in graph.edges():
+                code = order_codes.get(order)
+                if code is None:
+                    code = order_codes[order] = get_hash(str(order))
+                edge_orders.append(code)
+        self.edge_u = np.concatenate(edge_u or [np.empty(0, dtype=np.int64)])
+        self.edge_v = np.concatenate(edge_v or [np.empty(0, dtype=np.int64)])
+        self.edge_orders = np.asarray(edge_orders, dtype=np.uint64)
+
+        self.forest = None
+        if shortest_paths:
+            with stage("apsp"):
+                self.forest = ShortestPathForest.merge([ShortestPathForest(g, max_distance, max_paths_per_source) for g in graphs])
+
+    def refine(self, labels):
+        """One WL iteration for all nodes of the batch, see wl_labels.signature_label."""
+        aggregate = mix64(labels ^ _NODE_TAG64)
+        np.add.at(aggregate, self.owner, mix64(labels[self.neighbor]))
+        return mix64(aggregate)
+
+    def edge_features(self, labels):
+        """Edge feature of every edge of the batch, see wl_labels.edge_label."""
+        a = labels[self.edge_u]
+        b = labels[self.edge_v]
+        low = np.minimum(a, b)
+        high = np.maximum(a, b)
+        return mix64(mix64(mix64(low ^ _EDGE_TAG64) + self.edge_orders) + high)
+
+    def distinct_labels_per_group(self, labels):
+        """Number of distinct labels in every group."""
+        group_of_node = self.group_of_graph[self.graph_of_node]
+        order = np.lexsort((labels, group_of_node))
+        groups = group_of_node[order]
+        sorted_labels = labels[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (groups[1:] != groups[:-1]) | (sorted_labels[1:] != sorted_labels[:-1])
+        return np.bincount(groups[first], minlength=self.n_groups)
+
+
+def _split_per_graph(graph_ids, features, n_graphs):
+    # Sorted, duplicate-free uint64 feature array per graph
+    if len(features) == 0:
+        return [np.empty(0, dtype=np.uint64) for _ in range(n_graphs)]
+    order = np.lexsort((features, graph_ids))
+    graph_ids = graph_ids[order]
+    features = features[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = (graph_ids[1:] != graph_ids[:-1]) | (features[1:] != features[:-1])
+    graph_ids = graph_ids[keep]
+    features = features[keep]
+    bounds = np.searchsorted(graph_ids, np.arange(n_graphs + 1))
+    return [features[bounds[g]:bounds[g + 1]] for g in range(n_graphs)]
+
+
+def batch_wl(groups, h_max:int, early_stop:bool = True, shortest_paths:bool = True, max_distance:int = None, max_paths_per_source:int = None):
+    """
+    Compressed WL features for many graphs at once.
+
+    Args:
+        groups: List of groups, each a list of networkx graphs or CompactGraphs. All graphs of a
+            group stop at the same iteration (refine educt and product of a reaction as one group).
+        h_max (int): Maximum number of WL iterations.
+        early_stop (bool): Stop a group once its joint label partition no longer changes.
+        shortest_paths (bool): Also compute the shortest-path features.
+        max_distance, max_paths_per_source: Bound the shortest-path features, see shortest_paths.ShortestPathForest.
+
+    Returns:
+        list[list[tuple[np.ndarray, np.ndarray, np.ndarray]]]: Per group and graph the node, shortest-path
+            and edge features as sorted uint64 arrays, the same sets as getWL_compressed_joint returns.
+    """
+    batch = GraphBatch(groups, shortest_paths=shortest_paths, max_distance=max_distance, max_paths_per_source=max_paths_per_source)
+    labels = batch.initial_labels
+    group_of_node = batch.group_of_graph[batch.graph_of_node]
+    group_of_edge = group_of_node[batch.edge_u]
+    active = np.ones(batch.n_groups, dtype=bool)
+
+    node_graphs, node_features = [batch.graph_of_node], [labels]
+    edge_graphs, edge_features = [], []
+    path_graphs, path_features = [], []
+    for h in range(h_max+1):
+        count("wl_iterations")
+        with stage("wl_iteration"):
+            edges = active[group_of_edge]
+            edge_graphs.append(batch.graph_of_node[batch.edge_u[edges]])
+            edge_features.append(batch.edge_features(labels)[edges])
+            if shortest_paths:
+                sources, features = batch.forest.feature_arrays(labels, include_distance=True)
+                keep = active[group_of_node[sources]]
+                path_graphs.append(batch.graph_of_node[sources[keep]])
+                path_features.append(features[keep])
+
+            if h == h_max:
+                break
+            new_labels = batch.refine(labels)
+            if early_stop:
+                # Refinement never merges classes, an unchanged number of distinct labels means a stable partition
+                stable = batch.distinct_labels_per_group(new_labels) == batch.distinct_labels_per_group(labels)
+                active &= ~stable
+                if not active.any():
+                    break
+            # Stopped groups keep their labels and emit no further features
+            moving = active[group_of_node]
+            labels = np.where(moving, new_labels, labels)
+            node_graphs.append(batch.graph_of_node[moving])
+            node_features.append(labels[moving])
+
+    empty = np.empty(0, dtype=np.int64)
+    nodes = _split_per_graph(np.concatenate(node_graphs), np.concatenate(node_features), batch.n_graphs)
+    edges = _split_per_graph(np.concatenate(edge_graphs or [empty]), np.concatenate(edge_features or [empty.astype(np.uint64)]), batch.n_graphs)
+    if shortest_paths:
+        paths = _split_per_graph(np.concatenate(path_graphs), np.concatenate(path_features), batch.n_graphs)
+    else:
+        paths = [np.empty(0, dtype=np.uint64) for _ in range(batch.n_graphs)]
+
+    results = []
+    graph = 0
+    for group in groups:
+        results.append([(nodes[graph + i], paths[graph + i], edges[graph + i]) for i in range(len(group))])
+        graph += len(group)
+    return results
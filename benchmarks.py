@@ -0,0 +1,237 @@
+"""Micro-benchmarks of the feature extraction and kernel hot paths.
+
+Every operation runs on a fixed set of real reactions, on generated molecules of growing
+size (10 to 500 atoms) and, for the kernel, on feature blocks of growing size. For each case
+the time per call (best of several repeats) and the peak memory of one call (tracemalloc)
+are recorded and compared against a stored baseline. The run fails (exit code 1) as soon as
+one case got slower than the baseline by more than the threshold, or its peak memory grew by
+more than the memory threshold.
+
+All inputs are generated with fixed seeds, no network access or data files are needed.
+
+Usage:
+    python benchmarks.py --save-baseline        # record the baseline of this machine
+    python benchmarks.py                        # compare against it
+    python benchmarks.py --quick --filter getWL # small sizes only, matching cases only
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+import networkx as nx
+import numpy as np
+
+DEFAULT_BASELINE = "benchmark_baseline.json"
+# Relative slowdown and relative peak memory growth per case that count as a regression
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_MEMORY_THRESHOLD = 0.25
+MOLECULE_SIZES = [10, 50, 100, 250, 500]
+KERNEL_SIZES = [100, 500, 2000]
+QUICK_MOLECULE_SIZES = [10, 50]
+QUICK_KERNEL_SIZES = [100]
+# Hop limit of the bounded shortest-path cases (see shortest_paths.ShortestPathForest)
+BOUNDED_DISTANCE = 4
+
+REACTIONS = [
+    '[CH3:1][CH:2]=[O:3].[CH:4]([H:7])([H:8])[CH:5]=[O:6]>>[CH3:1][CH:2]=[CH:4][CH:5]=[O:6].[O:3]([H:7])([H:8])',
+    '[CH3:17][S:14](=[O:15])(=[O:16])[N:11]1[CH2:10][CH2:9][N:8](Cc2ccccc2)[CH2:13][CH2:12]1>>[CH3:17][S:14](=[O:15])(=[O:16])[N:11]1[CH2:10][CH2:9][NH:8][CH2:13][CH2:12]1',
+    '[CH3:1][c:2]1[cH:3][cH:4][c:5]([OH:6])[cH:7][cH:8]1.[Cl:9][CH2:10][c:11]1[cH:12][cH:13][cH:14][cH:15][cH:16]1>>[CH3:1][c:2]1[cH:3][cH:4][c:5]([O:6][CH2:10][c:11]2[cH:12][cH:13][cH:14][cH:15][cH:16]2)[cH:7][cH:8]1.[Cl:9][H]',
+    '[CH3:1][O:2][C:3](=[O:4])[c:5]1[cH:6][cH:7][c:8]([N+:9](=[O:10])[O-:11])[cH:12][cH:13]1.[OH2:14]>>[CH3:1][OH:2].[OH:14][C:3](=[O:4])[c:5]1[cH:6][cH:7][c:8]([N+:9](=[O:10])[O-:11])[cH:12][cH:13]1',
+]
+
+
+def generate_molecule(n_atoms:int, seed:int = 0) -> nx.Graph:
+    """
+    Generates a connected molecule-like graph with the node and edge attributes of synkit graphs.
+
+    A random tree of atoms with valence at most 4, plus about one ring closure per ten atoms.
+    """
+    rng = random.Random(seed)
+    graph = nx.Graph()
+    elements = ['C'] * 7 + ['N', 'O', 'S']
+    for atom in range(1, n_atoms + 1):
+        graph.add_node(atom, element=rng.choice(elements))
+        candidates = [n for n in range(max(1, atom - 8), atom) if graph.degree(n) < 4]
+        if candidates:
+            graph.add_edge(rng.choice(candidates), atom, order=rng.choice([1.0, 1.0, 1.0, 1.5, 2.0]))
+    for _ in range(n_atoms // 10):
+        u, v = rng.sample(range(1, n_atoms + 1), 2)
+        if not graph.has_edge(u, v) and graph.degree(u) < 4 and graph.degree(v) < 4:
+            graph.add_edge(u, v, order=1.0)
+    return graph
+
+
+def generate_reaction(n_atoms:int, seed:int = 0):
+    """Returns an (educt, product) pair of generated molecules where the product has one bond broken and one bond formed."""
+    educt = generate_molecule(n_atoms, seed)
+    product = educt.copy()
+    rng = random.Random(seed + 1)
+    u, v = rng.choice(list(product.edges()))
+    product.remove_edge(u, v)
+    a, b = rng.sample(list(product.nodes()), 2)
+    product.add_edge(a, b, order=1.0)
+    return educt, product
+
+
+def generate_feature_block(n_rows:int, seed:int = 0, features_per_row:int = 60, vocabulary:int = 20000):
+    """Returns n_rows feature sets as sorted uint64 arrays (feature-store layout)."""
+    rng = np.random.default_rng(seed)
+    rows = np.empty(n_rows, dtype=object)
+    for i in range(n_rows):
+        rows[i] = np.unique(rng.integers(0, vocabulary, features_per_row).astype(np.uint64))
+    return rows
+
+
+def build_cases(quick:bool = False) -> list:
+    """Returns the benchmark cases as (name, function without arguments) pairs."""
+    # Imported here, so that --help does not pay for synkit. Logging output is not part of the measurement
+    from synkit.IO import rsmi_to_graph, rsmi_to_its
+    from synkit.Graph.ITS import ITSConstruction
+    import WL_algorithm
+    import phi_transformation
+    import drf_implementation
+    from reaction_center import localized_drf
+    from kernels import intersection_kernel
+    logging.disable(logging.CRITICAL)
+
+    molecule_sizes = QUICK_MOLECULE_SIZES if quick else MOLECULE_SIZES
+    kernel_sizes = QUICK_KERNEL_SIZES if quick else KERNEL_SIZES
+
+    inputs = []
+    for i, rsmi in enumerate(REACTIONS):
+        educt, product = rsmi_to_graph(rsmi)
+        inputs.append((f"reaction{i}", educt, product, rsmi_to_its(rsmi)))
+    for n_atoms in molecule_sizes:
+        educt, product = generate_reaction(n_atoms, seed=n_atoms)
+        inputs.append((f"generated{n_atoms}", educt, product, None))
+
+    cases = []
+    for label, educt, product, its in inputs:
+        for relabel in ("string", "compressed"):
+            cases.append((f"getWL[{relabel}]/{label}", lambda g=educt, r=relabel: WL_algorithm.getWL(g, 4, r)))
+        cases.append((f"phi_vertex_dict_graph/{label}", lambda g=educt: phi_transformation.phi_vertex_dict_graph(g)))
+        cases.append((f"phi_edge_graph/{label}", lambda g=educt: phi_transformation.phi_edge_graph(g)))
+        cases.append((f"phi_shortest_path_graph/{label}", lambda g=educt: phi_transformation.phi_shortest_path_graph(g)))
+        cases.append((f"getWL[string,d{BOUNDED_DISTANCE}]/{label}", lambda g=educt: WL_algorithm.getWL(g, 4, max_distance=BOUNDED_DISTANCE)))
+        cases.append((f"phi_shortest_path_graph[d{BOUNDED_DISTANCE}]/{label}", lambda g=educt: phi_transformation.phi_shortest_path_graph(g, max_distance=BOUNDED_DISTANCE)))
+        cases.append((f"vertex_drf_graph/{label}", lambda e=educt, p=product: drf_implementation.vertex_drf_graph(e, p)))
+        cases.append((f"edge_drf_graph/{label}", lambda e=educt, p=product: drf_implementation.edge_drf_graph(e, p)))
+        cases.append((f"shortest_path_drf_graph/{label}", lambda e=educt, p=product: drf_implementation.shortest_path_drf_graph(e, p)))
+        # localized_drf replaces getWL on both the educt and the product graph
+        center_its = its if its is not None else ITSConstruction().ITSGraph(educt, product)
+        cases.append((f"localized_drf[string]/{label}", lambda e=educt, p=product, t=center_its: localized_drf(e, p, t, 4)))
+        if its is not None:
+            cases.append((f"reaction_features_graph/{label}", lambda e=educt, p=product, t=its: drf_implementation.reaction_features_graph(e, p, t)))
+
+    # my_kernel in svm_dummy.py and svm_test.py delegates to intersection_kernel, which is measured directly
+    for n_rows in kernel_sizes:
+        train = generate_feature_block(n_rows, seed=n_rows)
+        test = generate_feature_block(n_rows // 4, seed=n_rows + 1)
+        cases.append((f"my_kernel[fit]/{n_rows}", lambda X=train: intersection_kernel(X, X)))
+        cases.append((f"my_kernel[predict]/{n_rows}", lambda X1=test, X2=train: intersection_kernel(X1, X2)))
+        sets = [set(row.tolist()) for row in train]
+        cases.append((f"my_kernel[sets]/{n_rows}", lambda X=sets: intersection_kernel(X, X)))
+    return cases
+
+
+def measure(func, repeat:int = 5) -> dict:
+    """
+    Returns the best time per call over repeat rounds and the peak memory allocated by one call.
+
+    Each round runs func as often as needed to last at least 0.2 s (timeit autorange).
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        seconds = min(timer.repeat(repeat=repeat, number=number)) / number
+
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {"seconds": seconds, "peak_bytes": peak, "calls": number * repeat}
+
+
+def compare(results:dict, baseline:dict, threshold:float, memory_threshold:float = DEFAULT_MEMORY_THRESHOLD) -> list:
+    """
+    Returns the regressions against the baseline as (case name, metric) pairs: "seconds" for cases slower
+    by more than threshold, "peak_bytes" for cases whose peak memory grew by more than memory_threshold.
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if result["seconds"] > reference["seconds"] * (1 + threshold):
+            regressions.append((name, "seconds"))
+        if result["peak_bytes"] > reference["peak_bytes"] * (1 + memory_threshold):
+            regressions.append((name, "peak_bytes"))
+    return regressions
+
+
+def format_row(name:str, result:dict, reference:dict = None) -> str:
+    row = f"{name:<50} {result['seconds'] * 1e3:>10.3f} ms {result['peak_bytes'] / 1024:>10.1f} KiB"
+    if reference is not None:
+        time_change = result["seconds"] / reference["seconds"] - 1 if reference["seconds"] else 0.0
+        memory_change = result["peak_bytes"] / reference["peak_bytes"] - 1 if reference["peak_bytes"] else 0.0
+        row += f"   time {time_change:+7.1%}   memory {memory_change:+7.1%}"
+    return row
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the feature extraction and kernel hot paths.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed relative slowdown per case, e.g. 0.25")
+    parser.add_argument("--memory-threshold", type=float, default=DEFAULT_MEMORY_THRESHOLD, help="Allowed relative peak memory growth per case")
+    parser.add_argument("--filter", default=None, help="Only run cases whose name contains this string")
+    parser.add_argument("--quick", action="store_true", help="Only the small generated molecules and kernel blocks")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing rounds per case")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    for name, func in build_cases(args.quick):
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(func, args.repeat)
+        print(format_row(name, results[name], baseline.get(name)))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "results": results
+            }, f, indent=2)
+        print(f"Baseline with {len(results)} cases written to {args.baseline}")
+        return 0
+
+    if not baseline:
+        print(f"No baseline at {args.baseline}, run with --save-baseline first")
+        return 0
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+    for name, metric in regressions:
+        if metric == "seconds":
+            print(f"REGRESSION {name}: {results[name]['seconds'] * 1e3:.3f} ms vs {baseline[name]['seconds'] * 1e3:.3f} ms in the baseline")
+        else:
+            print(f"REGRESSION {name}: {results[name]['peak_bytes'] / 1024:.1f} KiB vs {baseline[name]['peak_bytes'] / 1024:.1f} KiB peak memory in the baseline")
+    print(f"{len(results)} cases, {len(regressions)} regressions (threshold {args.threshold:.0%}, memory threshold {args.memory_threshold:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+"""Resident classification service: a trained SVM kept warm, fed with reaction SMILES.
+
+train_model fits SVC(kernel='precomputed') on a kernel spec over a feature store (see
+kernels.parse_kernel_spec) and saves the model together with the features of its support
+vectors, as a small feature store of its own. A ClassificationService loads that once and
+keeps, per feature column, the sparse matrix of the support vectors. Requests are collected
+into micro-batches: every batch is featurized with the existing getWL/DRF code and evaluated
+against the support vectors with one sparse product per column, instead of retraining or
+reloading anything per reaction.
+
+Protocol (stdin or a local TCP socket), one JSON object or bare SMILES per line:
+    {"id": 1, "rsmi": "<reaction SMILES>"}  ->  {"id": 1, "prediction": 7}
+    {"command": "stats"}                    ->  throughput and latency percentiles
+
+Usage:
+    python cli.py train-model data/feature_store --spec "DRF Edges" --out models/drf_edges
+    python cli.py serve models/drf_edges                 # stdin/stdout
+    python cli.py serve models/drf_edges --port 8765     # localhost socket
+"""
+from collections import deque
+from concurrent.futures import Future
+import contextlib
+import json
+import os
+import pickle
+import queue
+import socketserver
+import sys
+import threading
+import time
+import numpy as np
+from feature_store import FEATURE_COLUMNS, write_feature_store, load_feature_dataframe, load_feature_column, featurization_settings, \
+    resolve_featurization
+from feature_index import reaction_feature_dict
+from kernels import parse_kernel_spec, spec_columns, combined_kernel, build_vocabulary, to_sparse_matrix, normalize_intersections, row_sizes
+from vocabulary import Vocabulary, load_or_build_vocabulary, vocabulary_path
+from instrumentation import stage, count
+
+DEFAULT_MAX_BATCH = 32
+# How long the first request of a batch waits for more requests to join it
+DEFAULT_MAX_WAIT = 0.002
+# Number of most recent requests the latency percentiles are computed over
+LATENCY_WINDOW = 10000
+
+
+def train_model(store:str, spec:str, out_dir:str, classes:list = None, reactions_per_class:int = None,
+                h_max:int = None, relabel:str = None, C:float = 1.0, random_state:int = 42, min_df = 1, max_df = None,
+                max_distance:int = None, max_paths_per_source:int = None) -> dict:
+    """
+    Trains SVC(kernel='precomputed') on a kernel spec and saves it with its support-vector features.
+
+    Args:
+        store: Feature store directory with the spec's columns and rxn_class.
+        spec: Kernel spec, e.g. "DRF Edges" or "cosine(DRF Edges) + 0.5*ITS Edges".
+        out_dir: Model directory.
+        classes: Classes to train on, all if None.
+        reactions_per_class: Sample this many reactions per class (see scripts.create_varied_set), all if None.
+        h_max, relabel, max_distance, max_paths_per_source: Featurization settings of the store (see
+            WL_algorithm.getWL), used to featurize requests. Taken from the store, passed values must match
+            it; only needed for stores that record none (see feature_store.featurization_settings).
+        C: SVC regularization.
+        random_state: Seed of the sample.
+        min_df, max_df: Document-frequency pruning of the columns (see vocabulary.Vocabulary.prune), with
+            the frequencies of the whole store. The pruned vocabularies are saved with the model and
+            applied to every request.
+
+    Returns:
+        dict: The saved model metadata.
+
+    Raises:
+        ValueError: If a passed featurization setting differs from the one the store was precomputed with.
+    """
+    from sklearn import svm
+    settings = resolve_featurization(featurization_settings(store), h_max=h_max, relabel=relabel,
+                                     max_distance=max_distance, max_paths_per_source=max_paths_per_source)
+    columns = spec_columns(spec)
+    data = load_feature_dataframe(store, columns=columns)
+    if classes is not None or reactions_per_class:
+        from scripts import create_varied_set
+        classes = classes if classes is not None else sorted(data["rxn_class"].unique().tolist())
+        data = create_varied_set(data, chosen_classes=classes, reactions_per_class=reactions_per_class, random_state=random_state)
+    pruned = (min_df, max_df) != (1, None)
+    # One column of feature sets per feature column of the spec, the input of kernels.combined_kernel
+    X = np.empty((len(data), len(columns)), dtype=object)
+    for j, column in enumerate(columns):
+        if pruned:
+            vocabulary = load_or_build_vocabulary(store, column).prune(min_df, max_df)
+            vocabulary.save(vocabulary_path(out_dir, column))
+            X[:, j] = vocabulary.filter_rows(data[column])
+        else:
+            X[:, j] = data[column].to_numpy()
+    Y = data["rxn_class"].to_numpy()
+
+    clf = svm.SVC(kernel='precomputed', C=C)
+    with stage("fit"):
+        clf.fit(combined_kernel(X, X, parse_kernel_spec(spec)), Y)
+
+    os.makedirs(out_dir, exist_ok=True)
+    support = clf.support_
+    write_feature_store(os.path.join(out_dir, "support"), {column: X[support, j] for j, column in enumerate(columns)}, overwrite=True)
+    with open(os.path.join(out_dir, "model.pkl"), "wb") as f:
+        pickle.dump(clf, f)
+    meta = {
+        "spec": spec, "n_train": len(Y), "n_support": len(support), "classes": clf.classes_.tolist(),
+        "store": store, "min_df": min_df, "max_df": max_df, **settings
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class ClassificationService:
+    """
+    A trained model held in memory that classifies reaction SMILES in micro-batches.
+
+    submit() may be called from any number of threads; one batch thread collects up to
+    max_batch pending requests (waiting at most max_wait seconds for a batch to fill),
+    featurizes them and evaluates them against the support vectors in one go.
+    """
+
+    def __init__(self, model_dir:str, max_batch:int = DEFAULT_MAX_BATCH, max_wait:float = DEFAULT_MAX_WAIT):
+        with open(os.path.join(model_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(model_dir, "model.pkl"), "rb") as f:
+            self.model = pickle.load(f)
+        self.terms = parse_kernel_spec(self.meta["spec"])
+        self.columns = spec_columns(self.meta["spec"])
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        # Pruned vocabularies the model was trained with, requests are mapped through them as well
+        self.vocabularies = {}
+        if (self.meta.get("min_df", 1), self.meta.get("max_df")) != (1, None):
+            self.vocabularies = {column: Vocabulary.load(vocabulary_path(model_dir, column), mmap=False) for column in self.columns}
+
+        # Support-vector side of the kernel, built once: vocabulary, transposed matrix and set sizes per column
+        self.support = {}
+        for column in self.columns:
+            rows = load_feature_column(os.path.join(model_dir, "support"), column, mmap=False).to_object_array()
+            vocabulary = build_vocabulary(rows)
+            self.support[column] = (vocabulary, to_sparse_matrix(rows, vocabulary).T.tocsc(), row_sizes(rows))
+        self._support_index = self.model.support_
+
+        self._queue = queue.Queue()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._batch_sizes = deque(maxlen=LATENCY_WINDOW)
+        self._served = 0
+        self._failed = 0
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def featurize(self, rsmis:list) -> list:
+        """Returns the feature dict (column -> uint64 array) of every reaction, or the exception it raised."""
+        results = self._featurize(rsmis)
+        for column, vocabulary in self.vocabularies.items():
+            ok = [i for i, f in enumerate(results) if not isinstance(f, Exception)]
+            for i, row in zip(ok, vocabulary.filter_rows([results[i][column] for i in ok])):
+                results[i][column] = row
+        return results
+
+    def _featurize(self, rsmis:list) -> list:
+        if self.meta["relabel"] == "compressed" and all(column in FEATURE_COLUMNS for column in self.columns):
+            # Vectorized WL engine for the whole batch (see batch_wl.py)
+            from WL_algorithm import batch_reaction_features
+            results = []
+            for rsmi, features in zip(rsmis, batch_reaction_features(rsmis, self.meta["h_max"], *self._path_limits())):
+                if features is None:
+                    results.append(ValueError(f"Could not parse reaction {rsmi}"))
+                else:
+                    results.append({column: np.unique(np.asarray(list(features[column]), dtype=np.uint64)) for column in self.columns})
+            return results
+        results = []
+        for rsmi in rsmis:
+            try:
+                results.append(reaction_feature_dict(rsmi, self.columns, self.meta["h_max"], self.meta["relabel"], *self._path_limits()))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _path_limits(self) -> tuple:
+        return self.meta.get("max_distance"), self.meta.get("max_paths_per_source")
+
+    def kernel(self, features:list) -> np.ndarray:
+        """
+        Returns the kernel of a batch of feature dicts against the support vectors, in the layout
+        SVC(kernel='precomputed').predict expects: one column per training row, where only the
+        columns of support vectors are read, so all others stay 0.
+        """
+        K = np.zeros((len(features), self.meta["n_train"]), dtype=np.float64)
+        with stage("kernel_build"):
+            for weight, kind, column in self.terms:
+                vocabulary, support_T, support_sizes = self.support[column]
+                rows = [f[column] for f in features]
+                intersections = (to_sparse_matrix(rows, vocabulary) @ support_T).toarray()
+                K[:, self._support_index] += weight * normalize_intersections(intersections, row_sizes(rows), support_sizes, kind)
+        count("kernel_entries", len(features) * len(self._support_index))
+        return K
+
+    def predict(self, rsmis:list) -> list:
+        """Classifies a batch of reactions synchronously, returns a label or an exception per reaction."""
+        with stage("featurize"):
+            features = self.featurize(rsmis)
+        ok = [i for i, f in enumerate(features) if not isinstance(f, Exception)]
+        results = list(features)
+        if ok:
+            with stage("predict"):
+                labels = self.model.predict(self.kernel([features[i] for i in ok]))
+            for i, label in zip(ok, labels):
+                results[i] = label.item() if hasattr(label, "item") else label
+        return results
+
+    def submit(self, rsmi:str) -> Future:
+        """Queues one reaction, the Future resolves to its label (or raises why it failed)."""
+        future = Future()
+        self._queue.put((rsmi, future, time.perf_counter()))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                try:
+                    batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                results = self.predict([rsmi for rsmi, _, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            done = time.perf_counter()
+            with self._lock:
+                self._batch_sizes.append(len(batch))
+                for (_, future, submitted), result in zip(batch, results):
+                    self._latencies.append(done - submitted)
+                    if isinstance(result, Exception):
+                        self._failed += 1
+                        future.set_exception(result)
+                    else:
+                        self._served += 1
+                        future.set_result(result)
+
+    def stats(self) -> dict:
+        """Returns throughput since start and latency percentiles (ms) over the most recent requests."""
+        with self._lock:
+            latencies = np.asarray(self._latencies) * 1e3
+            batch_sizes = np.asarray(self._batch_sizes)
+            served, failed = self._served, self._failed
+        elapsed = time.perf_counter() - self._started
+        stats = {"served": served, "failed": failed, "throughput_per_s": (served + failed) / elapsed if elapsed > 0 else 0.0,
+                 "mean_batch_size": float(batch_sizes.mean()) if len(batch_sizes) else 0.0}
+        for p in (50, 90, 99):
+            stats[f"latency_p{p}_ms"] = float(np.percentile(latencies, p)) if len(latencies) else None
+        return stats
+
+
+def handle_line(service:ClassificationService, line:str):
+    """
+    Parses one protocol line and returns a callable producing the response object, so that the
+    request is already queued (and can share a batch with others) while earlier responses are written.
+    """
+    line = line.strip()
+    try:
+        request = json.loads(line) if line.startswith("{") else {"rsmi": line}
+    except json.JSONDecodeError as e:
+        return lambda: {"error": f"Invalid request: {e}"}
+    if request.get("command") == "stats":
+        return lambda: {"stats": service.stats()}
+    if "rsmi" not in request:
+        return lambda: {"id": request.get("id"), "error": "Request has no 'rsmi'"}
+    future = service.submit(request["rsmi"])
+
+    def response():
+        try:
+            return {"id": request.get("id"), "prediction": future.result()}
+        except Exception as e:
+            return {"id": request.get("id"), "error": str(e)}
+    return response
+
+
+def serve_stdio(service:ClassificationService, stdin = None, stdout = None):
+    """
+    Answers requests from stdin on stdout, in request order, until stdin is closed.
+    Anything else printed meanwhile (e.g. parse errors of the featurization) goes to stderr.
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    pending = queue.Queue()
+
+    def write_responses():
+        while True:
+            response = pending.get()
+            if response is None:
+                return
+            stdout.write(json.dumps(response()) + "\n")
+            stdout.flush()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        writer = threading.Thread(target=write_responses, daemon=True)
+        writer.start()
+        for line in stdin:
+            if line.strip():
+                pending.put(handle_line(service, line))
+        pending.put(None)
+        writer.join()
+
+
+def serve_socket(service:ClassificationService, port:int, host:str = "127.0.0.1"):
+    """Answers requests on a local TCP socket, one thread per connection; all connections share the batches."""
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                line = line.decode("utf-8")
+                if line.strip():
+                    self.wfile.write((json.dumps(handle_line(service, line)()) + "\n").encode("utf-8"))
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer((host, port), Handler) as server:
+        print(f"Serving {service.meta['spec']} on {host}:{port}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
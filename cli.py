@@ -0,0 +1,215 @@
+"""Command-line entry point for the precompute and experiment stages.
+
+    python cli.py precompute schneider50k_clean.tsv --out data/feature_store --relabel compressed
+    python cli.py convert data/pre-computed-feature_sets_part_*.xlsx --rxn-classes schneider50k.tsv
+    python cli.py experiment --feature-sets "DRF Edges" "cosine(DRF Edges) + 0.5*ITS Shortest Paths" --classes 2 5 --mode linear
+    python cli.py sketch data/feature_store --permutations 256 --bits 8
+    python cli.py search data/feature_store "DRF Edges" --rsmi "<reaction SMILES>" -k 10
+    python cli.py vocabulary data/feature_store --min-df 2
+    python cli.py train-model data/feature_store --spec "DRF Edges" --out models/drf_edges
+    python cli.py serve models/drf_edges --port 8765
+    python cli.py benchmark --quick
+
+Every stage imports its modules only when it runs, so `python cli.py --help` and pool
+workers start without loading synkit or sklearn.
+"""
+import argparse
+import sys
+
+
+def precompute(args):
+    from WL_algorithm import stream_precompute_features
+    manifest = stream_precompute_features(
+        args.tsv, args.out, h_max=args.h_max, processes=args.processes, chunk_size=args.chunk_size,
+        shard_size=args.shard_size, cache_path=args.cache, relabel=args.relabel, minhash=minhash_settings(args),
+        max_distance=args.max_distance, max_paths_per_source=args.max_paths_per_source
+    )
+    print(f"Wrote {manifest['n_rows']} reactions in {len(manifest['shards'])} shards to {args.out}")
+
+
+def minhash_settings(args):
+    if not args.minhash_permutations:
+        return None
+    return {"num_perm": args.minhash_permutations, "bits": args.minhash_bits}
+
+
+def sketch(args):
+    from feature_store import sketch_feature_store
+    sketch_feature_store(args.store, {"num_perm": args.permutations, "bits": args.bits}, columns=args.columns)
+    print(f"Wrote {args.permutations} MinHash signatures per row to {args.store}")
+
+
+def convert(args):
+    from feature_store import convert_excel_parts
+    convert_excel_parts(args.sources, args.out, args.rxn_classes)
+
+
+def experiment(args):
+    import svm_dummy
+    results = svm_dummy.main(
+        feature_sets=args.feature_sets, class_settings=args.classes, reaction_settings=args.reactions,
+        mode=args.mode, processes=args.processes, store=args.store, output=args.output, instrument=args.instrument,
+        min_df=df_threshold(args.min_df), max_df=df_threshold(args.max_df)
+    )
+    print(f"Wrote {len(results)} result rows to {args.output}")
+
+
+def df_threshold(value):
+    # Document-frequency thresholds are counts, or fractions of the reactions if below 1
+    return int(value) if value is not None and value >= 1 else value
+
+
+def vocabulary(args):
+    import json
+    from feature_store import store_columns
+    from vocabulary import load_or_build_vocabulary, vocabulary_summary
+    for column in args.columns or store_columns(args.store):
+        summary = vocabulary_summary(load_or_build_vocabulary(args.store, column), df_threshold(args.min_df), df_threshold(args.max_df))
+        print(f"{column}\t{json.dumps(summary)}")
+
+
+def search(args):
+    from feature_index import load_or_build_index, search_reaction
+    from feature_store import load_feature_column
+    # The query is featurized with the settings recorded in the store, passed settings are only checked
+    index = load_or_build_index(args.store, args.column, h_max=args.h_max, relabel=args.relabel,
+                                max_distance=args.max_distance, max_paths_per_source=args.max_paths_per_source)
+    max_df = df_threshold(args.max_df)
+    if args.rsmi is not None:
+        rows, scores = search_reaction(index, args.rsmi, args.column, args.k, max_df, args.kind, args.h_max, args.relabel,
+                                       args.max_distance, args.max_paths_per_source)
+    else:
+        rows, scores = index.query(load_feature_column(args.store, args.column)[args.row], args.k, max_df, args.kind, exclude=args.row)
+    for row, score in zip(rows, scores):
+        print(f"{row}\t{score:g}")
+
+
+def train_model(args):
+    from classification_service import train_model
+    meta = train_model(args.store, args.spec, args.out, classes=args.classes, reactions_per_class=args.reactions_per_class,
+                       h_max=args.h_max, relabel=args.relabel, C=args.C, min_df=df_threshold(args.min_df), max_df=df_threshold(args.max_df),
+                       max_distance=args.max_distance, max_paths_per_source=args.max_paths_per_source)
+    print(f"Trained on {meta['n_train']} reactions, {meta['n_support']} support vectors, saved to {args.out}")
+
+
+def serve(args):
+    import json
+    from classification_service import ClassificationService, serve_stdio, serve_socket
+    service = ClassificationService(args.model, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000)
+    if args.port is None:
+        serve_stdio(service)
+    else:
+        serve_socket(service, args.port)
+    print(json.dumps(service.stats()), file=sys.stderr)
+
+
+def benchmark(args):
+    import benchmarks
+    return benchmarks.main(args.benchmark_args)
+
+
+def add_path_limit_arguments(p):
+    p.add_argument("--max-distance", type=int, default=None, help="Only shortest-path features of pairs up to this many hops apart")
+    p.add_argument("--max-paths-per-source", type=int, default=None, help="Only shortest-path features to the nearest this many atoms per atom (whole BFS levels)")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    # Defaults mirror the module constants, which are not imported here to keep start-up fast
+    parser = argparse.ArgumentParser(description="Reaction feature precomputation and SVM experiments.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("precompute", help="Featurize a reaction TSV into a sharded feature store")
+    p.add_argument("tsv", help="TSV with 'clean_rxn' and 'rxn_class' columns")
+    p.add_argument("--out", default="data/feature_store", help="Target store directory")
+    p.add_argument("--h-max", type=int, default=4, help="Number of WL iterations")
+    p.add_argument("--relabel", choices=["string", "compressed"], default="string", help="WL relabeling mode")
+    p.add_argument("--processes", type=int, default=None, help="Worker processes (default: all cores)")
+    p.add_argument("--chunk-size", type=int, default=500, help="Reactions per worker task")
+    p.add_argument("--shard-size", type=int, default=10000, help="Reactions per shard")
+    p.add_argument("--cache", default="data/feature_cache.sqlite", help="Feature cache file")
+    p.add_argument("--minhash-permutations", type=int, default=None, help="Also store MinHash signatures of this length")
+    p.add_argument("--minhash-bits", type=int, default=None, help="Keep only the lowest bits of every minimum (b-bit MinHash), below 8 packed and permutations a multiple of 8")
+    add_path_limit_arguments(p)
+    p.set_defaults(func=precompute)
+
+    p = commands.add_parser("convert", help="Convert Excel feature files into a feature store")
+    p.add_argument("sources", nargs="+", help="Excel files, concatenated in the given order")
+    p.add_argument("--out", default="data/feature_store", help="Target store directory")
+    p.add_argument("--rxn-classes", default=None, help="TSV with a 'rxn_class' column if the Excel files have none")
+    p.set_defaults(func=convert)
+
+    p = commands.add_parser("sketch", help="Add MinHash signatures to an existing feature store")
+    p.add_argument("store", help="Feature store directory")
+    p.add_argument("--permutations", type=int, default=128, help="Signature length")
+    p.add_argument("--bits", type=int, default=None, help="Keep only the lowest bits of every minimum (b-bit MinHash), below 8 packed and permutations a multiple of 8")
+    p.add_argument("--columns", nargs="+", default=None, help="Feature columns (default: all)")
+    p.set_defaults(func=sketch)
+
+    p = commands.add_parser("experiment", help="Run the SVM experiment sweep")
+    p.add_argument("--feature-sets", nargs="+", default=["DRF Edges"], help="Kernel specs, e.g. \"DRF Edges\" or \"cosine(DRF Edges) + 0.5*tanimoto(ITS Edges)\"")
+    p.add_argument("--classes", nargs="+", type=int, default=[2], help="Numbers of classes per experiment")
+    p.add_argument("--reactions", nargs="+", type=int, default=[50], help="Reactions per class")
+    p.add_argument("--mode", choices=["kernel", "precomputed", "linear", "sgd", "minhash"], default="precomputed", help="Training mode")
+    p.add_argument("--processes", type=int, default=None, help="Worker processes (default: all cores)")
+    p.add_argument("--store", default="data/feature_store", help="Feature store directory")
+    p.add_argument("--output", default="svm_experiment_results.xlsx", help="Result file")
+    p.add_argument("--instrument", action="store_true", help="Collect and print per-stage timers")
+    p.add_argument("--min-df", type=float, default=1, help="Drop features in fewer reactions than this (count, or fraction if < 1)")
+    p.add_argument("--max-df", type=float, default=None, help="Drop features in more reactions than this (count, or fraction if < 1)")
+    p.set_defaults(func=experiment)
+
+    p = commands.add_parser("vocabulary", help="Build the feature vocabularies of a store and report document-frequency pruning")
+    p.add_argument("store", help="Feature store directory, the vocabularies are saved there")
+    p.add_argument("--columns", nargs="+", default=None, help="Feature columns (default: all)")
+    p.add_argument("--min-df", type=float, default=1, help="Minimum document frequency (count, or fraction if < 1)")
+    p.add_argument("--max-df", type=float, default=None, help="Maximum document frequency (count, or fraction if < 1)")
+    p.set_defaults(func=vocabulary)
+
+    p = commands.add_parser("search", help="Top-k most similar reactions of a query in a store column")
+    p.add_argument("store", help="Feature store directory, the index is built there on first use")
+    p.add_argument("column", help="Feature column, e.g. 'DRF Edges'")
+    query = p.add_mutually_exclusive_group(required=True)
+    query.add_argument("--rsmi", help="Reaction SMILES of the query")
+    query.add_argument("--row", type=int, help="Row of the store to use as query")
+    p.add_argument("-k", type=int, default=10, help="Number of reactions to return")
+    p.add_argument("--max-df", type=float, default=None, help="Skip features in more reactions than this (count, or fraction if < 1)")
+    p.add_argument("--kind", choices=["intersection", "cosine", "tanimoto"], default="intersection", help="Kernel of the scores")
+    p.add_argument("--h-max", type=int, default=None, help="WL iterations used by the precomputation (default: as recorded in the store)")
+    p.add_argument("--relabel", choices=["string", "compressed"], default=None, help="WL relabeling mode used by the precomputation (default: as recorded in the store)")
+    add_path_limit_arguments(p)
+    p.set_defaults(func=search)
+
+    p = commands.add_parser("train-model", help="Train an SVM on a kernel spec and save it for serving")
+    p.add_argument("store", help="Feature store directory")
+    p.add_argument("--spec", default="DRF Edges", help="Kernel spec")
+    p.add_argument("--out", required=True, help="Model directory")
+    p.add_argument("--classes", nargs="+", type=int, default=None, help="Classes to train on (default: all)")
+    p.add_argument("--reactions-per-class", type=int, default=None, help="Sample this many reactions per class (default: all)")
+    p.add_argument("--h-max", type=int, default=None, help="WL iterations used by the precomputation (default: as recorded in the store)")
+    p.add_argument("--relabel", choices=["string", "compressed"], default=None, help="WL relabeling mode used by the precomputation (default: as recorded in the store)")
+    p.add_argument("--C", type=float, default=1.0, help="SVC regularization")
+    p.add_argument("--min-df", type=float, default=1, help="Drop features in fewer reactions than this (count, or fraction if < 1)")
+    p.add_argument("--max-df", type=float, default=None, help="Drop features in more reactions than this (count, or fraction if < 1)")
+    add_path_limit_arguments(p)
+    p.set_defaults(func=train_model)
+
+    p = commands.add_parser("serve", help="Classify reaction SMILES from stdin or a local socket with a trained model")
+    p.add_argument("model", help="Model directory written by train-model")
+    p.add_argument("--port", type=int, default=None, help="Listen on 127.0.0.1:PORT instead of stdin/stdout")
+    p.add_argument("--max-batch", type=int, default=32, help="Maximum requests per micro-batch")
+    p.add_argument("--max-wait-ms", type=float, default=2.0, help="How long a batch waits to fill")
+    p.set_defaults(func=serve)
+
+    p = commands.add_parser("benchmark", help="Run benchmarks.py, remaining arguments are passed on")
+    p.add_argument("benchmark_args", nargs=argparse.REMAINDER)
+    p.set_defaults(func=benchmark)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""Array-backed molecular graph for the feature hot loops.
+
+synkit returns networkx graphs, where every neighbor lookup and attribute access goes through
+dict-of-dict indirection. CompactGraph is built once per graph and keeps:
+    - the node ids (atom maps) in networkx node order,
+    - integer element codes per node,
+    - CSR adjacency (indptr, indices) in networkx neighbor order,
+    - the edge list in networkx edge order with integer bond-order codes.
+Keeping the networkx orders means every feature extractor produces exactly the same
+features on a CompactGraph as on the networkx graph it was built from.
+
+Element symbols and bond orders (floats, or tuples of floats for ITS graphs) are interned in
+module-wide tables, so the codes are consistent between all graphs of a process.
+"""
+from collections import deque
+import numpy as np
+
+# Interned element symbols and bond orders: value -> code and code -> value
+_ELEMENT_CODES = {}
+_ELEMENTS = []
+_ORDER_CODES = {}
+_ORDERS = []
+
+
+def element_code(element) -> int:
+    code = _ELEMENT_CODES.get(element)
+    if code is None:
+        code = _ELEMENT_CODES[element] = len(_ELEMENTS)
+        _ELEMENTS.append(element)
+    return code
+
+
+def order_code(order) -> int:
+    code = _ORDER_CODES.get(order)
+    if code is None:
+        code = _ORDER_CODES[order] = len(_ORDERS)
+        _ORDERS.append(order)
+    return code
+
+
+class CompactGraph:
+    """
+    Immutable molecular graph in CSR layout. Nodes are addressed by their position 0..n-1,
+    node_ids maps positions back to the networkx node ids.
+    """
+    __slots__ = ('node_ids', 'elements', 'indptr', 'indices', 'edge_u', 'edge_v', 'edge_orders')
+
+    def __init__(self, node_ids, elements, indptr, indices, edge_u, edge_v, edge_orders):
+        self.node_ids = node_ids
+        self.elements = elements
+        self.indptr = indptr
+        self.indices = indices
+        self.edge_u = edge_u
+        self.edge_v = edge_v
+        self.edge_orders = edge_orders
+
+    @classmethod
+    def from_networkx(cls, graph):
+        """Builds a CompactGraph from a synkit/networkx graph with 'element' node and 'order' edge attributes."""
+        node_ids = list(graph.nodes())
+        position = {n: i for i, n in enumerate(node_ids)}
+        elements = np.fromiter((element_code(d.get('element')) for _, d in graph.nodes(data=True)), dtype=np.int32, count=len(node_ids))
+
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int32)
+        indices = []
+        for i, n in enumerate(node_ids):
+            indices.extend(position[m] for m in graph.neighbors(n))
+            indptr[i + 1] = len(indices)
+
+        edge_u, edge_v, edge_orders = [], [], []
+        for u, v, d in graph.edges(data=True):
+            edge_u.append(position[u])
+            edge_v.append(position[v])
+            edge_orders.append(order_code(d.get('order')))
+
+        return cls(
+            node_ids, elements, indptr, np.asarray(indices, dtype=np.int32),
+            np.asarray(edge_u, dtype=np.int32), np.asarray(edge_v, dtype=np.int32), np.asarray(edge_orders, dtype=np.int32)
+        )
+
+    def number_of_nodes(self) -> int:
+        return len(self.node_ids)
+
+    def number_of_edges(self) -> int:
+        return len(self.edge_u)
+
+    def element(self, i:int):
+        """Returns the element symbol of the node at position i."""
+        return _ELEMENTS[self.elements[i]]
+
+    def element_symbols(self) -> list:
+        """Returns the element symbol of every node, in position order."""
+        return [_ELEMENTS[code] for code in self.elements.tolist()]
+
+    def bond_order(self, code:int):
+        """Returns the original bond order value of a bond-order code."""
+        return _ORDERS[code]
+
+    def neighbors(self, i:int) -> np.ndarray:
+        """Returns the positions of the neighbors of the node at position i."""
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def adjacency_lists(self) -> list:
+        """Returns the neighbor positions of every node as python lists, for tight python loops."""
+        indices = self.indices.tolist()
+        indptr = self.indptr.tolist()
+        return [indices[indptr[i]:indptr[i + 1]] for i in range(len(self.node_ids))]
+
+    def edges(self):
+        """Yields (u position, v position, bond order) for every edge."""
+        for u, v, code in zip(self.edge_u.tolist(), self.edge_v.tolist(), self.edge_orders.tolist()):
+            yield u, v, _ORDERS[code]
+
+    def bfs_distances(self, source:int, max_distance:int = None) -> np.ndarray:
+        """
+        Returns the hop distance from the node at position source to every node (-1 if unreachable).
+
+        Args:
+            source: Position of the source node.
+            max_distance: Stop the BFS after this many hops, farther nodes stay at -1.
+        """
+        distances = np.full(len(self.node_ids), -1, dtype=np.int32)
+        distances[source] = 0
+        indptr = self.indptr
+        indices = self.indices
+        queue = deque([source])
+        while queue:
+            u = queue.popleft()
+            d = distances[u] + 1
+            if max_distance is not None and d > max_distance:
+                continue
+            for w in indices[indptr[u]:indptr[u + 1]]:
+                if distances[w] < 0:
+                    distances[w] = d
+                    queue.append(w)
+        return distances
+
+
+def as_compact_graph(graph) -> CompactGraph:
+    """Returns graph itself if it already is a CompactGraph, otherwise builds one from the networkx graph."""
+    if isinstance(graph, CompactGraph):
+        return graph
+    return CompactGraph.from_networkx(graph)
@@ -1,16 +1,24 @@
 # A DRF returns the symmetric difference between educt and product graphs == Reaction graph
-from hashlib import blake2b
+# All feature sets are sorted uint64 arrays, the set algebra runs vectorized (see feature_ids.py)
 from synkit.IO import rsmi_to_graph
+from synkit.Graph.ITS import ITSConstruction
 from phi_transformation import phi_edge_graph, phi_shortest_path_graph, phi_vertex_dict_graph
+from feature_ids import EMPTY, as_feature_array, symmetric_difference
+from compact_graph import as_compact_graph
+from instrumentation import stage, count
+import logging
+
+# No logging configuration here, see phi_transformation.py
+logger = logging.getLogger(__name__)
 
 def calculate_symmetric_difference_off_dict(dict1, dict2):
-  # Calculate for each key in both dicts the symmetric difference of their value sets
+  # Calculate for each key in both dicts the symmetric difference of their value arrays
   symm_diff = dict()
   all_keys = set(dict1.keys()).union(set(dict2.keys()))
   for key in all_keys:
-    set1 = set(dict1.get(key, []))
-    set2 = set(dict2.get(key, []))
-    symm_diff[key] = set1.symmetric_difference(set2)
+    set1 = dict1.get(key, EMPTY)
+    set2 = dict2.get(key, EMPTY)
+    symm_diff[key] = symmetric_difference(set1, set2)
   return symm_diff
 
 def vertex_drf(rsmi:str):
@@ -23,7 +31,7 @@ def vertex_drf(rsmi:str):
   # Calculate symmetric difference
   sym_diff = calculate_symmetric_difference_off_dict(educt_vertices, product_vertices)
 
-  return sorted(educt_vertices), sorted(product_vertices), sorted(sym_diff)
+  return as_feature_array(educt_vertices), as_feature_array(product_vertices), as_feature_array(sym_diff)
 
 def edge_drf(rsmi:str):
   educt_graph, product_graph = rsmi_to_graph(rsmi)
@@ -33,9 +41,10 @@ def edge_drf(rsmi:str):
   product_edges = phi_edge_graph(product_graph)
 
   # Calculate symmetric difference
-  sym_diff = set(educt_edges).symmetric_difference(set(product_edges))
+  with stage("set_algebra"):
+    sym_diff = symmetric_difference(educt_edges, product_edges)
 
-  return sorted(educt_edges), sorted(product_edges), sorted(sym_diff)
+  return educt_edges, product_edges, sym_diff
 
 def shortest_path_drf(rsmi:str):
   educt_graph, product_graph = rsmi_to_graph(rsmi)
@@ -45,9 +54,10 @@ def shortest_path_drf(rsmi:str):
   product_paths = phi_shortest_path_graph(product_graph)
 
   # Calculate symmetric difference
-  sym_diff = set(educt_paths).symmetric_difference(set(product_paths))
+  with stage("set_algebra"):
+    sym_diff = symmetric_difference(educt_paths, product_paths)
 
-  return sorted(educt_paths), sorted(product_paths), sorted(sym_diff)
+  return educt_paths, product_paths, sym_diff
 
 ######### Same methods with graphs passed directly #########
 
@@ -57,9 +67,10 @@ def vertex_drf_graph(educt_graph, product_graph):
   product_vertices = phi_vertex_dict_graph(product_graph)
 
   # Calculate symmetric difference
-  sym_diff = calculate_symmetric_difference_off_dict(educt_vertices, product_vertices)
+  with stage("set_algebra"):
+    sym_diff = calculate_symmetric_difference_off_dict(educt_vertices, product_vertices)
 
-  return sorted(educt_vertices), sorted(product_vertices), sorted(sym_diff)
+  return as_feature_array(educt_vertices), as_feature_array(product_vertices), as_feature_array(sym_diff)
 
 def edge_drf_graph(educt_graph, product_graph):
   # Calculate edge sets for educt and product graph
@@ -67,17 +78,67 @@ def edge_drf_graph(educt_graph, product_graph):
   product_edges = phi_edge_graph(product_graph)
 
   # Calculate symmetric difference
-  sym_diff = set(educt_edges).symmetric_difference(set(product_edges))
+  with stage("set_algebra"):
+    sym_diff = symmetric_difference(educt_edges, product_edges)
 
-  return sorted(educt_edges), sorted(product_edges), sorted(sym_diff)
+  return educt_edges, product_edges, sym_diff
 
-def shortest_path_drf_graph(educt_graph, product_graph):
-  # Calculate shortest path sets for educt and product graph
-  educt_paths = phi_shortest_path_graph(educt_graph)
-  product_paths = phi_shortest_path_graph(product_graph)
+def shortest_path_drf_graph(educt_graph, product_graph, max_distance=None, max_paths_per_source=None):
+  # Calculate shortest path sets for educt and product graph, optionally bounded (see phi_shortest_path_graph)
+  educt_paths = phi_shortest_path_graph(educt_graph, max_distance, max_paths_per_source)
+  product_paths = phi_shortest_path_graph(product_graph, max_distance, max_paths_per_source)
 
   # Calculate symmetric difference
-  sym_diff = set(educt_paths).symmetric_difference(set(product_paths))
-
-  return sorted(educt_paths), sorted(product_paths), sorted(sym_diff)
-
+  with stage("set_algebra"):
+    sym_diff = symmetric_difference(educt_paths, product_paths)
+
+  return educt_paths, product_paths, sym_diff
+
+######### Combined extractor: one parse per reaction #########
+
+def parse_reaction(rsmi:str):
+  # Parse the SMILES once, the ITS graph is built from the parsed educt and product graphs
+  # (this is what rsmi_to_its does internally after parsing the SMILES a second time)
+  with stage("parse"):
+    educt_graph, product_graph = rsmi_to_graph(rsmi)
+    # synkit only logs a SMILES it cannot parse and returns no graphs
+    if educt_graph is None or product_graph is None:
+      raise ValueError(f"Could not parse reaction {rsmi}")
+    its_graph = ITSConstruction().ITSGraph(educt_graph, product_graph)
+  count("reactions_parsed")
+  return educt_graph, product_graph, its_graph
+
+def reaction_features_graph(educt_graph, product_graph, its_graph, max_distance=None, max_paths_per_source=None):
+  # All educt, product and symmetric difference feature families plus the ITS features in one pass
+  # Returns a dict of uint64 arrays, keyed like the columns of pre-computing-feature-sets.py
+  # Each graph is converted to a CompactGraph once and shared by all phi transformations
+  # max_distance and max_paths_per_source bound the shortest-path features (see phi_shortest_path_graph)
+  educt_graph, product_graph, its_graph = as_compact_graph(educt_graph), as_compact_graph(product_graph), as_compact_graph(its_graph)
+  features = dict()
+  features["educt_phi_vertex_dict"], features["product_phi_vertex_dict"], features["symmetric_difference_vertex_dict"] = vertex_drf_graph(educt_graph, product_graph)
+  features["educt_phi_edge"], features["product_phi_edge"], features["symmetric_difference_edge"] = edge_drf_graph(educt_graph, product_graph)
+  features["educt_phi_shortest_path"], features["product_phi_shortest_path"], features["symmetric_difference_shortest_path"] = shortest_path_drf_graph(educt_graph, product_graph, max_distance, max_paths_per_source)
+  features["its_phi_vertex_dict"] = as_feature_array(phi_vertex_dict_graph(its_graph))
+  features["its_phi_edge"] = phi_edge_graph(its_graph)
+  features["its_phi_shortest_path"] = phi_shortest_path_graph(its_graph, max_distance, max_paths_per_source)
+  return features
+
+def reaction_features(rsmi:str, max_distance=None, max_paths_per_source=None):
+  # Same as vertex_drf, edge_drf and shortest_path_drf together plus the ITS features, with a single parse
+  return reaction_features_graph(*parse_reaction(rsmi), max_distance, max_paths_per_source)
+
+def reaction_features_batched(rsmis, batch_size:int = 256, max_distance=None, max_paths_per_source=None):
+  # Yields lists of feature dicts (see reaction_features) for batch_size reactions at a time
+  # Reactions that fail to parse yield None instead of aborting the whole batch, the error is logged
+  batch = []
+  for index, rsmi in enumerate(rsmis):
+    try:
+      batch.append(reaction_features(rsmi, max_distance, max_paths_per_source))
+    except Exception as e:
+      logger.warning("Error processing reaction %d: %s: %s", index, type(e).__name__, e)
+      batch.append(None)
+    if len(batch) == batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
@@ -0,0 +1,105 @@
+"""Persistent, content-addressed cache of per-reaction features.
+
+Entries are keyed by a hash of the reaction SMILES plus the feature settings (feature kind and h_max),
+so an interrupted precomputation resumes where it stopped and repeated reactions are computed once.
+The cache is a single sqlite file, which several worker processes can read and write concurrently.
+"""
+from hashlib import blake2b
+import pickle
+import sqlite3
+
+DEFAULT_CACHE = "data/feature_cache.sqlite"
+# Bumped whenever the representation or definition of cached features changes, which invalidates all older entries
+CACHE_VERSION = 2
+
+
+def cache_key(rsmi:str, kind:str, h_max:int = None) -> str:
+    """
+    Returns the cache key of one reaction under the given feature settings.
+
+    Args:
+        rsmi: Reaction SMILES.
+        kind: Feature kind, e.g. 'wl' or 'edge_drf'.
+        h_max: Number of WL iterations, None for features without iterations.
+    """
+    return blake2b(f"{CACHE_VERSION}|{kind}|{h_max}|{rsmi}".encode('utf-8'), digest_size=16).hexdigest()
+
+
+class FeatureCache:
+    """
+    Sqlite-backed mapping from (reaction SMILES, feature settings) to computed features.
+
+    Hits and misses are counted, see report().
+    """
+
+    def __init__(self, path:str = DEFAULT_CACHE, commit_every:int = 100):
+        self.path = path
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        # Entries not written yet. They are buffered in memory and written in one short transaction,
+        # so the write lock is never held while the next reactions are computed
+        self._pending = {}
+        # Waiting on locks instead of failing lets several pool workers share the file
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS features (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+        self._connection.commit()
+
+    def get(self, rsmi:str, kind:str, h_max:int = None):
+        """Returns the cached features or None, counting a hit or a miss."""
+        key = cache_key(rsmi, kind, h_max)
+        value = self._pending.get(key)
+        if value is None:
+            row = self._connection.execute("SELECT value FROM features WHERE key = ?", (key,)).fetchone()
+            value = row[0] if row is not None else None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(value)
+
+    def put(self, rsmi:str, kind:str, value, h_max:int = None):
+        """Stores features. Writes are buffered and committed in batches of commit_every entries."""
+        self._pending[cache_key(rsmi, kind, h_max)] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(self._pending) >= self.commit_every:
+            self.commit()
+
+    def get_or_compute(self, rsmi:str, kind:str, compute, h_max:int = None):
+        """
+        Returns the cached features or computes and stores them.
+
+        Args:
+            rsmi: Reaction SMILES.
+            kind: Feature kind.
+            compute: Callable without arguments computing the features on a miss.
+            h_max: Number of WL iterations, None for features without iterations.
+        """
+        value = self.get(rsmi, kind, h_max)
+        if value is None:
+            value = compute()
+            self.put(rsmi, kind, value, h_max)
+        return value
+
+    def commit(self):
+        """Writes the buffered entries in a single transaction."""
+        if not self._pending:
+            return
+        with self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO features (key, value) VALUES (?, ?)", self._pending.items())
+        self._pending = {}
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"Feature cache {self.path}: {self.hits} hits, {self.misses} misses ({rate:.1%} of lookups skipped)"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
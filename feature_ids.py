@@ -0,0 +1,37 @@
+"""Compact feature-ID representation shared by the phi transformations and the DRF functions.
+
+A feature is a 64-bit blake2b hash of its label string, and a feature set is a sorted NumPy
+uint64 array without duplicates. Set algebra runs vectorized on these arrays, and the arrays
+go straight into the kernels and the feature store without conversion.
+"""
+from hashlib import blake2b
+import numpy as np
+
+EMPTY = np.empty(0, dtype=np.uint64)
+
+
+def get_hash(data: str) -> int:
+    """Returns a stable 64-bit integer from a string. The one hash of all feature IDs and label codes."""
+    return int.from_bytes(blake2b(data.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def as_feature_array(features) -> np.ndarray:
+    """Returns the features of any iterable of 64-bit IDs as a sorted uint64 array without duplicates."""
+    if isinstance(features, np.ndarray):
+        return np.unique(features.astype(np.uint64, copy=False))
+    features = list(features)
+    if not features:
+        return EMPTY.copy()
+    return np.unique(np.asarray(features, dtype=np.uint64))
+
+
+def union(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.union1d(a, b)
+
+
+def intersection(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.intersect1d(a, b, assume_unique=True)
+
+
+def symmetric_difference(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.setxor1d(a, b, assume_unique=True)
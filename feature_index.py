@@ -0,0 +1,210 @@
+"""Inverted index from feature ID to the reactions containing it, for top-k similarity search.
+
+For a query set q, |q intersection x| is accumulated over the posting lists of the features
+of q only, so a query touches the reactions that share at least one feature with it instead
+of the whole pool. Features that occur in more than max_df reactions can be skipped; they
+make up most of the postings while saying little about similarity, and skipping them turns
+the counts into lower bounds that are short by at most the number of skipped features.
+
+An index is persisted as a directory of .npy arrays (in the layout of feature_store.py):
+    vocabulary.npy  uint64, sorted feature IDs
+    offsets.npy     int64,  the postings of vocabulary[j] are rows[offsets[j]:offsets[j+1]]
+    rows.npy        int64,  reaction rows in ascending order per posting list
+    sizes.npy       int64,  set size of every reaction, for the normalized kernels
+meta.json records the column_signature and the featurization settings of the indexed store,
+query reactions are featurized with these settings (see search_reaction).
+
+Usage:
+    python cli.py search data/feature_store "DRF Edges" --rsmi "<reaction SMILES>" -k 10
+"""
+import json
+import os
+import numpy as np
+from feature_store import as_feature_column, column_signature, featurization_settings, load_feature_column, resolve_featurization, \
+    DEFAULT_STORE, FEATURE_COLUMNS
+from kernels import normalize_intersections
+from vocabulary import df_limit
+from instrumentation import stage, count
+
+
+class FeatureIndex:
+    """
+    Read-only inverted index over one feature column: posting list of reaction rows per feature ID.
+    featurization holds the featurization settings of the indexed store, None if unknown.
+    """
+    __slots__ = ('vocabulary', 'offsets', 'rows', 'sizes', 'featurization')
+    # Arrays written by save, one .npy file each
+    ARRAYS = ('vocabulary', 'offsets', 'rows', 'sizes')
+
+    def __init__(self, vocabulary, offsets, rows, sizes, featurization:dict = None):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.rows = rows
+        self.sizes = sizes
+        self.featurization = featurization
+
+    @classmethod
+    def build(cls, column):
+        """
+        Builds the index of a feature column with one stable sort of all its feature IDs.
+
+        Args:
+            column: FeatureColumn (plain or sharded) or iterable of per-row feature collections.
+        """
+        column = as_feature_column(column)
+        sizes = np.asarray(column.sizes(), dtype=np.int64)
+        ids = np.asarray(column.ids, dtype=np.uint64)
+        row_of = np.repeat(np.arange(len(sizes), dtype=np.int64), sizes)
+        with stage("index_build"):
+            # The stable sort keeps the rows of each posting list in ascending order
+            order = np.argsort(ids, kind='stable')
+            vocabulary, starts = np.unique(ids[order], return_index=True)
+            offsets = np.append(starts, len(ids)).astype(np.int64)
+        count("indexed_features", len(ids))
+        return cls(vocabulary, offsets, row_of[order], sizes)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def document_frequencies(self) -> np.ndarray:
+        """Returns the number of reactions containing each feature of vocabulary."""
+        return np.diff(self.offsets)
+
+    def save(self, path:str, signature:str = None):
+        """Writes the index to a directory, with the column_signature of the column it was built from if known."""
+        os.makedirs(path, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"n_rows": len(self), "n_features": len(self.vocabulary), "n_postings": len(self.rows),
+                       "signature": signature, "featurization": self.featurization}, f, indent=2)
+
+    @classmethod
+    def load(cls, path:str, mmap:bool = True):
+        """Loads an index written by save, memory-mapped unless mmap is False."""
+        mode = 'r' if mmap else None
+        with open(os.path.join(path, "meta.json")) as f:
+            featurization = json.load(f).get("featurization")
+        return cls(*(np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode) for name in cls.ARRAYS), featurization)
+
+    def query(self, features, k:int = 10, max_df = None, kind:str = "intersection", exclude = None):
+        """
+        Returns the k reactions most similar to a query feature set.
+
+        Args:
+            features: Feature IDs of the query (uint64 array or iterable of ints).
+            k: Number of reactions to return.
+            max_df: Skip query features contained in more than max_df reactions; a float below 1
+                is a fraction of the indexed reactions. None keeps all features (exact scores).
+            kind: Kernel of the scores, one of kernels.KERNEL_KINDS.
+            exclude: Optional row (or rows) never to return, e.g. the query's own row.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray]: Rows and scores, best first (ties by row).
+                Only reactions sharing at least one counted feature with the query are returned.
+        """
+        query = np.unique(np.asarray(list(features) if isinstance(features, (set, frozenset)) else features, dtype=np.uint64))
+        with stage("index_query"):
+            positions = np.searchsorted(self.vocabulary, query)
+            positions[positions == len(self.vocabulary)] = 0
+            found = positions[self.vocabulary[positions] == query] if len(self.vocabulary) else positions[:0]
+            starts = np.asarray(self.offsets[found])
+            lengths = np.asarray(self.offsets[found + 1]) - starts
+            if max_df is not None:
+                keep = lengths <= df_limit(max_df, len(self))
+                starts, lengths = starts[keep], lengths[keep]
+
+            # Gather all kept posting lists at once (same trick as FeatureColumn.take) and count per row
+            ends = np.cumsum(lengths)
+            gather = np.repeat(starts - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0, dtype=np.int64)
+            counts = np.bincount(np.asarray(self.rows[gather]), minlength=len(self))
+
+            candidates = np.flatnonzero(counts)
+            if exclude is not None:
+                candidates = np.setdiff1d(candidates, np.atleast_1d(exclude))
+            scores = normalize_intersections(counts[candidates][None, :], [len(query)], self.sizes[candidates], kind)[0]
+            best = np.lexsort((candidates, -scores))[:k]
+        count("index_postings", int(lengths.sum()))
+        return candidates[best], scores[best]
+
+
+def index_path(store:str, column:str) -> str:
+    """Returns the default location of the index of a store column, inside the store directory."""
+    return os.path.join(store, "index", column.replace(' ', '_'))
+
+
+def load_or_build_index(store:str = DEFAULT_STORE, column:str = "DRF Edges", path:str = None, h_max:int = None, relabel:str = None,
+                        max_distance:int = None, max_paths_per_source:int = None) -> FeatureIndex:
+    """
+    Loads the persisted index of a store column, building and saving it on first use or when
+    the column has changed since, e.g. because the store was precomputed again with other settings.
+    The index carries the featurization settings recorded in the store.
+
+    Args:
+        h_max, relabel, max_distance, max_paths_per_source: Optional featurization settings the
+            caller expects, checked against the store, see feature_store.resolve_featurization.
+
+    Raises:
+        ValueError: If a passed setting differs from the one the store was precomputed with.
+    """
+    featurization = featurization_settings(store)
+    resolve_featurization(featurization, h_max=h_max, relabel=relabel, max_distance=max_distance, max_paths_per_source=max_paths_per_source)
+    path = path or index_path(store, column)
+    features = load_feature_column(store, column)
+    signature = column_signature(features)
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("signature") == signature and meta.get("featurization") == featurization:
+            return FeatureIndex.load(path)
+    index = FeatureIndex.build(features)
+    index.featurization = featurization
+    index.save(path, signature)
+    return index
+
+
+def reaction_feature_dict(rsmi:str, columns:list, h_max:int = 4, relabel:str = "string",
+                          max_distance:int = None, max_paths_per_source:int = None) -> dict:
+    """
+    Computes the features of a new reaction for several columns, the way the store was precomputed.
+
+    Columns of WL_algorithm.FEATURE_COLUMNS go through getWL (h_max, relabel and the shortest-path
+    limits must match the precomputation), the columns of pre-computing-feature-sets.py through the DRF functions.
+    Each family is computed with a single parse of the reaction.
+
+    Returns:
+        dict[str, numpy.ndarray]: Sorted uint64 feature IDs per column.
+    """
+    features = {}
+    if any(column in FEATURE_COLUMNS for column in columns):
+        from WL_algorithm import compute_reaction_features
+        features.update(compute_reaction_features(rsmi, h_max, relabel, max_distance, max_paths_per_source))
+    if any(column not in FEATURE_COLUMNS for column in columns):
+        from drf_implementation import reaction_features
+        features.update(reaction_features(rsmi, max_distance, max_paths_per_source))
+    return {column: np.unique(np.asarray(list(features[column]) if isinstance(features[column], set) else features[column], dtype=np.uint64))
+            for column in columns}
+
+
+def featurize_reaction(rsmi:str, column:str, h_max:int = 4, relabel:str = "string",
+                       max_distance:int = None, max_paths_per_source:int = None) -> np.ndarray:
+    """Computes the features of a new reaction for one column, see reaction_feature_dict."""
+    return reaction_feature_dict(rsmi, [column], h_max, relabel, max_distance, max_paths_per_source)[column]
+
+
+def search_reaction(index:FeatureIndex, rsmi:str, column:str, k:int = 10, max_df = None, kind:str = "intersection", h_max:int = None, relabel:str = None,
+                    max_distance:int = None, max_paths_per_source:int = None):
+    """
+    Featurizes a reaction SMILES (see featurize_reaction) and returns its top-k (rows, scores) in the index.
+
+    The reaction is featurized with the settings recorded in the indexed store. h_max, relabel and the
+    shortest-path limits are only needed for stores that record none, passed values must match the store.
+
+    Raises:
+        ValueError: If a passed setting differs from the one the store was precomputed with.
+    """
+    settings = resolve_featurization(index.featurization, h_max=h_max, relabel=relabel,
+                                     max_distance=max_distance, max_paths_per_source=max_paths_per_source)
+    return index.query(featurize_reaction(rsmi, column, **settings), k=k, max_df=max_df, kind=kind)
+
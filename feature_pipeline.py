@@ -0,0 +1,162 @@
+"""Streaming precomputation: TSV -> reaction chunks -> features -> fixed-size shards.
+
+Every stage is a generator, so at no point is more than a bounded number of chunks in
+memory: the TSV is read in chunks, at most max_pending chunks are featurized at once on the
+process pool, and rows are written out as soon as a shard is full. Peak memory therefore
+depends on chunk_size and shard_size only, not on the number of reactions.
+
+The output is a sharded feature store (see feature_store.py): one plain store per shard plus
+a manifest.json, rewritten after every shard, so the readers see all finished shards and an
+interrupted run is visible as such. Downstream scripts load it with the usual feature_store
+readers, or process the shards in parallel with map_shards.
+"""
+from collections import deque
+from multiprocessing import Pool
+import json
+import os
+import time
+from feature_store import write_feature_store, shard_paths
+
+
+def read_reaction_chunks(path:str, chunk_size:int = 1000, smiles_column:str = "clean_rxn", class_column:str = "rxn_class"):
+    """
+    Reads a reaction TSV in chunks without loading the whole file.
+
+    Args:
+        path: TSV file, e.g. schneider50k_clean.tsv.
+        chunk_size: Number of reactions per chunk.
+        smiles_column: Column holding the reaction SMILES.
+        class_column: Column holding the class labels.
+
+    Yields:
+        tuple[int, list, list]: Index of the first row, reaction SMILES and class labels of one chunk.
+    """
+    import pandas as pd
+    first_row = 0
+    for chunk in pd.read_csv(path, sep="\t", usecols=[smiles_column, class_column], chunksize=chunk_size):
+        yield first_row, chunk[smiles_column].tolist(), chunk[class_column].tolist()
+        first_row += len(chunk)
+
+
+def map_chunks(func, chunks, processes:int = None, max_pending:int = None):
+    """
+    Applies func to every chunk on a process pool and yields the results in chunk order.
+
+    Unlike Pool.imap, which consumes the whole input up front, at most max_pending chunks
+    are submitted at any time, so the input generator is only advanced as results are consumed.
+
+    Args:
+        func: Picklable function of one chunk.
+        chunks: Iterable of chunks.
+        processes: Number of worker processes, os.cpu_count() if None. 1 runs in this process.
+        max_pending: Maximum number of chunks in flight, 2 * processes if None.
+    """
+    if processes == 1:
+        for chunk in chunks:
+            yield func(chunk)
+        return
+    processes = processes or os.cpu_count()
+    max_pending = max_pending or 2 * processes
+    with Pool(processes=processes) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(func, (chunk,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def iter_rows(chunk_results):
+    """
+    Flattens chunk results into rows.
+
+    Args:
+        chunk_results: Iterable of (class labels, feature dicts) per chunk.
+
+    Yields:
+        tuple[dict, object]: Feature dict (column name -> feature collection) and class label of one reaction.
+    """
+    for rxn_classes, features in chunk_results:
+        yield from zip(features, rxn_classes)
+
+
+def _write_manifest(out_dir:str, manifest:dict):
+    # Replace atomically, a reader never sees a half-written manifest
+    tmp_path = os.path.join(out_dir, "manifest.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, "manifest.json"))
+
+
+def write_shards(rows, out_dir:str, columns:list, shard_size:int = 10000, total:int = None, minhash:dict = None, featurization:dict = None) -> dict:
+    """
+    Writes a stream of rows into a sharded feature store with fixed-size shards.
+
+    Args:
+        rows: Iterable of (feature dict, class label), see iter_rows.
+        out_dir: Target directory of the sharded store.
+        columns: Feature columns to store, keys of the feature dicts.
+        shard_size: Number of rows per shard (the last shard may be smaller).
+        total: Expected number of rows, only used for the progress output.
+        minhash: Optional MinHash settings, the signatures are written next to the features of every shard.
+        featurization: Optional settings the features were computed with (h_max, relabel, shortest-path limits),
+            recorded in the manifest, see feature_store.featurization_settings.
+
+    Returns:
+        dict: The manifest of the written store.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {"columns": list(columns), "n_rows": 0, "shard_size": shard_size, "complete": False, "shards": []}
+    if minhash is not None:
+        manifest["minhash"] = dict(minhash)
+    if featurization is not None:
+        manifest["featurization"] = dict(featurization)
+    _write_manifest(out_dir, manifest)
+    start_time = time.perf_counter()
+
+    def flush(buffer, labels):
+        name = f"shard_{len(manifest['shards']):05d}"
+        write_feature_store(os.path.join(out_dir, name), buffer, rxn_class=labels, overwrite=True, minhash=minhash,
+                            featurization=featurization)
+        manifest["shards"].append({"path": name, "n_rows": len(labels)})
+        manifest["n_rows"] += len(labels)
+        _write_manifest(out_dir, manifest)
+        elapsed = time.perf_counter() - start_time
+        rate = manifest["n_rows"] / elapsed if elapsed > 0 else float('inf')
+        progress = f"{manifest['n_rows']}/{total}" if total else f"{manifest['n_rows']}"
+        print(f"Shard {name} written: {progress} reactions, {rate:.1f} reactions/s")
+
+    buffer = {name: [] for name in columns}
+    labels = []
+    for features, rxn_class in rows:
+        for name in columns:
+            buffer[name].append(features[name])
+        labels.append(rxn_class)
+        if len(labels) >= shard_size:
+            flush(buffer, labels)
+            buffer = {name: [] for name in columns}
+            labels = []
+    if labels:
+        flush(buffer, labels)
+
+    manifest["complete"] = True
+    _write_manifest(out_dir, manifest)
+    return manifest
+
+
+def map_shards(func, path:str, processes:int = None) -> list:
+    """
+    Applies func to every shard directory of a (sharded) store in parallel, e.g. to
+    compute per-shard statistics. Each worker memory-maps only its own shard.
+
+    Args:
+        func: Picklable function of one shard directory.
+        path: Store directory.
+        processes: Number of worker processes, os.cpu_count() if None.
+
+    Returns:
+        list: Results in shard order.
+    """
+    with Pool(processes=processes) as pool:
+        return pool.map(func, shard_paths(path))
@@ -0,0 +1,502 @@
+"""Binary columnar store for precomputed reaction feature sets.
+
+Every feature column is kept as two .npy arrays in CSR layout:
+    <column>.offsets.npy  int64,  shape (n_rows + 1,)
+    <column>.ids.npy      uint64, shape (n_features_total,)
+The features of row i are ids[offsets[i]:offsets[i+1]], sorted and unique.
+rxn_class.npy holds the class labels and meta.json lists the stored columns.
+Optionally, <column>.minhash.npy holds a fixed-size MinHash signature per row (see minhash.py),
+and meta.json the settings they were computed with. A store precomputed from reaction SMILES
+also records its featurization settings (h_max, relabel, shortest-path limits) in meta.json,
+so new reactions can be featurized the same way (see featurization_settings).
+
+All arrays can be memory-mapped, so a script only pays for the columns and rows it touches.
+
+A sharded store is a directory of such stores (shard_00000, shard_00001, ...) plus a
+manifest.json listing the shards in row order, as written by feature_pipeline.py. All
+readers below accept plain and sharded stores alike.
+
+Usage (one-time conversion of the Excel files):
+    python feature_store.py data/combined_data.xlsx
+    python feature_store.py data/pre-computed-feature_sets_part_*.xlsx --rxn-classes schneider50k.tsv
+"""
+from hashlib import blake2b
+import argparse
+import json
+import os
+import numpy as np
+
+FEATURE_COLUMNS = ['DRF Nodes', 'DRF Edges', 'DRF Shortest Paths', 'ITS Nodes', 'ITS Edges', 'ITS Shortest Paths']
+DEFAULT_STORE = "data/feature_store"
+# Featurization settings of WL_algorithm.compute_reaction_features, assumed for stores that record none
+DEFAULT_FEATURIZATION = {"h_max": 4, "relabel": "string", "max_distance": None, "max_paths_per_source": None}
+
+_UINT64_MAX = 2**64 - 1
+
+
+class FeatureColumn:
+    """
+    Read-only CSR view on one feature column: row i is a sorted uint64 array of feature IDs.
+    """
+    __slots__ = ('offsets', 'ids')
+
+    def __init__(self, offsets, ids):
+        self.offsets = offsets
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def sizes(self):
+        """Returns the number of features per row."""
+        return np.diff(self.offsets)
+
+    def take(self, rows):
+        """Returns a new in-memory FeatureColumn holding only the passed rows (in that order)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.offsets[rows]
+        sizes = self.offsets[rows + 1] - starts
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        # Gather all slices at once: position j of row r reads ids[starts[r] + j]
+        gather = np.repeat(starts - offsets[:-1], sizes) + np.arange(offsets[-1], dtype=np.int64)
+        return FeatureColumn(offsets, np.asarray(self.ids[gather]))
+
+    def to_object_array(self):
+        """Returns a numpy object array of per-row feature ID arrays, e.g. for train_test_split."""
+        rows = np.empty(len(self), dtype=object)
+        for i in range(len(self)):
+            rows[i] = self[i]
+        return rows
+
+
+class ShardedFeatureColumn:
+    """
+    Read-only view on one feature column spread over the shards of a sharded store,
+    with the same interface as FeatureColumn. Each shard stays memory-mapped on its own.
+    """
+    __slots__ = ('parts', 'row_offsets')
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.row_offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+        np.cumsum([len(part) for part in parts], out=self.row_offsets[1:])
+
+    def __len__(self):
+        return int(self.row_offsets[-1])
+
+    def __getitem__(self, i):
+        shard = int(np.searchsorted(self.row_offsets, i, side='right')) - 1
+        return self.parts[shard][i - self.row_offsets[shard]]
+
+    def __iter__(self):
+        for part in self.parts:
+            yield from part
+
+    def sizes(self):
+        """Returns the number of features per row."""
+        return np.concatenate([part.sizes() for part in self.parts] or [np.empty(0, dtype=np.int64)])
+
+    def take(self, rows):
+        """Returns a new in-memory FeatureColumn holding only the passed rows (in that order)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        shards = np.searchsorted(self.row_offsets, rows, side='right') - 1
+        # Gather per shard, then restore the requested row order
+        taken = []
+        positions = []
+        for shard in np.unique(shards):
+            selected = np.flatnonzero(shards == shard)
+            taken.append(self.parts[shard].take(rows[selected] - self.row_offsets[shard]))
+            positions.append(selected)
+        if not taken:
+            return FeatureColumn(np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.uint64))
+        return concatenate_columns(taken).take(np.argsort(np.concatenate(positions), kind='stable'))
+
+    def to_object_array(self):
+        """Returns a numpy object array of per-row feature ID arrays, e.g. for train_test_split."""
+        return np.concatenate([part.to_object_array() for part in self.parts] or [np.empty(0, dtype=object)])
+
+
+def concatenate_columns(columns) -> FeatureColumn:
+    """Concatenates FeatureColumns row-wise into one in-memory FeatureColumn."""
+    offsets = [np.zeros(1, dtype=np.int64)]
+    shift = 0
+    for column in columns:
+        offsets.append(np.asarray(column.offsets[1:], dtype=np.int64) + shift)
+        shift += int(column.offsets[-1])
+    return FeatureColumn(np.concatenate(offsets), np.concatenate([np.asarray(column.ids) for column in columns]))
+
+
+def column_signature(column) -> str:
+    """
+    Returns a fingerprint of the contents of a feature column (row sizes and feature IDs), so data
+    derived from a column (vocabularies, indexes) can detect that the store was rewritten since.
+    Plain and sharded columns with the same rows have the same signature.
+    """
+    column = as_feature_column(column)
+    signature = blake2b(digest_size=16)
+    for part in column.parts if isinstance(column, ShardedFeatureColumn) else [column]:
+        signature.update(np.ascontiguousarray(part.sizes(), dtype=np.int64))
+        signature.update(np.ascontiguousarray(part.ids, dtype=np.uint64))
+    return signature.hexdigest()
+
+
+def _slug(column:str) -> str:
+    return column.replace(' ', '_')
+
+
+def feature_id(token:str) -> int:
+    """
+    Maps one feature token from a stringified set to a uint64 feature ID.
+
+    Tokens that already are 64-bit integers (hashes from feature_ids.get_hash) are kept as they are,
+    all other tokens (e.g. hex digests from phi_transformation) are hashed to 64 bits.
+    """
+    token = token.strip().strip("'\"")
+    if token.isdigit():
+        value = int(token)
+        if value <= _UINT64_MAX:
+            return value
+    return int.from_bytes(blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def parse_feature_cell(cell) -> np.ndarray:
+    """
+    Parses one cell written by DataFrame.to_excel (a python set repr) into a sorted uint64 array.
+    Empty sets and missing cells (NaN) become empty arrays.
+    """
+    if not isinstance(cell, str):
+        return np.empty(0, dtype=np.uint64)
+    body = cell.strip()
+    if body in ('set()', '{}', ''):
+        return np.empty(0, dtype=np.uint64)
+    tokens = body.strip('{}[]').split(', ')
+    return np.unique(np.fromiter((feature_id(t) for t in tokens), dtype=np.uint64, count=len(tokens)))
+
+
+def pack_column(rows) -> FeatureColumn:
+    """
+    Packs an iterable of per-row feature collections (uint64 arrays or sets of ints) into a FeatureColumn.
+    """
+    arrays = [np.unique(np.asarray(list(r) if isinstance(r, (set, frozenset)) else r, dtype=np.uint64)) for r in rows]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum([len(a) for a in arrays], out=offsets[1:])
+    ids = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.uint64)
+    return FeatureColumn(offsets, ids.astype(np.uint64, copy=False))
+
+
+def as_feature_column(rows):
+    """
+    Returns rows as a FeatureColumn: store columns are used as they are (a sharded column is
+    concatenated), other rows (uint64 arrays, or sets of string tokens as parsed from the Excel
+    files) are packed into one, mapping string tokens with feature_id.
+    """
+    if isinstance(rows, FeatureColumn):
+        return rows
+    if isinstance(rows, ShardedFeatureColumn):
+        return concatenate_columns(rows.parts)
+    if hasattr(rows, 'tolist'):
+        rows = rows.tolist()
+    return pack_column([row if isinstance(row, np.ndarray) else [feature_id(str(token)) for token in row] for row in rows])
+
+
+def write_feature_store(path:str, columns:dict, rxn_class=None, overwrite:bool = False, minhash:dict = None, featurization:dict = None):
+    """
+    Writes feature columns (and optionally the class labels) to a store directory.
+
+    Columns are added to an existing store unless overwrite is set, in which case
+    the store is started from scratch.
+
+    Args:
+        path: Store directory, created if missing.
+        columns: Mapping column name -> FeatureColumn or iterable of per-row feature collections.
+        rxn_class: Optional array-like of class labels, one per row.
+        overwrite: Ignore the columns already listed in the store.
+        minhash: Optional MinHash settings (num_perm, bits, seed), see minhash.minhash_signatures.
+            The signatures of every written column are stored next to its features.
+        featurization: Optional settings the features were computed with, see featurization_settings.
+    """
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, "meta.json")
+    meta = {"columns": [], "n_rows": None}
+    if os.path.exists(meta_path) and not overwrite:
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    for name, rows in columns.items():
+        column = rows if isinstance(rows, FeatureColumn) else pack_column(rows)
+        if meta["n_rows"] is not None and len(column) != meta["n_rows"]:
+            raise ValueError(f"Column '{name}' has {len(column)} rows, store has {meta['n_rows']}")
+        meta["n_rows"] = len(column)
+        np.save(os.path.join(path, f"{_slug(name)}.offsets.npy"), np.asarray(column.offsets, dtype=np.int64))
+        np.save(os.path.join(path, f"{_slug(name)}.ids.npy"), np.asarray(column.ids, dtype=np.uint64))
+        if minhash is not None:
+            _write_signatures(path, name, column, minhash)
+        if name not in meta["columns"]:
+            meta["columns"].append(name)
+
+    if minhash is not None:
+        meta["minhash"] = dict(minhash)
+    if featurization is not None:
+        meta["featurization"] = dict(featurization)
+
+    if rxn_class is not None:
+        rxn_class = np.asarray(rxn_class)
+        if meta["n_rows"] is not None and len(rxn_class) != meta["n_rows"]:
+            raise ValueError(f"rxn_class has {len(rxn_class)} rows, store has {meta['n_rows']}")
+        meta["n_rows"] = len(rxn_class)
+        np.save(os.path.join(path, "rxn_class.npy"), rxn_class)
+
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def _write_signatures(path:str, name:str, column, minhash:dict):
+    from minhash import minhash_signatures
+    np.save(os.path.join(path, f"{_slug(name)}.minhash.npy"), minhash_signatures(column, **minhash))
+
+
+def sketch_feature_store(path:str = DEFAULT_STORE, minhash:dict = None, columns=None):
+    """
+    Adds MinHash signatures to an existing (plain or sharded) store, e.g. one converted from Excel.
+
+    Args:
+        path: Store directory.
+        minhash: MinHash settings (num_perm, bits, seed), the minhash.py defaults if None.
+        columns: Feature columns to sketch, all stored columns if None.
+    """
+    minhash = dict(minhash or {})
+    columns = store_columns(path) if columns is None else columns
+    for shard in shard_paths(path):
+        for name in columns:
+            _write_signatures(shard, name, load_feature_column(shard, name), minhash)
+        meta_path = os.path.join(shard, "meta.json")
+        with open(meta_path) as f:
+            meta = json.load(f)
+        meta["minhash"] = minhash
+        with open(meta_path, "w") as f:
+            json.dump(meta, f, indent=2)
+
+    manifest = load_manifest(path)
+    if manifest is not None:
+        manifest["minhash"] = minhash
+        with open(os.path.join(path, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+
+def signature_settings(path:str = DEFAULT_STORE):
+    """Returns the MinHash settings the signatures of a store were computed with, None if it has none."""
+    manifest = load_manifest(path)
+    if manifest is not None:
+        return manifest.get("minhash")
+    with open(os.path.join(path, "meta.json")) as f:
+        return json.load(f).get("minhash")
+
+
+def featurization_settings(path:str = DEFAULT_STORE):
+    """
+    Returns the settings the features of a store were precomputed with (a subset of h_max, relabel,
+    max_distance and max_paths_per_source), None if it records none, e.g. a store converted from Excel.
+    """
+    manifest = load_manifest(path)
+    if manifest is not None:
+        return manifest.get("featurization")
+    with open(os.path.join(path, "meta.json")) as f:
+        return json.load(f).get("featurization")
+
+
+def resolve_featurization(stored:dict = None, **requested) -> dict:
+    """
+    Returns the settings to featurize new reactions with for a store, given its featurization_settings.
+
+    Requested settings that are None are taken from the store (DEFAULT_FEATURIZATION if it records none),
+    the others must agree with the store.
+
+    Raises:
+        ValueError: If a requested setting differs from the one the store was precomputed with.
+    """
+    stored = stored or {}
+    settings = {**DEFAULT_FEATURIZATION, **stored}
+    for name, value in requested.items():
+        if value is None:
+            continue
+        if name in stored and stored[name] != value:
+            raise ValueError(f"{name}={value!r} does not match the store, which was precomputed with {name}={stored[name]!r}")
+        settings[name] = value
+    return settings
+
+
+def load_signatures(path:str, name:str, num_perm:int = None, mmap:bool = True) -> np.ndarray:
+    """
+    Loads the MinHash signatures of one feature column.
+
+    Args:
+        path: Store directory.
+        name: Column name, e.g. 'DRF Edges'.
+        num_perm: Use only the first num_perm positions (a valid shorter signature), all if None.
+        mmap: Memory-map the array instead of reading it into memory (plain stores only).
+
+    Returns:
+        numpy.ndarray of shape (n_rows, num_perm), packed for fewer than 8 bits (see minhash.minhash_signatures).
+    """
+    if load_manifest(path) is not None:
+        signatures = np.concatenate([load_signatures(shard, name, num_perm, mmap=False) for shard in shard_paths(path)])
+    else:
+        signatures = np.load(os.path.join(path, f"{_slug(name)}.minhash.npy"), mmap_mode='r' if mmap else None)
+    if num_perm is not None:
+        from minhash import signature_positions, signature_width
+        bits = (signature_settings(path) or {}).get("bits")
+        if num_perm > signature_positions(signatures, bits):
+            raise ValueError(f"Store has signatures of length {signature_positions(signatures, bits)}, {num_perm} requested")
+        signatures = signatures[:, :signature_width(num_perm, bits)]
+    return signatures
+
+
+def load_manifest(path:str):
+    """Returns the manifest of a sharded store, None for a plain store."""
+    manifest_path = os.path.join(path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def is_feature_store(path:str) -> bool:
+    """True if path is a plain or a sharded feature store."""
+    return os.path.exists(os.path.join(path, "meta.json")) or os.path.exists(os.path.join(path, "manifest.json"))
+
+
+def shard_paths(path:str = DEFAULT_STORE) -> list:
+    """Returns the shard directories of a sharded store in row order, [path] for a plain store."""
+    manifest = load_manifest(path)
+    if manifest is None:
+        return [path]
+    return [os.path.join(path, shard["path"]) for shard in manifest["shards"]]
+
+
+def store_columns(path:str = DEFAULT_STORE) -> list:
+    """Returns the names of the feature columns available in a store."""
+    manifest = load_manifest(path)
+    if manifest is not None:
+        return manifest["columns"]
+    with open(os.path.join(path, "meta.json")) as f:
+        return json.load(f)["columns"]
+
+
+def load_feature_column(path:str, name:str, mmap:bool = True):
+    """
+    Loads a single feature column from a store without touching the other columns.
+
+    Args:
+        path: Store directory.
+        name: Column name, e.g. 'DRF Edges'.
+        mmap: Memory-map the arrays instead of reading them into memory.
+
+    Returns:
+        FeatureColumn, or a ShardedFeatureColumn for a sharded store.
+    """
+    if load_manifest(path) is not None:
+        return ShardedFeatureColumn([load_feature_column(shard, name, mmap=mmap) for shard in shard_paths(path)])
+    mode = 'r' if mmap else None
+    offsets = np.load(os.path.join(path, f"{_slug(name)}.offsets.npy"), mmap_mode=mode)
+    ids = np.load(os.path.join(path, f"{_slug(name)}.ids.npy"), mmap_mode=mode)
+    return FeatureColumn(offsets, ids)
+
+
+def load_rxn_class(path:str = DEFAULT_STORE) -> np.ndarray:
+    """Loads the class label of every row of a store."""
+    if load_manifest(path) is not None:
+        return np.concatenate([load_rxn_class(shard) for shard in shard_paths(path)])
+    return np.load(os.path.join(path, "rxn_class.npy"), allow_pickle=False)
+
+
+def load_feature_dataframe(path:str = DEFAULT_STORE, columns=None, mmap:bool = True):
+    """
+    Loads rxn_class and the requested feature columns as a DataFrame.
+
+    Every feature cell is a uint64 array (a view on the memory-mapped column), so the
+    DataFrame can be sampled and split as before while the kernels consume it without any text parsing.
+
+    Args:
+        path: Store directory.
+        columns: Feature columns to load, all stored columns if None.
+        mmap: Memory-map the arrays instead of reading them into memory.
+    """
+    if columns is None:
+        columns = store_columns(path)
+    data = {"rxn_class": load_rxn_class(path)}
+    for name in columns:
+        data[name] = load_feature_column(path, name, mmap=mmap).to_object_array()
+    import pandas as pd
+    return pd.DataFrame(data)
+
+
+def merge_feature_stores(sources:list, out_dir:str = DEFAULT_STORE):
+    """
+    Concatenates several stores (e.g. the shards of a precomputation run) row-wise into one store.
+
+    Args:
+        sources: Store directories, concatenated in the given order. All must have the same columns
+            and featurization settings.
+        out_dir: Target store directory.
+    """
+    columns = store_columns(sources[0])
+    merged = {name: concatenate_columns([load_feature_column(source, name) for source in sources]) for name in columns}
+
+    labels = None
+    if all(os.path.exists(os.path.join(source, "rxn_class.npy")) for source in sources):
+        labels = np.concatenate([load_rxn_class(source) for source in sources])
+
+    featurization = featurization_settings(sources[0])
+    for source in sources[1:]:
+        if featurization_settings(source) != featurization:
+            raise ValueError(f"Store {source} was precomputed with other featurization settings than {sources[0]}")
+
+    write_feature_store(out_dir, merged, rxn_class=labels, overwrite=True, featurization=featurization)
+
+
+def convert_excel_parts(sources:list, out_dir:str = DEFAULT_STORE, rxn_classes:str = None):
+    """
+    One-time conversion of Excel feature files (stringified python sets) into a feature store.
+
+    The files are read in the passed order and concatenated row-wise.
+
+    Args:
+        sources: Excel files, e.g. data/combined_data.xlsx or the data/pre-computed-feature_sets_part_*.xlsx files.
+        out_dir: Target store directory.
+        rxn_classes: Optional TSV with a 'rxn_class' column, used when the Excel files carry no class labels.
+    """
+    import pandas as pd
+    parsed = {name: [] for name in FEATURE_COLUMNS}
+    labels = []
+    for source in sources:
+        data = pd.read_excel(source)
+        print(f"File: {source}, Rows: {len(data)}")
+        for name in FEATURE_COLUMNS:
+            if name in data:
+                parsed[name].extend(parse_feature_cell(cell) for cell in data[name])
+        if "rxn_class" in data:
+            labels.extend(data["rxn_class"].tolist())
+
+    if rxn_classes is not None:
+        labels = pd.read_csv(rxn_classes, sep="\t")["rxn_class"].tolist()
+
+    columns = {name: rows for name, rows in parsed.items() if rows}
+    write_feature_store(out_dir, columns, rxn_class=labels if labels else None, overwrite=True)
+    print(f"Wrote {len(columns)} feature columns to {out_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert Excel feature files into a binary feature store.")
+    parser.add_argument("sources", nargs="+", help="Excel files, concatenated in the given order")
+    parser.add_argument("--out", default=DEFAULT_STORE, help="Target store directory")
+    parser.add_argument("--rxn-classes", default=None, help="TSV with a 'rxn_class' column if the Excel files have none")
+    args = parser.parse_args()
+    convert_excel_parts(args.sources, args.out, args.rxn_classes)
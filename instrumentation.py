@@ -0,0 +1,135 @@
+"""Per-stage timers and counters for the feature and experiment pipeline.
+
+Instrumented code marks its stages with
+
+    with stage("wl_iteration"):
+        ...
+    count("wl_features", len(features))
+
+Collection is off by default. While it is off, stage() returns one shared no-op context
+manager and count() returns right away, so instrumented hot loops pay a single function call.
+Enable it around a run and export the collected numbers:
+
+    instrumentation.enable()
+    ...
+    print(instrumentation.format_report())
+    instrumentation.write_report("results/profile.json")
+
+Stage names used in this repo: parse, apsp, wl_iteration, hashing, set_algebra, kernel_build,
+fit, predict. Timers are per process; pool workers collect their own numbers (see merge).
+"""
+from time import perf_counter
+import json
+
+_enabled = False
+_stages = {}
+_counters = {}
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name:str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = perf_counter() - self.start
+        entry = _stages.get(self.name)
+        if entry is None:
+            entry = _stages[self.name] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def enable():
+    """Starts collecting timers and counters."""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stops collecting, the numbers collected so far are kept until reset()."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """Discards all collected timers and counters."""
+    _stages.clear()
+    _counters.clear()
+
+
+def stage(name:str):
+    """Returns a context manager that adds the time spent inside it to the stage name."""
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def count(name:str, n:int = 1):
+    """Adds n to the counter name."""
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def report() -> dict:
+    """
+    Returns the collected numbers as a JSON-serializable dict:
+    {"stages": {name: {"calls", "seconds", "mean_seconds"}}, "counters": {name: value}}.
+    """
+    return {
+        "stages": {
+            name: {"calls": calls, "seconds": seconds, "mean_seconds": seconds / calls if calls else 0.0}
+            for name, (calls, seconds) in sorted(_stages.items())
+        },
+        "counters": dict(sorted(_counters.items()))
+    }
+
+
+def merge(other:dict):
+    """Adds a report() of another process (e.g. a pool worker) to the numbers of this process."""
+    for name, entry in other.get("stages", {}).items():
+        mine = _stages.setdefault(name, [0, 0.0])
+        mine[0] += entry["calls"]
+        mine[1] += entry["seconds"]
+    for name, value in other.get("counters", {}).items():
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def format_report() -> str:
+    """Returns the collected numbers as a human-readable table."""
+    data = report()
+    lines = [f"{'stage':<20} {'calls':>10} {'total s':>12} {'mean ms':>12}"]
+    for name, entry in data["stages"].items():
+        lines.append(f"{name:<20} {entry['calls']:>10} {entry['seconds']:>12.4f} {entry['mean_seconds'] * 1e3:>12.4f}")
+    for name, value in data["counters"].items():
+        lines.append(f"{name:<20} {value:>10}")
+    return "\n".join(lines)
+
+
+def write_report(path:str):
+    """Writes report() as JSON to path."""
+    with open(path, "w") as f:
+        json.dump(report(), f, indent=2)
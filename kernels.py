@@ -0,0 +1,296 @@
+"""Set kernels computed as sparse matrix products instead of pairwise Python loops.
+
+Every kernel is derived from the intersection counts |x intersection y| of one sparse product
+plus the set sizes |x| of the rows:
+
+    intersection  |x intersection y|
+    cosine        |x intersection y| / sqrt(|x| |y|)
+    tanimoto      |x intersection y| / (|x| + |y| - |x intersection y|)   (Jaccard index)
+
+Kernels over several feature columns are weighted sums of these, written as kernel specs,
+e.g. "cosine(DRF Edges) + 0.5*tanimoto(ITS Shortest Paths)", see parse_kernel_spec.
+"""
+import re
+import numpy as np
+from scipy import sparse
+from instrumentation import stage, count
+
+KERNEL_KINDS = ("intersection", "cosine", "tanimoto")
+
+# Weights use the float syntax, including exponents such as 1e-3
+_TERM = re.compile(r"^(?:(?P<weight>(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)\s*\*)?\s*(?:(?P<kind>[a-z]+)\((?P<column>[^()]+)\)|(?P<plain>[^()*]+))$")
+_TERM_SEPARATOR = re.compile(r"(?<![0-9][eE])\+")
+
+
+def _as_list(X):
+    # Convert to list if pandas Series (or numpy object array)
+    if hasattr(X, 'tolist'):
+        return X.tolist()
+    return list(X)
+
+
+def _is_id_block(X):
+    # Rows loaded from the feature store are sorted uint64 arrays instead of python sets
+    return all(isinstance(row, np.ndarray) for row in X)
+
+
+def build_vocabulary(*blocks):
+    """
+    Assigns a dense column index to every feature occurring in the passed blocks.
+
+    Args:
+        *blocks: Any number of array-likes whose items are iterables of hashable features
+            (python sets, or uint64 arrays as loaded from the feature store).
+
+    Returns:
+        dict or numpy.ndarray: Mapping feature -> column index, shared by all blocks.
+            For blocks of uint64 arrays this is the sorted array of all feature IDs,
+            the column index of a feature being its position in that array.
+    """
+    blocks = [_as_list(block) for block in blocks]
+    if all(_is_id_block(block) for block in blocks):
+        rows = [row for block in blocks for row in block]
+        if not rows:
+            return np.empty(0, dtype=np.uint64)
+        return np.unique(np.concatenate(rows).astype(np.uint64, copy=False))
+
+    vocabulary = {}
+    for block in blocks:
+        for row in block:
+            for feature in row:
+                if feature not in vocabulary:
+                    vocabulary[feature] = len(vocabulary)
+    return vocabulary
+
+
+def to_sparse_matrix(X, vocabulary):
+    """
+    Turns a column of feature sets into a binary CSR matrix over a shared vocabulary.
+
+    Features that are missing from the vocabulary are dropped, as they cannot contribute
+    to an intersection with any row indexed by it.
+
+    Args:
+        X: array-like of shape (n_samples,) containing python sets or uint64 arrays.
+        vocabulary (dict or numpy.ndarray): Mapping feature -> column index, see build_vocabulary.
+
+    Returns:
+        scipy.sparse.csr_matrix: Binary matrix of shape (n_samples, len(vocabulary)).
+    """
+    X = _as_list(X)
+    if isinstance(vocabulary, np.ndarray):
+        return _id_arrays_to_sparse_matrix(X, vocabulary)
+
+    indptr = np.zeros(len(X) + 1, dtype=np.int64)
+    indices = []
+    for i, row in enumerate(X):
+        columns = {vocabulary[f] for f in row if f in vocabulary}
+        indices.extend(columns)
+        indptr[i + 1] = len(indices)
+    indices = np.asarray(indices, dtype=np.int64)
+    data = np.ones(len(indices), dtype=np.float64)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(X), len(vocabulary)))
+
+
+def _id_arrays_to_sparse_matrix(X, vocabulary):
+    # Vectorized variant for rows of unique uint64 IDs: one searchsorted over all rows at once
+    sizes = np.fromiter((len(row) for row in X), dtype=np.int64, count=len(X))
+    ids = np.concatenate(X).astype(np.uint64, copy=False) if len(X) else np.empty(0, dtype=np.uint64)
+    row_of = np.repeat(np.arange(len(X), dtype=np.int64), sizes)
+
+    columns = np.searchsorted(vocabulary, ids)
+    columns[columns == len(vocabulary)] = 0
+    known = len(vocabulary) > 0
+    found = vocabulary[columns] == ids if known else np.zeros(len(ids), dtype=bool)
+
+    data = np.ones(int(found.sum()), dtype=np.float64)
+    return sparse.csr_matrix((data, (row_of[found], columns[found])), shape=(len(X), len(vocabulary)))
+
+
+def intersection_kernel(X1, X2):
+    """
+    Computes the intersection kernel between two arrays of sets as one sparse product.
+    K(x, y) = |x intersection y|
+
+    Both blocks are indexed over one shared vocabulary, so the asymmetric
+    X_test x X_train call made by SVC.predict is handled the same way as the
+    symmetric X_train x X_train call made by SVC.fit.
+
+    Args:
+        X1: array-like of shape (n_samples_X1,) containing python sets.
+        X2: array-like of shape (n_samples_X2,) containing python sets.
+
+    Returns:
+        K: Kernel matrix of shape (n_samples_X1, n_samples_X2).
+    """
+    X1 = _as_list(X1)
+    X2 = _as_list(X2)
+    symmetric = X1 is X2 or (len(X1) == len(X2) and all(a is b for a, b in zip(X1, X2)))
+
+    with stage("kernel_build"):
+        # Only features of X2 can ever contribute to |x intersection y|
+        vocabulary = build_vocabulary(X2)
+        M2 = to_sparse_matrix(X2, vocabulary)
+        M1 = M2 if symmetric else to_sparse_matrix(X1, vocabulary)
+        K = (M1 @ M2.T).toarray()
+    count("kernel_entries", K.size)
+    return K
+
+
+def intersection_gram_to_file(X, path, block_size=512, dtype=np.int32):
+    """
+    Computes the full intersection Gram matrix of one column of feature sets and writes it to disk.
+
+    The matrix is filled block of rows by block of rows into a memory-mapped .npy file,
+    so only one (block_size, n_samples) block is held in memory at any time.
+
+    Args:
+        X: array-like of shape (n_samples,) containing python sets.
+        path (str): Target .npy file.
+        block_size (int): Number of rows computed per sparse product.
+        dtype: Integer dtype of the stored counts.
+
+    Returns:
+        numpy.memmap: The written Gram matrix of shape (n_samples, n_samples), opened read-only.
+    """
+    X = _as_list(X)
+    n = len(X)
+    with stage("kernel_build"):
+        M = to_sparse_matrix(X, build_vocabulary(X))
+        MT = M.T.tocsc()
+
+        K = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(n, n))
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            K[start:stop] = (M[start:stop] @ MT).toarray().astype(dtype)
+        K.flush()
+        del K
+    count("kernel_entries", n * n)
+
+    return np.load(path, mmap_mode='r')
+
+
+def row_sizes(X) -> np.ndarray:
+    """Returns the set size |x| of every row of a column of feature sets (python sets or uint64 arrays)."""
+    X = _as_list(X)
+    return np.fromiter((len(row) for row in X), dtype=np.float64, count=len(X))
+
+
+def normalize_intersections(K, sizes1, sizes2, kind:str = "intersection"):
+    """
+    Turns a block of intersection counts into one of the KERNEL_KINDS.
+
+    Args:
+        K: Intersection counts of shape (len(sizes1), len(sizes2)), e.g. a slice of the pool Gram matrix.
+        sizes1, sizes2: Set sizes of the rows and columns of K, see row_sizes.
+        kind: One of KERNEL_KINDS. Pairs with an empty set get 0 for cosine and tanimoto.
+
+    Returns:
+        numpy.ndarray: Kernel values as float64.
+    """
+    K = np.asarray(K, dtype=np.float64)
+    if kind == "intersection":
+        return K
+    if kind == "cosine":
+        denominator = np.sqrt(np.outer(sizes1, sizes2))
+    elif kind == "tanimoto":
+        denominator = np.add.outer(sizes1, sizes2) - K
+    else:
+        raise ValueError(f"Unknown kernel '{kind}', expected one of {KERNEL_KINDS}")
+    return np.divide(K, denominator, out=np.zeros_like(K), where=denominator > 0)
+
+
+def set_kernel(X1, X2, kind:str = "intersection"):
+    """
+    Computes one of the KERNEL_KINDS between two arrays of sets from a single intersection product.
+
+    Args:
+        X1: array-like of shape (n_samples_X1,) containing python sets or uint64 arrays.
+        X2: array-like of shape (n_samples_X2,) containing python sets or uint64 arrays.
+        kind: One of KERNEL_KINDS.
+
+    Returns:
+        K: Kernel matrix of shape (n_samples_X1, n_samples_X2).
+    """
+    K = intersection_kernel(X1, X2)
+    if kind == "intersection":
+        return K
+    return normalize_intersections(K, row_sizes(X1), row_sizes(X2), kind)
+
+
+def parse_kernel_spec(spec:str) -> list:
+    """
+    Parses a kernel spec into its weighted terms.
+
+    A spec is a sum of terms "[weight*]kind(column)", where a bare column name stands for
+    intersection(column), e.g. "DRF Edges", "cosine(DRF Edges)" or
+    "cosine(DRF Edges) + 0.5*tanimoto(ITS Shortest Paths)". Weights are floats, exponents included.
+
+    Returns:
+        list[tuple[float, str, str]]: (weight, kind, column) per term.
+
+    Examples (python -m doctest kernels.py):
+        >>> parse_kernel_spec("DRF Edges")
+        [(1.0, 'intersection', 'DRF Edges')]
+        >>> parse_kernel_spec("cosine(DRF Edges) + 0.5*tanimoto(ITS Shortest Paths)")
+        [(1.0, 'cosine', 'DRF Edges'), (0.5, 'tanimoto', 'ITS Shortest Paths')]
+        >>> parse_kernel_spec("1e-3*cosine(DRF Edges) + 2.5E+2*ITS Edges")
+        [(0.001, 'cosine', 'DRF Edges'), (250.0, 'intersection', 'ITS Edges')]
+    """
+    terms = []
+    # A "+" separates terms unless it is the sign of an exponent (digit, e, +)
+    for part in _TERM_SEPARATOR.split(spec):
+        match = _TERM.match(part.strip())
+        if match is None:
+            raise ValueError(f"Invalid term '{part.strip()}' in kernel spec '{spec}'")
+        kind = match["kind"] or "intersection"
+        if kind not in KERNEL_KINDS:
+            raise ValueError(f"Unknown kernel '{kind}' in kernel spec '{spec}', expected one of {KERNEL_KINDS}")
+        column = (match["column"] or match["plain"]).strip()
+        terms.append((float(match["weight"] or 1.0), kind, column))
+    return terms
+
+
+def spec_columns(spec:str) -> list:
+    """Returns the feature columns a kernel spec uses, in order of first occurrence."""
+    return list(dict.fromkeys(column for _, _, column in parse_kernel_spec(spec)))
+
+
+def _as_object_matrix(X):
+    # 2-D object array of feature sets; building it cell by cell keeps numpy from turning
+    # equally long uint64 rows into a numeric matrix
+    if getattr(X, "ndim", 1) == 2:
+        return np.asarray(X, dtype=object)
+    rows = _as_list(X)
+    matrix = np.empty((len(rows), 1), dtype=object)
+    for i, row in enumerate(rows):
+        matrix[i, 0] = row
+    return matrix
+
+
+def combined_kernel(X1, X2, terms:list):
+    """
+    Computes the weighted sum of set kernels over several feature columns.
+
+    Args:
+        X1: array of shape (n_samples_X1, n_columns) with one feature set per cell, the columns
+            being spec_columns of the spec; a 1-D array if there is only one column.
+        X2: array of shape (n_samples_X2, n_columns), like X1.
+        terms: (weight, kind, column) per term, see parse_kernel_spec.
+
+    Returns:
+        K: Kernel matrix of shape (n_samples_X1, n_samples_X2).
+    """
+    columns = list(dict.fromkeys(column for _, _, column in terms))
+    X1 = _as_object_matrix(X1)
+    X2 = _as_object_matrix(X2)
+
+    # One intersection product and one pair of size vectors per column, shared by all terms on it
+    products = {}
+    K = np.zeros((len(X1), len(X2)), dtype=np.float64)
+    for weight, kind, column in terms:
+        j = columns.index(column)
+        if column not in products:
+            products[column] = (intersection_kernel(X1[:, j], X2[:, j]), row_sizes(X1[:, j]), row_sizes(X2[:, j]))
+        K += weight * normalize_intersections(*products[column], kind)
+    return K
@@ -0,0 +1,192 @@
+"""MinHash sketches of feature sets and the approximate set kernels estimated from them.
+
+A signature holds, for each of num_perm hash functions, the minimum hash over the features
+of a row. Two rows agree at one position with probability J = |x intersection y| / |x union y|,
+so the fraction of agreeing positions estimates the Jaccard index, and with the exact set sizes
+|x intersection y| = J / (1 + J) * (|x| + |y|). b-bit MinHash keeps only the lowest b bits of
+every minimum, which shrinks the signature at the price of chance agreements (corrected for).
+Minima of 8 to 64 bits are stored in the smallest unsigned dtype holding them. Fewer bits are packed
+(np.packbits), b bits per position one after another, so a row of num_perm positions takes
+num_perm * b / 8 bytes; num_perm must then be a multiple of 8.
+
+Signatures have a fixed size per reaction, independent of the size of its feature sets.
+They are written next to the exact features by the precomputation (see feature_store.py).
+"""
+from math import ceil, log
+import numpy as np
+from shortest_paths import mix64
+from kernels import intersection_kernel
+from feature_store import as_feature_column
+from instrumentation import stage, count
+
+DEFAULT_PERMUTATIONS = 128
+DEFAULT_SEED = 1
+
+
+def minhash_permutations(error:float, confidence:float = 0.95, bits:int = None) -> int:
+    """
+    Returns the signature length for which the Jaccard estimate of a pair is within error of the
+    true value with the given probability (Hoeffding bound).
+
+    Args:
+        error: Maximum absolute error of the Jaccard estimate, e.g. 0.05.
+        confidence: Probability that the error bound holds for one pair.
+        bits: b of b-bit MinHash, None for full 64-bit minima. The correction for chance
+            agreements inflates the error by 1 / (1 - 2^-b).
+    """
+    permutations = log(2.0 / (1.0 - confidence)) / (2.0 * error ** 2)
+    if bits is not None:
+        permutations /= (1.0 - 2.0 ** -bits) ** 2
+    if _packed(bits):
+        # Packed signatures take whole bytes, see signature_width
+        return 8 * ceil(permutations / 8)
+    return ceil(permutations)
+
+
+def _packed(bits:int) -> bool:
+    return bits is not None and bits < 8
+
+
+def _signature_dtype(bits:int):
+    if bits is None or bits > 32:
+        return np.uint64
+    if bits > 16:
+        return np.uint32
+    if bits > 8:
+        return np.uint16
+    return np.uint8
+
+
+def signature_width(num_perm:int, bits:int = None) -> int:
+    """
+    Returns the number of array columns of a signature with num_perm positions, num_perm * bits / 8
+    bytes for packed signatures (bits < 8), num_perm otherwise.
+
+    Raises:
+        ValueError: If a packed signature would not take whole bytes.
+    """
+    if not _packed(bits):
+        return num_perm
+    if num_perm % 8:
+        raise ValueError(f"Signatures of {bits}-bit minima need a multiple of 8 positions, got {num_perm}")
+    return num_perm * bits // 8
+
+
+def signature_positions(signatures:np.ndarray, bits:int = None) -> int:
+    """Returns the number of positions (num_perm) of signatures computed with bits, see signature_width."""
+    return signatures.shape[1] * 8 // bits if _packed(bits) else signatures.shape[1]
+
+
+def unpack_signatures(signatures:np.ndarray, bits:int = None) -> np.ndarray:
+    """Returns the minima of packed signatures (bits < 8) as uint8 array of shape (n_rows, num_perm), others as they are."""
+    if not _packed(bits):
+        return signatures
+    # Bit planes of shape (n_rows, num_perm, bits), lowest bit first, packed back into one byte per position
+    planes = np.unpackbits(np.asarray(signatures, dtype=np.uint8), axis=1, bitorder='little').reshape(len(signatures), -1, bits)
+    return np.packbits(planes, axis=2, bitorder='little')[:, :, 0]
+
+
+def minhash_signatures(column, num_perm:int = DEFAULT_PERMUTATIONS, bits:int = None, seed:int = DEFAULT_SEED) -> np.ndarray:
+    """
+    Computes the MinHash signature of every row of a feature column.
+
+    The hash functions are fixed by seed and their position, so the first k columns of a
+    signature with num_perm > k positions are the signature with k positions.
+
+    Args:
+        column: FeatureColumn, or an iterable of per-row feature collections.
+        num_perm: Number of hash functions (signature length).
+        bits: Keep only the lowest bits of every minimum (b-bit MinHash), None for 64 bits.
+        seed: Seed of the hash functions; signatures are only comparable with equal seeds.
+
+    Returns:
+        numpy.ndarray of shape (n_rows, num_perm), the smallest unsigned dtype holding bits, or
+            for bits < 8 uint8 of shape (n_rows, num_perm * bits / 8) with the minima packed
+            (see unpack_signatures). Rows without features hold the maximum value at every position.
+
+    Raises:
+        ValueError: If bits < 8 and num_perm is not a multiple of 8.
+    """
+    width = signature_width(num_perm, bits)
+    column = as_feature_column(column)
+    sizes = column.sizes()
+    ids = np.asarray(column.ids, dtype=np.uint64)
+    starts = np.asarray(column.offsets[:-1], dtype=np.int64)[sizes > 0]
+    salts = mix64(np.arange(num_perm, dtype=np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15))
+
+    full = np.full((len(sizes), num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+    with stage("minhash"):
+        # One vectorized pass over all features per hash function, the minima per row via reduceat
+        for i, salt in enumerate(salts):
+            if len(starts):
+                full[sizes > 0, i] = np.minimum.reduceat(mix64(ids ^ salt), starts)
+    count("minhash_rows", len(sizes))
+
+    if bits is None:
+        return full
+    minima = (full & np.uint64((1 << bits) - 1)).astype(_signature_dtype(bits))
+    if not _packed(bits):
+        return minima
+    # The lowest bits of every position, one position after another
+    planes = np.unpackbits(minima[:, :, None], axis=2, bitorder='little')[:, :, :bits]
+    return np.packbits(planes.reshape(len(minima), width * 8), axis=1, bitorder='little')
+
+
+def _signature_tokens(signatures:np.ndarray, bits:int = None):
+    # Position i with value v becomes one uint64 token, so the number of agreeing positions of two
+    # signatures is the intersection of their token sets, i.e. one sparse product (see kernels.py)
+    signatures = unpack_signatures(signatures, bits)
+    positions = mix64(np.arange(signatures.shape[1], dtype=np.uint64) + np.uint64(1))
+    tokens = mix64(signatures.astype(np.uint64) ^ positions)
+    rows = np.empty(len(tokens), dtype=object)
+    for i, row in enumerate(tokens):
+        rows[i] = np.unique(row)
+    return rows
+
+
+def approximate_jaccard(signatures1:np.ndarray, signatures2:np.ndarray, bits:int = None, sizes1=None, sizes2=None) -> np.ndarray:
+    """
+    Estimates the Jaccard index |x intersection y| / |x union y| of all pairs of rows.
+
+    Args:
+        signatures1: Signatures of n1 rows, see minhash_signatures.
+        signatures2: Signatures of shape (n2, num_perm), with the same num_perm, bits and seed.
+        bits: The bits the signatures were computed with.
+        sizes1, sizes2: Optional set sizes; pairs with an empty set get 0, like the exact kernel.
+
+    Returns:
+        numpy.ndarray of shape (n1, n2).
+    """
+    num_perm = signature_positions(signatures1, bits)
+    if signature_positions(signatures2, bits) != num_perm:
+        raise ValueError(f"Signatures of length {num_perm} and {signature_positions(signatures2, bits)} are not comparable")
+    with stage("kernel_build"):
+        agreement = intersection_kernel(_signature_tokens(signatures1, bits), _signature_tokens(signatures2, bits)) / num_perm
+        if bits is not None:
+            # Two different minima agree in their lowest b bits with probability 2^-b
+            chance = 2.0 ** -bits
+            agreement = np.clip((agreement - chance) / (1.0 - chance), 0.0, 1.0)
+        if sizes1 is not None and sizes2 is not None:
+            agreement[np.asarray(sizes1) == 0, :] = 0.0
+            agreement[:, np.asarray(sizes2) == 0] = 0.0
+    count("kernel_entries", agreement.size)
+    return agreement
+
+
+def approximate_intersection(signatures1:np.ndarray, signatures2:np.ndarray, sizes1, sizes2, bits:int = None) -> np.ndarray:
+    """
+    Estimates |x intersection y| of all pairs of rows from their signatures and exact set sizes.
+
+    Args:
+        signatures1, signatures2: Signatures, see approximate_jaccard.
+        sizes1, sizes2: Exact set sizes of the rows, e.g. FeatureColumn.sizes().
+        bits: The bits the signatures were computed with.
+
+    Returns:
+        numpy.ndarray of shape (n1, n2), never larger than the smaller set of a pair.
+    """
+    sizes1 = np.asarray(sizes1, dtype=np.float64)
+    sizes2 = np.asarray(sizes2, dtype=np.float64)
+    jaccard = approximate_jaccard(signatures1, signatures2, bits, sizes1, sizes2)
+    intersection = jaccard / (1.0 + jaccard) * np.add.outer(sizes1, sizes2)
+    return np.minimum(intersection, np.minimum.outer(sizes1, sizes2))
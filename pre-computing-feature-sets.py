@@ -1,58 +1,58 @@
-from synkit.IO import rsmi_to_graph
-from _blake2 import blake2b
-from networkx.algorithms import all_pairs_shortest_path
-from drf_implementation import vertex_drf, edge_drf, shortest_path_drf
-import pandas as pd
+from drf_implementation import reaction_features
+from feature_cache import FeatureCache, DEFAULT_CACHE
+from feature_ids import EMPTY
+from feature_pipeline import read_reaction_chunks, map_chunks, iter_rows, write_shards
 
-def calculate_symmetric_difference_off_dict(dict1, dict2):
-  # Calculate for each key in both dicts the symmetric difference of their value sets
-  symm_diff = dict()
-  all_keys = set(dict1.keys()).union(set(dict2.keys()))
-  for key in all_keys:
-    set1 = set(dict1.get(key, []))
-    set2 = set(dict2.get(key, []))
-    symm_diff[key] = set1.symmetric_difference(set2)
-  return symm_diff
-
-# Load schneider50k-clean.tsv to dataframe
-df = pd.read_csv("schneider50k_clean.tsv",sep="\t")
-
-# For each reaction in the dataframe, compute the phi_vertex_dict_graph, phi_edge_graph, and phi_shortest_path_graph
-# Store in a new dataframe consisting of 
+# For each reaction in schneider50k-clean.tsv, compute the phi_vertex_dict_graph, phi_edge_graph, and phi_shortest_path_graph
+# Store in a sharded feature store (see feature_pipeline.py) with the columns
 ### educt_phi_vertex_dict, product_phi_vertex_dict, symmetric_difference_vertex_dict,
 ### educt_phi_edge, product_phi_edge, symmetric_difference_edge,
-### educt_phi_shortest_path, product_phi_shortest_path, symmetric_difference_shortest_path
-df_features = pd.DataFrame(columns=[
+### educt_phi_shortest_path, product_phi_shortest_path, symmetric_difference_shortest_path,
+### its_phi_vertex_dict, its_phi_edge, its_phi_shortest_path
+COLUMNS = [
     "educt_phi_vertex_dict", "product_phi_vertex_dict", "symmetric_difference_vertex_dict",
     "educt_phi_edge", "product_phi_edge", "symmetric_difference_edge",
-    "educt_phi_shortest_path", "product_phi_shortest_path", "symmetric_difference_shortest_path"
-])
-
-for index, row in df.iterrows():
-  rsmi = row["clean_rxn"]
-
-  educt_phi_vertex_dict, product_phi_vertex_dict, symm_diff_vertices_test = vertex_drf(rsmi)
-
-  educt_phi_edge, product_phi_edge, symm_diff_edges_test = edge_drf(rsmi)
-
-  educt_phi_shortest_path, product_phi_shortest_path, symm_diff_shortest_paths_test = shortest_path_drf(rsmi)
-
-  # Print short summary
-  print(f"Processed reaction {index}/{len(df)}")
-  df_features = pd.concat([df_features, pd.DataFrame([{
-      "educt_phi_vertex_dict": educt_phi_vertex_dict,
-      "product_phi_vertex_dict": product_phi_vertex_dict,
-      "symmetric_difference_vertex_dict": symm_diff_vertices_test,
-      "educt_phi_edge": educt_phi_edge,
-      "product_phi_edge": product_phi_edge,
-      "symmetric_difference_edge": symm_diff_edges_test,
-      "educt_phi_shortest_path": educt_phi_shortest_path,
-      "product_phi_shortest_path": product_phi_shortest_path,
-      "symmetric_difference_shortest_path": symm_diff_shortest_paths_test
-  }])], ignore_index=True)
-
-  # Test: Break after 1 reaction
-  if index >= 0:
-    # Write to excel
-    #df_features.to_excel("schneider50k_features.xlsx", index=False)
-    break;
\ No newline at end of file
+    "educt_phi_shortest_path", "product_phi_shortest_path", "symmetric_difference_shortest_path",
+    "its_phi_vertex_dict", "its_phi_edge", "its_phi_shortest_path"
+]
+OUT_DIR = "data/phi_feature_store"
+# MinHash settings, e.g. {"num_perm": 256, "bits": 8}, to store signatures next to every column for the
+# approximate kernels (see minhash.py), None to skip
+MINHASH = None
+# Bounded shortest-path features for large molecules: only paths of up to MAX_DISTANCE hops and at most
+# MAX_PATHS_PER_SOURCE paths per source atom, rounded up to whole BFS levels (see shortest_paths.ShortestPathForest), None for all
+MAX_DISTANCE = None
+MAX_PATHS_PER_SOURCE = None
+
+def featurize_chunk(chunk):
+  # Worker: features of one (first row, SMILES, classes) chunk of the TSV
+  first_row, rsmis, rxn_classes = chunk
+  features = []
+  # The path limits are part of the feature settings the cache is keyed by
+  kind = "reaction_features" if (MAX_DISTANCE, MAX_PATHS_PER_SOURCE) == (None, None) else f"reaction_features_d{MAX_DISTANCE}_p{MAX_PATHS_PER_SOURCE}"
+  # Features of reactions computed in earlier (or interrupted) runs and of duplicate reactions are taken from the cache
+  with FeatureCache(DEFAULT_CACHE) as cache:
+    for offset, rsmi in enumerate(rsmis):
+      value = cache.get(rsmi, kind)
+      if value is None:
+        # Only featurization errors mark a reaction as failed, cache and IO errors are raised
+        try:
+          # Vertex, edge and shortest path DRFs (plus the ITS features) from a single parse of the reaction
+          value = reaction_features(rsmi, MAX_DISTANCE, MAX_PATHS_PER_SOURCE)
+        except Exception as e:
+          print(f"Error processing reaction {first_row + offset}: {type(e).__name__}: {e}")
+          features.append({name: EMPTY for name in COLUMNS})
+          continue
+        cache.put(rsmi, kind, value)
+      features.append(value)
+    print(cache.report())
+  return rxn_classes, features
+
+if __name__ == "__main__":
+  # Create the cache table once before the workers open the file concurrently
+  FeatureCache(DEFAULT_CACHE).close()
+  # Reactions are streamed chunk by chunk, memory stays flat however large the TSV is
+  chunks = read_reaction_chunks("schneider50k_clean.tsv", chunk_size=500)
+  # The path limits are recorded in the manifest, so reactions searched against the store are featurized the same way
+  write_shards(iter_rows(map_chunks(featurize_chunk, chunks)), OUT_DIR, COLUMNS, shard_size=10000, minhash=MINHASH,
+               featurization={"max_distance": MAX_DISTANCE, "max_paths_per_source": MAX_PATHS_PER_SOURCE})
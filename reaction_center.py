@@ -0,0 +1,276 @@
+"""Reaction-center-localized DRF features.
+
+The DRF columns of WL_algorithm.py are the symmetric differences of the getWL features of the
+educt and the product graph. Both graphs share everything outside the reaction center, the
+atoms whose bonds change in the ITS graph. A WL label of iteration h only depends on the atoms
+within h hops, so it is identical in both graphs for every atom farther than h hops from the
+center, and so are the edges between two such atoms and the shortest paths that run through
+such atoms only and follow the same BFS tree path in both graphs.
+
+The symmetric difference can still not be computed from the center alone. Feature sets are
+sets: a feature of the center that also occurs in the unchanged part of the molecule is
+contained in both graphs and must not show up in the DRF. With R the features of the unchanged
+("remote") units, which both graphs share, and X, Y the features of the remaining ("local")
+units of either graph:
+    (R | X) ^ (R | Y) = (X ^ Y) - R
+So one graph is featurized completely and split into X and R, and the other graph only
+recomputes its local units: the WL labels within h hops of the center, the edges touching
+them and the shortest paths through them (plus the pairs whose BFS tree path differs between
+the graphs because of a tie broken differently or a changed bond). The result equals the full
+symmetric difference exactly.
+
+The recomputed labels and edges are proportional to the h-hop neighborhood of the center. The
+shortest paths are not local in the same way: a formed or broken bond reroutes the paths of
+many pairs far from the center, and both BFS forests are still built completely to detect them.
+The savings therefore grow with the molecule; for small reactions whose center neighborhood is
+most of the molecule, the bookkeeping costs about as much as it saves.
+"""
+import numpy as np
+from compact_graph import CompactGraph, as_compact_graph
+from feature_ids import get_hash
+from shortest_paths import ShortestPathForest
+from wl_labels import edge_label
+from instrumentation import stage, count
+
+# Distance of the atoms that are not connected to the reaction center at all
+_FAR = np.iinfo(np.int64).max
+
+
+def reaction_center(its_graph) -> set:
+    """
+    Returns the node ids of the reaction center: the atoms of the ITS bonds whose order changes
+    (including bonds that are formed or broken).
+
+    Args:
+        its_graph (nx.Graph): ITS graph with (educt order, product order) 'order' edge attributes.
+    """
+    center = set()
+    for u, v, data in its_graph.edges(data=True):
+        order = data.get('order')
+        if order[0] != order[1]:
+            center.update((u, v))
+    return center
+
+
+def _changed_atoms(graph_a:CompactGraph, graph_b:CompactGraph) -> set:
+    # Atoms whose presence, element or bonds differ between the graphs. For an ITS built from the
+    # same graphs these are center atoms already, the union only guarantees exactness if not.
+    elements_a = dict(zip(graph_a.node_ids, graph_a.elements.tolist()))
+    elements_b = dict(zip(graph_b.node_ids, graph_b.elements.tolist()))
+    changed = set(elements_a.keys() ^ elements_b.keys())
+    changed.update(n for n in elements_a.keys() & elements_b.keys() if elements_a[n] != elements_b[n])
+    for bond, _ in _bonds(graph_a).items() ^ _bonds(graph_b).items():
+        changed.update(bond)
+    return changed
+
+
+def _bonds(graph:CompactGraph) -> dict:
+    ids = graph.node_ids
+    return {frozenset((ids[u], ids[v])): code for u, v, code in zip(graph.edge_u.tolist(), graph.edge_v.tolist(), graph.edge_orders.tolist())}
+
+
+def _center_distances(graph:CompactGraph, center:set) -> np.ndarray:
+    # Multi-source BFS: hop distance of every node position to the nearest center atom
+    adjacency = graph.adjacency_lists()
+    distances = np.full(graph.number_of_nodes(), _FAR, dtype=np.int64)
+    frontier = [i for i, n in enumerate(graph.node_ids) if n in center]
+    distances[frontier] = 0
+    d = 0
+    while frontier:
+        d += 1
+        next_frontier = []
+        for u in frontier:
+            for w in adjacency[u]:
+                if distances[w] == _FAR:
+                    distances[w] = d
+                    next_frontier.append(w)
+        frontier = next_frontier
+    return distances
+
+
+def _stable_pairs(forest:ShortestPathForest, other:ShortestPathForest, to_forest:np.ndarray, reach:np.ndarray):
+    """
+    Compares the BFS trees of the fully featurized graph with those of the other graph.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Per entry of forest, whether both forests emit
+            its pair from the same source along the same tree path, and the smallest center distance
+            on that path; per entry of other, the entry of forest with the same (source, target), -1 if none.
+    """
+    n = len(forest.nodes)
+    key = forest.source * n + forest.target
+    other_source = to_forest[other.source]
+    other_target = to_forest[other.target]
+    other_key = np.where((other_source >= 0) & (other_target >= 0), other_source * n + other_target, -1)
+    order = np.argsort(other_key)
+    positions = np.minimum(np.searchsorted(other_key[order], key), len(order) - 1)
+    match = order[positions]
+    found = other_key[match] == key
+
+    # Same tree path: the same parent in every level, checked top-down like the prefix hashes
+    same = found & (other_target[other.parent[match]] == forest.target[forest.parent])
+    nearest = reach[forest.target].copy()
+    for d in range(1, len(forest.level_bounds) - 1):
+        level = slice(forest.level_bounds[d], forest.level_bounds[d + 1])
+        parents = forest.parent[level]
+        same[level] &= same[parents]
+        nearest[level] = np.minimum(nearest[level], nearest[parents])
+    # Pairs are emitted from their smaller node position, which may differ between the graphs
+    emitted = forest.emitted & other.emitted[match]
+
+    entry_of_other = np.full(len(other), -1, dtype=np.int64)
+    entry_of_other[match[found]] = np.flatnonzero(found)
+    return same & emitted, nearest, entry_of_other
+
+
+def localized_drf(educt_graph, product_graph, its_graph, h_max:int, relabel:str = "string", compressor = None,
+                  early_stop:bool = True, max_distance:int = None, max_paths_per_source:int = None) -> tuple:
+    """
+    Computes the DRF node, shortest-path and edge features of a reaction, i.e. the symmetric
+    differences of the getWL features of its educt and product graph, recomputing only the
+    neighborhood of the reaction center in one of the two graphs.
+
+    Args:
+        educt_graph, product_graph (nx.Graph or CompactGraph): Educt and product graph.
+        its_graph (nx.Graph): ITS graph of the reaction, see reaction_center.
+        h_max (int): Number of WL iterations.
+        relabel (str): WL relabeling mode, see WL_algorithm.getWL.
+        compressor (WLLabelCompressor): Signature dictionary for relabel="compressed".
+        early_stop (bool): For relabel="compressed", stop once the joint label partition of both graphs is stable.
+        max_distance, max_paths_per_source (int): Bound the shortest-path features, see WL_algorithm.getWL.
+
+    Returns:
+        tuple[set, set, set]: Node, shortest-path and edge DRF, equal to the symmetric differences of getWL
+            (getWL_compressed_joint for relabel="compressed").
+    """
+    if relabel == "string":
+        initial, refine, code = str, _concatenate, get_hash
+        order_label, edge_feature = str, _string_edge_feature
+    elif relabel == "compressed":
+        initial, refine, code = compressor.initial_label, compressor.compress, int
+        order_label, edge_feature = compressor.order_code, edge_label
+    else:
+        raise ValueError(f"Unknown relabel mode '{relabel}'")
+    early_stop = early_stop and relabel == "compressed"
+
+    # The smaller graph is featurized completely, the symmetric difference does not depend on the order
+    full, other = sorted((as_compact_graph(educt_graph), as_compact_graph(product_graph)), key=CompactGraph.number_of_nodes)
+    with stage("apsp"):
+        forest = ShortestPathForest(full, max_distance, max_paths_per_source)
+        other_forest = ShortestPathForest(other, max_distance, max_paths_per_source)
+    with stage("localization"):
+        center = reaction_center(its_graph) | _changed_atoms(full, other)
+        position = {n: i for i, n in enumerate(full.node_ids)}
+        to_full = np.fromiter((position.get(n, -1) for n in other.node_ids), dtype=np.int64, count=other.number_of_nodes())
+        # Both graphs agree on the distance of every shared atom outside the center, take the smaller one to be safe
+        reach = _center_distances(full, center)
+        other_reach = _center_distances(other, center)
+        shared = to_full >= 0
+        reach[to_full[shared]] = other_reach[shared] = np.minimum(reach[to_full[shared]], other_reach[shared])
+        stable, nearest, entry_of_other = _stable_pairs(forest, other_forest, to_full, reach)
+    count("reaction_center_atoms", len(center))
+
+    adjacency = full.adjacency_lists()
+    other_adjacency = other.adjacency_lists()
+    edges = [(u, v, order_label(order)) for u, v, order in full.edges()]
+    other_edges = [(u, v, order_label(order)) for u, v, order in other.edges()]
+    edge_reach = np.minimum(reach[full.edge_u], reach[full.edge_v])
+    other_edge_reach = np.minimum(other_reach[other.edge_u], other_reach[other.edge_v])
+    emitted = forest.emitted
+    other_emitted = other_forest.emitted
+    copy_from = np.maximum(to_full, 0).tolist()
+
+    labels = [initial(element) for element in full.element_symbols()]
+    other_labels = [labels[i] for i in copy_from]
+    other_elements = other.element_symbols()
+    for p in np.flatnonzero(other_reach <= 0).tolist():
+        other_labels[p] = initial(other_elements[p])
+    # Features of the local units of both graphs and of the remote units, which both graphs share
+    local = {"N": [], "SP": [], "E": []}
+    other_local = {"N": [], "SP": [], "E": []}
+    remote = {"N": [], "SP": [], "E": []}
+
+    for h in range(h_max+1):
+        count("wl_iterations")
+        with stage("wl_iteration"):
+            codes = np.fromiter((code(label) for label in labels), dtype=np.uint64, count=len(labels))
+            other_codes = codes[copy_from]
+            recomputed = np.flatnonzero(other_reach <= h)
+            for p in recomputed.tolist():
+                other_codes[p] = code(other_labels[p])
+            count("recomputed_labels", len(recomputed))
+
+            # Node features of this iteration are the label codes themselves
+            _split(codes, reach <= h, local["N"], remote["N"])
+            other_local["N"].append(other_codes[recomputed])
+
+            edge_features = np.fromiter((edge_feature(labels[u], order, labels[v]) for u, v, order in edges), dtype=np.uint64, count=len(edges))
+            _split(edge_features, edge_reach <= h, local["E"], remote["E"])
+            other_local["E"].append(np.fromiter((edge_feature(other_labels[u], order, other_labels[v]) for u, v, order in
+                                                 (other_edges[e] for e in np.flatnonzero(other_edge_reach <= h).tolist())), dtype=np.uint64))
+
+            # Shortest paths: a pair is remote if both graphs hash the same tree path of remote atoms
+            is_remote = stable & (nearest > h)
+            _, path_features = forest.feature_arrays(codes, include_distance=True)
+            _split(path_features, ~np.tile(is_remote[emitted], 2), local["SP"], remote["SP"])
+            recompute = other_emitted & ~((entry_of_other >= 0) & is_remote[entry_of_other])
+            needed = _with_ancestors(other_forest, recompute)
+            subforest = other_forest if needed.all() else other_forest.subforest(needed)
+            _, other_path_features = subforest.feature_arrays(other_codes, include_distance=True, entries=recompute[needed])
+            other_local["SP"].append(other_path_features)
+
+            if h == h_max:
+                break
+            new_labels = [refine(labels[n], [labels[m] for m in neighbors]) for n, neighbors in enumerate(adjacency)]
+            new_other_labels = [new_labels[i] for i in copy_from]
+            for p in np.flatnonzero(other_reach <= h + 1).tolist():
+                new_other_labels[p] = refine(other_labels[p], [other_labels[m] for m in other_adjacency[p]])
+
+        # Same stopping rule as getWL_compressed_joint, on the joint label set of both graphs
+        if early_stop and len(set(new_labels).union(new_other_labels)) == len(set(labels).union(other_labels)):
+            break
+        labels, other_labels = new_labels, new_other_labels
+
+    with stage("set_algebra"):
+        return tuple(set(_drop_contained(np.setxor1d(_unique(local[name]), _unique(other_local[name]), assume_unique=True), remote[name]).tolist())
+                     for name in ("N", "SP", "E"))
+
+
+def _concatenate(label:str, neighbor_labels:list) -> str:
+    # String relabeling of getWL: the label followed by the sorted neighbor labels
+    return label + "".join(sorted(neighbor_labels))
+
+
+def _string_edge_feature(label_a:str, order:str, label_b:str) -> int:
+    # Edge feature of getWL: both labels in sorted order around the bond order
+    return get_hash(f"{label_a}{order}{label_b}" if label_a <= label_b else f"{label_b}{order}{label_a}")
+
+
+def _split(features:np.ndarray, is_local:np.ndarray, local:list, remote:list):
+    local.append(features[is_local])
+    remote.append(features[~is_local])
+
+
+def _unique(arrays:list) -> np.ndarray:
+    # Sorted and deduplicated by hand, np.unique falls back to a much slower hash table for large uint64 arrays
+    features = np.sort(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.uint64)
+    return features[np.concatenate(([True], features[1:] != features[:-1]))] if len(features) else features
+
+
+def _drop_contained(candidates:np.ndarray, arrays:list) -> np.ndarray:
+    # candidates without the features contained in any of the arrays. The remote features are the
+    # bulk of a large molecule, one sort is cheaper than deduplicating them
+    contained = np.sort(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.uint64)
+    positions = np.minimum(np.searchsorted(contained, candidates), max(len(contained) - 1, 0))
+    if not len(contained):
+        return candidates
+    return candidates[contained[positions] != candidates]
+
+
+def _with_ancestors(forest:ShortestPathForest, entries:np.ndarray) -> np.ndarray:
+    # Selected entries plus all their tree ancestors, which the prefix hashes need
+    needed = entries.copy()
+    for d in range(len(forest.level_bounds) - 2, 0, -1):
+        level = slice(forest.level_bounds[d], forest.level_bounds[d + 1])
+        needed[forest.parent[level][needed[level]]] = True
+    return needed
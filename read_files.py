@@ -1,10 +1,13 @@
 # Exemplary code
 
-import glob
-import pandas as pd
+from feature_store import load_feature_column, load_rxn_class, store_columns, DEFAULT_STORE
 
-for file in glob.glob("data/*.xlsx"):
-    data = pd.read_excel(file)
-    print(f"File: {file}, Rows: {len(data)}")
+# Columns are memory-mapped one at a time (shard by shard for a sharded store), see feature_store.py for the on-disk layout
+rxn_class = load_rxn_class(DEFAULT_STORE)
+print(f"Store: {DEFAULT_STORE}, Rows: {len(rxn_class)}")
+for name in store_columns(DEFAULT_STORE):
+    column = load_feature_column(DEFAULT_STORE, name)
+    print(f"Column: {name}, Features: {column.sizes().sum()}")
     # Print the first 20 rows
-    print(data.head(20))
\ No newline at end of file
+    for i in range(min(20, len(column))):
+        print(rxn_class[i], column[i])
@@ -1,6 +1,4 @@
 from synkit.IO import rsmi_to_its
-from synkit.Vis import GraphVisualizer
-import matplotlib.pyplot as plt
 import random
 import pandas as pd
 
@@ -14,8 +12,10 @@ def plot_and_print_its_graphs(rsmi:str):
   for u,v, d in full_graph.edges(data=True):
       print(u,v, d)
 
-  # Visualize ITS
+  # Visualize ITS (visualization libraries are only imported when needed)
   try:
+    from synkit.Vis import GraphVisualizer
+    import matplotlib.pyplot as plt
     viz = GraphVisualizer()
     fig = viz.visualize_its(full_graph, use_edge_color=True)
     plt.show()
@@ -28,15 +28,19 @@ def plot_and_print_its_graphs(rsmi:str):
 #   df: DataFrame containing the dataset with a 'rxn_class' column
 #   classes: Number of unique reaction classes to sample
 #   reactions_per_class: Number of reactions to sample per class
+#   keep_index: Keep the row labels of data, e.g. to slice a precomputed Gram matrix of the whole pool
+#   random_state: Seed of the row sampling, for reproducible experiments (random if None)
 # Returns:
 
-def create_varied_set(data, chosen_classes:list, reactions_per_class:int) -> pd.DataFrame:
+def create_varied_set(data, chosen_classes:list, reactions_per_class:int, keep_index:bool = False, random_state:int = None) -> pd.DataFrame:
     varied_set = pd.DataFrame() # Return as array of DataFrames to concatenate later
 
     for cls in chosen_classes:
         if not reactions_per_class:
             reactions_per_class = random.randint(20, 200)
-        class_subset = data[data['rxn_class'] == cls].sample(n=reactions_per_class)
+        class_subset = data[data['rxn_class'] == cls].sample(n=reactions_per_class, random_state=random_state)
         varied_set = pd.concat([varied_set, class_subset])
 
+    if keep_index:
+        return varied_set
     return varied_set.reset_index(drop=True)
\ No newline at end of file
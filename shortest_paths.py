@@ -0,0 +1,281 @@
+"""Shortest-path features from BFS trees with prefix hashes.
+
+One BFS per source yields a shortest path to every other node as a path in the BFS tree.
+Instead of joining and hashing the label string of every path, each path hash is derived
+from the hash of its parent prefix in the tree:
+    forward(s..t)  = forward(s..parent(t)) * B + code(t)
+    backward(s..t) = backward(s..parent(t)) + code(t) * B^depth(t)
+backward is the polynomial hash of the reversed path, so min(forward, backward) does not
+depend on the direction in which a path is read. Every unordered pair {s, t} is emitted
+once. All trees are processed together, level by level, with NumPy uint64 arithmetic
+(wrapping modulo 2^64), so the cost is proportional to the number of pairs and not to
+pairs times path length.
+
+The number of pairs still grows quadratically with the number of atoms. A forest built with
+max_distance stops every BFS after that many hops, and max_paths_per_source stops it at the end
+of the first BFS level that brings it to that many targets, so for fixed limits and bounded
+degree the cost per graph is linear in the number of atoms. A pair is kept if it is in the tree
+of either of its nodes; whole levels are kept, so the kept pairs only depend on the graph and
+not on the node order. The pairs left out this way are counted in skipped_pairs.
+
+Feature IDs only depend on the node label codes, so they are stable across runs and processes.
+"""
+import numpy as np
+from compact_graph import as_compact_graph
+from feature_ids import get_hash
+from instrumentation import count
+
+_BASE = np.uint64(0x100000001B3)
+_PATH_TAG = np.uint64(0x9E3779B97F4A7C15)
+_DIST_TAG = np.uint64(0xC2B2AE3D27D4EB4F)
+_MASK = (1 << 64) - 1
+
+
+def mix64(x):
+    """splitmix64 finalizer on uint64 arrays, used to spread the polynomial hashes over all 64 bits."""
+    x = np.asarray(x, dtype=np.uint64)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class ShortestPathForest:
+    """
+    The BFS trees of all sources of a graph, built once and reused for every node labelling
+    (e.g. every WL iteration).
+
+    All trees are stored as one flat array of (source, target, parent entry, depth),
+    ordered by depth, so prefix hashes can be computed one BFS level at a time for all sources.
+    emitted marks the one entry per kept unordered pair that the features are computed from.
+    """
+    __slots__ = ('nodes', 'source', 'target', 'parent', 'depth', 'emitted', 'level_bounds', 'skipped_pairs')
+
+    def __init__(self, graph, max_distance:int = None, max_paths_per_source:int = None):
+        """
+        Args:
+            graph (nx.Graph or CompactGraph): Input molecular graph.
+            max_distance: Only follow shortest paths of up to this many hops, None for all.
+            max_paths_per_source: Stop every BFS at the end of the first level that brings it to at
+                least this many targets, None for all. A pair is kept if it is in the tree of either
+                of its nodes and emitted from the tree of its smaller node position that contains it.
+        """
+        graph = as_compact_graph(graph)
+        self.nodes = graph.node_ids
+        adjacency = graph.adjacency_lists()
+
+        source, target, parent, depth = [], [], [], []
+        # Depth of the last complete level of every BFS
+        radius = [0] * len(self.nodes)
+        for s in range(len(self.nodes)):
+            # Queue-based BFS discovers nodes in the same order as nx.single_source_shortest_path
+            root = len(target)
+            source.append(s)
+            target.append(s)
+            parent.append(root)
+            depth.append(0)
+            entry_of = {s: root}
+            head = root
+            while head < len(target):
+                # Entries are discovered in order of depth, at the first entry of a level all
+                # targets up to that depth are known and the limits are checked
+                if head == root or depth[head] != depth[head - 1]:
+                    if max_distance is not None and depth[head] >= max_distance:
+                        break
+                    if max_paths_per_source is not None and len(target) - root - 1 >= max_paths_per_source:
+                        break
+                u = target[head]
+                for w in adjacency[u]:
+                    if w not in entry_of:
+                        entry_of[w] = len(target)
+                        source.append(s)
+                        target.append(w)
+                        parent.append(head)
+                        depth.append(depth[head] + 1)
+                head += 1
+            radius[s] = depth[-1]
+
+        source = np.asarray(source, dtype=np.int64)
+        target = np.asarray(target, dtype=np.int64)
+        depth = np.asarray(depth, dtype=np.int64)
+        # A pair in both trees is emitted from the smaller node position, otherwise from the tree that has it
+        emitted = (target > source) | ((target != source) & (depth > np.asarray(radius, dtype=np.int64)[target]))
+        self._set_entries(source, target, np.asarray(parent, dtype=np.int64), depth, emitted)
+        self.skipped_pairs = 0
+        if max_distance is not None or max_paths_per_source is not None:
+            self.skipped_pairs = self._connected_pairs(adjacency) - int(np.count_nonzero(self.emitted))
+            count("skipped_pairs", self.skipped_pairs)
+
+    @staticmethod
+    def _connected_pairs(adjacency) -> int:
+        # Number of unordered node pairs joined by some path, i.e. the pairs of an unbounded forest
+        seen = [False] * len(adjacency)
+        pairs = 0
+        for start in range(len(adjacency)):
+            if seen[start]:
+                continue
+            seen[start] = True
+            stack = [start]
+            size = 0
+            while stack:
+                u = stack.pop()
+                size += 1
+                for w in adjacency[u]:
+                    if not seen[w]:
+                        seen[w] = True
+                        stack.append(w)
+            pairs += size * (size - 1) // 2
+        return pairs
+
+    @classmethod
+    def merge(cls, forests):
+        """
+        Merges the forests of several graphs into one forest over their disjoint union,
+        e.g. to compute the shortest-path features of a whole batch of graphs at once.
+        Node positions of the i-th forest are shifted by the number of nodes of the forests before it.
+        """
+        forest = cls.__new__(cls)
+        forest.nodes = [n for f in forests for n in f.nodes]
+        forest.skipped_pairs = sum(f.skipped_pairs for f in forests)
+        node_offsets = np.cumsum([0] + [len(f.nodes) for f in forests])
+        entry_offsets = np.cumsum([0] + [len(f) for f in forests])
+        forest._set_entries(
+            np.concatenate([f.source + node_offsets[i] for i, f in enumerate(forests)] or [np.empty(0, dtype=np.int64)]),
+            np.concatenate([f.target + node_offsets[i] for i, f in enumerate(forests)] or [np.empty(0, dtype=np.int64)]),
+            np.concatenate([f.parent + entry_offsets[i] for i, f in enumerate(forests)] or [np.empty(0, dtype=np.int64)]),
+            np.concatenate([f.depth for f in forests] or [np.empty(0, dtype=np.int64)]),
+            np.concatenate([f.emitted for f in forests] or [np.empty(0, dtype=bool)])
+        )
+        return forest
+
+    def subforest(self, entries):
+        """
+        Returns the forest of the entries selected by a boolean mask, e.g. to hash only some of the paths.
+        The mask must also select the parent of every selected entry. Node positions stay the same.
+        """
+        entries = np.asarray(entries, dtype=bool)
+        forest = self.__class__.__new__(self.__class__)
+        forest.nodes = self.nodes
+        forest.skipped_pairs = self.skipped_pairs
+        new_entry = np.cumsum(entries) - 1
+        forest._set_entries(self.source[entries], self.target[entries], new_entry[self.parent[entries]], self.depth[entries],
+                            self.emitted[entries])
+        return forest
+
+    def _set_entries(self, source, target, parent, depth, emitted):
+        # Reorder all entries by depth, parents always precede their children
+        order = np.argsort(depth, kind='stable')
+        new_entry = np.empty_like(order)
+        new_entry[order] = np.arange(len(order))
+        self.source = source[order]
+        self.target = target[order]
+        self.parent = new_entry[parent[order]]
+        self.depth = depth[order]
+        self.emitted = emitted[order]
+        self.level_bounds = np.searchsorted(self.depth, np.arange(self.depth.max() + 2 if len(self.depth) else 1))
+
+    def __len__(self):
+        return len(self.target)
+
+    def path_hashes(self, codes):
+        """
+        Returns the direction-independent polynomial hash of the tree path of every entry.
+
+        Args:
+            codes: uint64 array with the label code of every node (in self.nodes order).
+        """
+        codes = np.asarray(codes, dtype=np.uint64)
+        node_codes = codes[self.target]
+        forward = np.empty(len(self), dtype=np.uint64)
+        backward = np.empty(len(self), dtype=np.uint64)
+        power = 1
+        for d in range(len(self.level_bounds) - 1):
+            level = slice(self.level_bounds[d], self.level_bounds[d + 1])
+            if d == 0:
+                forward[level] = node_codes[level]
+                backward[level] = node_codes[level]
+            else:
+                parents = self.parent[level]
+                forward[level] = forward[parents] * _BASE + node_codes[level]
+                backward[level] = backward[parents] + node_codes[level] * np.uint64(power)
+            # Python ints for the running power, NumPy warns on uint64 scalar overflow
+            power = (power * int(_BASE)) & _MASK
+        return np.minimum(forward, backward)
+
+    def feature_arrays(self, codes, include_distance:bool = True, include_self:bool = False, entries = None):
+        """
+        Computes the shortest-path features of the graph under one node labelling as arrays.
+
+        Args:
+            codes: Label code of every node (in self.nodes order), see feature_ids.get_hash.
+            include_distance: Also emit a (label, distance, label) feature per pair.
+            include_self: Also emit the zero-length path of every node.
+            entries: Optional boolean mask over the entries, only the pairs of selected entries are emitted.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Source node position and 64-bit feature ID of every emitted feature.
+        """
+        codes = np.asarray(codes, dtype=np.uint64)
+        paths = self.path_hashes(codes)
+        # Each kept unordered pair once, see emitted
+        keep = self.emitted | (self.target == self.source) if include_self else self.emitted.copy()
+        if entries is not None:
+            keep &= entries
+        depth = self.depth[keep].astype(np.uint64)
+        sources = self.source[keep]
+
+        features = mix64(mix64(paths[keep] + depth) ^ _PATH_TAG)
+        if not include_distance:
+            return sources, features
+
+        a = codes[sources]
+        b = codes[self.target[keep]]
+        low = np.minimum(a, b)
+        high = np.maximum(a, b)
+        distance_features = mix64(mix64(mix64(low ^ _DIST_TAG) + high) + depth)
+        return np.concatenate([sources, sources]), np.concatenate([features, distance_features])
+
+    def features(self, codes, include_distance:bool = True, include_self:bool = False) -> set:
+        """
+        Computes the shortest-path features of the graph under one node labelling.
+
+        Args:
+            codes: Label code of every node (in self.nodes order), see feature_ids.get_hash.
+            include_distance: Also emit a (label, distance, label) feature per pair.
+            include_self: Also emit the zero-length path of every node.
+
+        Returns:
+            set[int]: 64-bit feature IDs.
+        """
+        _, features = self.feature_arrays(codes, include_distance=include_distance, include_self=include_self)
+        return set(features.tolist())
+
+
+def shortest_path_features(graph, labels:dict, include_distance:bool = True, include_self:bool = False,
+                           max_distance:int = None, max_paths_per_source:int = None) -> set:
+    """
+    Convenience wrapper computing the shortest-path features of a graph for one labelling.
+
+    Args:
+        graph (nx.Graph or CompactGraph): Input molecular graph.
+        labels (dict): Node id -> string label.
+        include_distance: Also emit a (label, distance, label) feature per pair.
+        include_self: Also emit the zero-length path of every node.
+        max_distance, max_paths_per_source: Limits of the BFS trees, see ShortestPathForest.
+
+    Returns:
+        set[int]: 64-bit feature IDs.
+
+    Examples (python -m doctest shortest_paths.py), the bounded features do not depend on the node order:
+        >>> import networkx as nx
+        >>> edges = [(1, 2), (2, 3), (3, 4), (3, 5), (5, 6), (6, 7)]
+        >>> labels = {n: "O" if n % 3 == 0 else "C" for n in range(1, 8)}
+        >>> graph, reordered = nx.Graph(), nx.Graph()
+        >>> graph.add_nodes_from(range(1, 8)); reordered.add_nodes_from(range(7, 0, -1))
+        >>> graph.add_edges_from(edges); reordered.add_edges_from(edges)
+        >>> bounded = [shortest_path_features(g, labels, max_paths_per_source=2) for g in (graph, reordered)]
+        >>> bounded[0] == bounded[1]
+        True
+    """
+    forest = ShortestPathForest(graph, max_distance, max_paths_per_source)
+    codes = [get_hash(labels[n]) for n in forest.nodes]
+    return forest.features(codes, include_distance=include_distance, include_self=include_self)
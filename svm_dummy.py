@@ -1,12 +1,24 @@
+"""SVM experiments on the precomputed reaction feature sets.
 
-from sklearn import svm
-from sklearn.model_selection import train_test_split
+Importing the module only defines the functions; sklearn is imported on first use.
+Run the module (or cli.py experiment) to run the configured sweep.
+"""
 import numpy as np
 from scripts import create_varied_set
-import glob
+from kernels import intersection_kernel, intersection_gram_to_file, build_vocabulary, to_sparse_matrix, \
+    parse_kernel_spec, spec_columns, combined_kernel, normalize_intersections, row_sizes
+from scipy import sparse
+from functools import partial
+from feature_store import load_feature_dataframe, is_feature_store, signature_settings, load_signatures
+from minhash import minhash_signatures, minhash_permutations, approximate_intersection, DEFAULT_SEED
+from vocabulary import Vocabulary, load_or_build_vocabulary
+import instrumentation
+from instrumentation import stage
+from hashlib import blake2b
+import os
+from multiprocessing import Pool
 import pandas as pd
 from math import log, ceil
-from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
 
 ### INTRODUCTION ###
 # There are 50 different classes with 1000 reactions each in the dataset.
@@ -19,18 +31,63 @@ CLASSES = 2
 REACTIONS_PER_CLASS = 500
 FEATURE_SET = 'DRF Edges'
 
+# Every entry is a kernel spec (see kernels.parse_kernel_spec): a feature column for the plain intersection kernel,
+# or a weighted sum of intersection/cosine/tanimoto kernels over one or more columns, all derived from the same
+# intersection Gram matrices, e.g. 'cosine(DRF Edges) + 0.5*tanimoto(ITS Shortest Paths)'
 #FEATURE_SETS = ['DRF Nodes', 'DRF Edges', 'DRF Shortest Paths', 'ITS Nodes', 'ITS Edges', 'ITS Shortest Paths']
 FEATURE_SETS = ['DRF Edges']
 #REACTION_SETTINGS = [20, 50, 100, 200]
 REACTION_SETTINGS = [50]
 #CLASS_SETTINGS = [2, 5, 10, 20]
 CLASS_SETTINGS = [2]
+# How the classifier is trained:
+#   "kernel":      SVC with the callable kernel of the spec (my_kernel for a plain column)
+#   "precomputed": SVC on slices of the intersection Gram matrix of the whole pool, computed once per feature column
+#   "linear":      LinearSVC on the binary feature-indicator design matrix (the intersection kernel is its dot product)
+#   "sgd":         SGDClassifier with hinge loss, trained with partial_fit on mini-batches of the design matrix
+#   "minhash":     like "precomputed", but the intersections are estimated from MinHash signatures of fixed size per
+#                  reaction (see minhash.py) instead of sliced from the quadratic pool Gram matrix
+EXPERIMENT_MODE = "precomputed"
+GRAM_CACHE_DIR = "data/gram_cache"
+# Accuracy of the "minhash" mode: the Jaccard estimate of a pair is within MINHASH_ERROR with probability MINHASH_CONFIDENCE.
+# MINHASH_BITS keeps only the lowest bits of every minimum (b-bit MinHash, smaller signatures), None for 64 bits
+MINHASH_ERROR = 0.05
+MINHASH_CONFIDENCE = 0.95
+MINHASH_BITS = 8
+# Document-frequency pruning of every feature column before any kernel is built (see vocabulary.py): features in fewer
+# than MIN_DF or more than MAX_DF reactions are dropped (counts, or fractions if below 1). MIN_DF = 2 drops the
+# singletons, which never contribute to the kernel of two different reactions; 1 and None keep every feature
+MIN_DF = 1
+MAX_DF = None
+SGD_BATCH_SIZE = 4096
+SGD_EPOCHS = 5
+# Seed of the experiment sweep (class sets and row samples are derived from it) and number of worker processes (None: all cores)
+SWEEP_SEED = 42
+PROCESSES = None
+# Collect per-stage timers and counters (kernel build, fit, predict, ...) and write them to INSTRUMENTATION_REPORT
+INSTRUMENTATION = False
+INSTRUMENTATION_REPORT = "results/svm_instrumentation.json"
+# Binary feature store written by feature_store.py, used instead of data/combined_data.xlsx if present
+FEATURE_STORE = "data/feature_store"
 ### END CONFIGURATION VARIABLES ###
 
 dataset = pd.DataFrame()
+# Feature store the dataset was loaded from (None for the Excel file), memory-mapped again by pool workers
+dataset_store = None
+# (min_df, max_df) the feature columns of dataset were pruned with, see prune_dataset
+dataset_pruning = (1, None)
 
 final_dataset = pd.DataFrame()
 
+# Binary design matrix of the whole pool per kernel spec, see load_pool_design_matrix
+design_matrices = {}
+# Set size of every pool row per feature column, see pool_row_sizes
+pool_sizes = {}
+# Memory-mapped intersection Gram matrix of the pool per feature column, see load_pool_gram
+pool_grams = {}
+# MinHash signatures of every pool row per feature column, see load_pool_signatures
+pool_signatures = {}
+
 def my_kernel(X1, X2):
     """
     Computes the intersection kernel between two arrays of sets.
@@ -42,51 +99,270 @@ def my_kernel(X1, X2):
     Returns:
         K: Kernel matrix of shape (n_samples_X, n_samples_Y).
     """
-    # Convert to list if pandas Series
-    if hasattr(X1, 'tolist'):
-        X1 = X1.tolist()
-    if hasattr(X2, 'tolist'):
-        X2 = X2.tolist()
-    
-    n_x1 = len(X1)
-    n_x2 = len(X2)
-
-    K = np.zeros((n_x1, n_x2))
-
-    for i in range(n_x1):
-        for j in range(n_x2):
-            # Compute intersection size
-            K[i, j] = len(X1[i].intersection(X2[j]))
-
-    return K
+    # Evaluated as one sparse product over a shared feature vocabulary, see kernels.py
+    return intersection_kernel(X1, X2)
 
-def run_single_experiment(feature_set:str, chosen_classes:list, reactions_per_class:int):
-    # 2nd step: Create a varied dataset according to configuration variables
-    data = create_varied_set(dataset, chosen_classes=chosen_classes, reactions_per_class=reactions_per_class)
+def parse_feature_sets(X):
+    """
+    Preprocesses strings from the excel file into sets if possible (not so for e.g. NaN).
+    Columns loaded from the binary feature store already hold uint64 arrays and are returned unchanged.
 
-    # 3rd step: Prepare data for SVM
-    X = data[f'{feature_set}']
-    Y = data['rxn_class']
+    Args:
+        X: pandas Series of stringified python sets.
 
-    # 4th step: Preprocess strings from the excel file into sets if possible (not so for e.g. NaN) # TODO: Add a counter for empty sets or some other sort of tracking
+    Returns:
+        pandas Series of python sets with the same index.
+    """
+    if all(isinstance(x, np.ndarray) for x in X):
+        return X
+    X = X.astype(object)
     for idx in X.index:
         x = X[idx]
         try:
             X[idx] = set(map(str, x.strip('{}').split(', ')))
         except AttributeError:
             X[idx] = set()
+    return X
+
+def feature_columns(specs:list) -> list:
+    """Returns the feature columns used by a list of kernel specs, in order of first occurrence."""
+    return list(dict.fromkeys(column for spec in specs for column in spec_columns(spec)))
+
+def kernel_input(data:pd.DataFrame, columns:list):
+    """
+    Returns the input of the callable kernel for the rows of data: the parsed column itself for
+    a single column, otherwise a 2-D object array with one column of feature sets per feature column.
+    """
+    if len(columns) == 1:
+        return parse_feature_sets(data[columns[0]])
+    X = np.empty((len(data), len(columns)), dtype=object)
+    for j, column in enumerate(columns):
+        X[:, j] = parse_feature_sets(data[column]).to_numpy()
+    return X
+
+def load_pool_gram(feature_set:str):
+    """
+    Returns the intersection Gram matrix of the whole dataset pool for one feature set.
+
+    The matrix is computed once and cached in GRAM_CACHE_DIR. The cache file name contains
+    a fingerprint of the raw feature column, so a changed dataset never reuses a stale matrix.
+    The fingerprint is taken and the file mapped once per process and feature set.
+
+    Args:
+        feature_set: Name of the feature column in dataset.
+
+    Returns:
+        numpy.memmap of shape (len(dataset), len(dataset)) holding |x intersection y|.
+    """
+    if feature_set in pool_grams:
+        return pool_grams[feature_set]
+    column = dataset[feature_set]
+    fingerprint = blake2b(digest_size=8)
+    for value in column:
+        fingerprint.update(value.tobytes() if isinstance(value, np.ndarray) else str(value).encode('utf-8'))
+        fingerprint.update(b'\0')
+    path = os.path.join(GRAM_CACHE_DIR, f"{feature_set.replace(' ', '_')}_{fingerprint.hexdigest()}.npy")
+
+    if os.path.exists(path):
+        pool_grams[feature_set] = np.load(path, mmap_mode='r')
+    else:
+        print(f"Computing intersection Gram matrix for feature set '{feature_set}' over {len(column)} reactions.")
+        os.makedirs(GRAM_CACHE_DIR, exist_ok=True)
+        pool_grams[feature_set] = intersection_gram_to_file(parse_feature_sets(column), path)
+    return pool_grams[feature_set]
+
+def pool_row_sizes(feature_set:str) -> np.ndarray:
+    """Returns the set size of every row of the dataset pool for one feature column, computed once."""
+    if feature_set not in pool_sizes:
+        pool_sizes[feature_set] = row_sizes(parse_feature_sets(dataset[feature_set]))
+    return pool_sizes[feature_set]
+
+def load_pool_signatures(feature_set:str) -> np.ndarray:
+    """
+    Returns the MinHash signatures of the whole dataset pool for one feature column.
+
+    The signature length follows from MINHASH_ERROR and MINHASH_CONFIDENCE. Signatures stored
+    in the feature store are used if they were computed with MINHASH_BITS and are long enough,
+    otherwise they are computed once from the column.
+
+    Args:
+        feature_set: Name of the feature column in dataset.
+
+    Returns:
+        numpy.ndarray of shape (len(dataset), signature length).
+    """
+    if feature_set not in pool_signatures:
+        num_perm = minhash_permutations(MINHASH_ERROR, MINHASH_CONFIDENCE, MINHASH_BITS)
+        # Stored signatures describe the unpruned columns
+        settings = signature_settings(dataset_store) if dataset_store is not None and dataset_pruning == (1, None) else None
+        if settings is not None and settings.get("bits") == MINHASH_BITS and settings.get("num_perm", 0) >= num_perm \
+                and settings.get("seed") in (None, DEFAULT_SEED):
+            pool_signatures[feature_set] = load_signatures(dataset_store, feature_set, num_perm)
+        else:
+            print(f"Computing {num_perm} MinHash signatures for feature set '{feature_set}' over {len(dataset)} reactions.")
+            pool_signatures[feature_set] = minhash_signatures(parse_feature_sets(dataset[feature_set]), num_perm, MINHASH_BITS)
+    return pool_signatures[feature_set]
+
+def pool_kernel_block(spec:str, rows1, rows2, approximate:bool = False) -> np.ndarray:
+    """
+    Returns the kernel of a kernel spec between two sets of pool rows.
+
+    Every term is sliced out of the cached intersection Gram matrix of its column and
+    normalized with the cached row sizes, so no term computes intersections of its own.
+    With approximate set, the intersections are estimated from the pool MinHash signatures instead.
+
+    Args:
+        spec: Kernel spec, see kernels.parse_kernel_spec.
+        rows1, rows2: Row positions in dataset.
+        approximate: Estimate the intersections from MinHash signatures (the "minhash" mode).
+
+    Returns:
+        numpy.ndarray of shape (len(rows1), len(rows2)).
+    """
+    blocks = {}
+    K = np.zeros((len(rows1), len(rows2)), dtype=np.float64)
+    for weight, kind, column in parse_kernel_spec(spec):
+        sizes = pool_row_sizes(column)
+        if column not in blocks and approximate:
+            signatures = load_pool_signatures(column)
+            blocks[column] = approximate_intersection(signatures[rows1], signatures[rows2], sizes[rows1], sizes[rows2], MINHASH_BITS)
+        elif column not in blocks:
+            blocks[column] = load_pool_gram(column)[np.ix_(rows1, rows2)]
+        K += weight * normalize_intersections(blocks[column], sizes[rows1], sizes[rows2], kind)
+    return K
+
+def load_pool_design_matrix(feature_set:str):
+    """
+    Returns the feature-indicator matrix of the whole dataset pool for one kernel spec.
+
+    For a feature column, row i is the binary indicator vector of the features of reaction i,
+    so M @ M.T is the intersection Gram matrix. The matrix is built once and kept in memory;
+    it has as many non-zeros as the column has features, unlike the quadratic Gram matrix.
+    A cosine term scales every row by 1 / sqrt(|x|), and a weighted sum stacks the terms'
+    matrices scaled by sqrt(weight) side by side, so M @ M.T is again exactly the spec's kernel.
+
+    Args:
+        feature_set: Kernel spec over the columns of dataset, without tanimoto terms
+            (the Tanimoto kernel has no finite feature map).
+
+    Returns:
+        scipy.sparse.csr_matrix of shape (len(dataset), number of distinct features of all terms).
+    """
+    if feature_set in design_matrices:
+        return design_matrices[feature_set]
+
+    blocks = []
+    for weight, kind, column in parse_kernel_spec(feature_set):
+        if kind == "tanimoto":
+            raise ValueError(f"Kernel spec '{feature_set}': tanimoto has no explicit feature map, use the kernel or precomputed mode")
+        if column not in design_matrices:
+            X = parse_feature_sets(dataset[column])
+            design_matrices[column] = to_sparse_matrix(X, build_vocabulary(X))
+        M = design_matrices[column]
+        if kind == "cosine":
+            sizes = M.getnnz(axis=1)
+            M = sparse.diags(np.divide(1.0, np.sqrt(sizes), out=np.zeros(len(sizes)), where=sizes > 0)) @ M
+        if weight != 1.0:
+            M = np.sqrt(weight) * M
+        blocks.append(M)
+    design_matrices[feature_set] = blocks[0] if len(blocks) == 1 else sparse.hstack(blocks, format='csr')
+    return design_matrices[feature_set]
+
+def run_single_experiment(feature_set:str, chosen_classes:list, reactions_per_class:int, mode:str = EXPERIMENT_MODE, random_state:int = None):
+    if mode in ("precomputed", "minhash"):
+        return run_single_precomputed_experiment(feature_set, chosen_classes, reactions_per_class, random_state, approximate=(mode == "minhash"))
+    if mode in ("linear", "sgd"):
+        return run_single_linear_experiment(feature_set, chosen_classes, reactions_per_class, streaming=(mode == "sgd"), random_state=random_state)
+    if mode != "kernel":
+        raise ValueError(f"Unknown experiment mode '{mode}'")
+
+    # 2nd step: Create a varied dataset according to configuration variables
+    data = create_varied_set(dataset, chosen_classes=chosen_classes, reactions_per_class=reactions_per_class, random_state=random_state)
+
+    # 3rd step: Prepare data for SVM, feature_set is a kernel spec over one or more columns
+    terms = parse_kernel_spec(feature_set)
+    Y = data['rxn_class']
+
+    # 4th step: Preprocess strings from the excel file into sets # TODO: Add a counter for empty sets or some other sort of tracking
+    X = kernel_input(data, spec_columns(feature_set))
 
     # 5th step: Split data into training and test set
+    from sklearn import svm
+    from sklearn.model_selection import train_test_split
     X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2, random_state=42)
 
     #6th step: Set up SVM classifier with custom kernel
-    clf = svm.SVC(kernel=my_kernel) # Here, one may try different kernels, see documentation
+    # The plain intersection kernel of one column, or the weighted kernel sum of the spec
+    kernel = my_kernel if terms == [(1.0, "intersection", feature_set)] else partial(combined_kernel, terms=terms)
+    clf = svm.SVC(kernel=kernel) # Here, one may try different kernels, see documentation
 
     # 7th step: Train model on training set
-    clf.fit(X_train, Y_train)
+    with stage("fit"):
+        clf.fit(X_train, Y_train)
 
     # 8th step: Evaluate model on test set
-    Y_pred = clf.predict(X_test)
+    with stage("predict"):
+        Y_pred = clf.predict(X_test)
+    return evaluate(Y_test, Y_pred)
+
+def run_single_precomputed_experiment(feature_set:str, chosen_classes:list, reactions_per_class:int, random_state:int = None, approximate:bool = False):
+    # Same steps as run_single_experiment, but the kernel values are sliced out of the pool Gram matrices
+    # (or estimated from the pool MinHash signatures if approximate is set)
+    data = create_varied_set(dataset, chosen_classes=chosen_classes, reactions_per_class=reactions_per_class, keep_index=True, random_state=random_state)
+    rows = data.index.to_numpy()
+    Y = data['rxn_class'].to_numpy()
+
+    from sklearn import svm
+    from sklearn.model_selection import train_test_split
+    # Splitting the row positions yields the same split as splitting the feature column itself
+    rows_train, rows_test, Y_train, Y_test = train_test_split(rows, Y, test_size=0.2, random_state=42)
+
+    clf = svm.SVC(kernel='precomputed')
+    with stage("fit"):
+        clf.fit(pool_kernel_block(feature_set, rows_train, rows_train, approximate), Y_train)
+
+    with stage("predict"):
+        Y_pred = clf.predict(pool_kernel_block(feature_set, rows_test, rows_train, approximate))
+    return evaluate(Y_test, Y_pred)
+
+def run_single_linear_experiment(feature_set:str, chosen_classes:list, reactions_per_class:int, streaming:bool = False, random_state:int = None):
+    # Same steps as run_single_experiment, but a linear model is trained on the rows of the pool design matrix.
+    # The intersection kernel is the plain dot product of these rows, so a linear SVM optimizes the same
+    # hinge-loss objective as SVC(kernel=my_kernel) in time linear in the number of samples.
+    # Differences: multiclass is one-vs-rest instead of one-vs-one, and the intercept is regularized.
+    M = load_pool_design_matrix(feature_set)
+    data = create_varied_set(dataset, chosen_classes=chosen_classes, reactions_per_class=reactions_per_class, keep_index=True, random_state=random_state)
+    rows = data.index.to_numpy()
+    Y = data['rxn_class'].to_numpy()
+
+    from sklearn import svm
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.model_selection import train_test_split
+    rows_train, rows_test, Y_train, Y_test = train_test_split(rows, Y, test_size=0.2, random_state=42)
+    M_train = M[rows_train]
+
+    if streaming:
+        # alpha = 1 / (C * n_samples) is the SGD counterpart of SVC's default C=1
+        clf = SGDClassifier(loss='hinge', alpha=1.0 / len(rows_train), random_state=42)
+        classes = np.unique(Y)
+        shuffle = np.random.default_rng(42)
+        with stage("fit"):
+            for _ in range(SGD_EPOCHS):
+                order = shuffle.permutation(len(rows_train))
+                for start in range(0, len(order), SGD_BATCH_SIZE):
+                    batch = order[start:start + SGD_BATCH_SIZE]
+                    clf.partial_fit(M_train[batch], Y_train[batch], classes=classes)
+    else:
+        clf = svm.LinearSVC(loss='hinge', C=1.0, max_iter=10000)
+        with stage("fit"):
+            clf.fit(M_train, Y_train)
+
+    with stage("predict"):
+        Y_pred = clf.predict(M[rows_test])
+    return evaluate(Y_test, Y_pred)
+
+def evaluate(Y_test, Y_pred):
+    from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
     accuracy = accuracy_score(Y_test, Y_pred)
     f1 = f1_score(Y_test, Y_pred, average='weighted')
     precision = precision_score(Y_test, Y_pred, average='weighted', zero_division=np.nan)
@@ -94,6 +370,31 @@ def run_single_experiment(feature_set:str, chosen_classes:list, reactions_per_cl
     print(f"Accuracy: {accuracy}, F1 Score: {f1}, Precision: {precision}, Recall: {recall}")
     return accuracy, f1, precision, recall
 
+def summary_row(feature_set:str, chosen_classes:list, used_classes:int, reactions_per_class:int, repetitions:int, class_repetitions:int, scores:list) -> dict:
+    # Summary row of final_dataset for the repetitions on one set of classes
+    avg_score = {
+        "accuracy": np.mean([s["accuracy"] for s in scores]),
+        "f1": np.mean([s["f1"] for s in scores]),
+        "precision": np.mean([s["precision"] for s in scores]),
+        "recall": np.mean([s["recall"] for s in scores])
+    }
+    return {
+        "Feature Set": feature_set,
+        "Used Classes": list(chosen_classes),
+        "Number of Used Classes": used_classes,
+        "Reactions per Class": reactions_per_class,
+        "Repetitions on same classes": repetitions,
+        "Repetitions of each class size": class_repetitions,
+        "Average Accuracy score": avg_score["accuracy"],
+        "Average F1 score": avg_score["f1"],
+        "Average Precision score": avg_score["precision"],
+        "Average Recall score": avg_score["recall"],
+        "Accuracy Scores": [s["accuracy"] for s in scores],
+        "F1 Scores": [s["f1"] for s in scores],
+        "Precision Scores": [s["precision"] for s in scores],
+        "Recall Scores": [s["recall"] for s in scores]
+    }
+
 def run_experiments(feature_set:str = FEATURE_SET, used_classes:int = CLASSES, reactions_per_class:int = REACTIONS_PER_CLASS):
     global final_dataset
     class_repetitions = required_repetitions(used_classes, total=50)
@@ -108,32 +409,120 @@ def run_experiments(feature_set:str = FEATURE_SET, used_classes:int = CLASSES, r
             print(f"  Repetition {i+1}/{repetitions}")
             accuracy, f1, precision, recall = run_single_experiment(feature_set, chosen_classes, reactions_per_class)
             scores.append({"accuracy": accuracy, "f1": f1, "precision": precision, "recall": recall})
-        
-        # Summary
-        avg_score = {
-            "accuracy": np.mean([s["accuracy"] for s in scores]),
-            "f1": np.mean([s["f1"] for s in scores]),
-            "precision": np.mean([s["precision"] for s in scores]),
-            "recall": np.mean([s["recall"] for s in scores])
-        }
 
         # Write results to final_dataset (append per class set)
-        final_dataset = pd.concat([final_dataset, pd.DataFrame([{
-            "Feature Set": feature_set,
-            "Used Classes": chosen_classes.tolist(),
-            "Number of Used Classes": used_classes,
-            "Reactions per Class": reactions_per_class,
-            "Repetitions on same classes": repetitions,
-            "Repetitions of each class size": class_repetitions,
-            "Average Accuracy score": avg_score["accuracy"],
-            "Average F1 score": avg_score["f1"],
-            "Average Precision score": avg_score["precision"],
-            "Average Recall score": avg_score["recall"],
-            "Accuracy Scores": [s["accuracy"] for s in scores],
-            "F1 Scores": [s["f1"] for s in scores],
-            "Precision Scores": [s["precision"] for s in scores],
-            "Recall Scores": [s["recall"] for s in scores]
-        }])], ignore_index=True)
+        row = summary_row(feature_set, chosen_classes.tolist(), used_classes, reactions_per_class, repetitions, class_repetitions, scores)
+        final_dataset = pd.concat([final_dataset, pd.DataFrame([row])], ignore_index=True)
+
+def job_seed(*key) -> int:
+    """Returns a deterministic 32-bit seed for a job, derived from the sweep seed and the job's position in the sweep."""
+    return int.from_bytes(blake2b(repr(key).encode('utf-8'), digest_size=4).digest(), 'big')
+
+def expand_sweep(feature_sets:list, class_settings:list, reaction_settings:list, seed:int = SWEEP_SEED, mode:str = EXPERIMENT_MODE) -> list:
+    """
+    Expands the FEATURE_SETS x CLASS_SETTINGS x REACTION_SETTINGS sweep into independent jobs,
+    one per (class set, repetition), with the same class sets and repetition counts as run_experiments.
+
+    Every job carries its own seeds, derived from seed and its position in the sweep, so the
+    sweep gives the same results however the jobs are distributed over processes.
+
+    Returns:
+        list[dict]: Jobs in the order of the summary rows of final_dataset.
+    """
+    all_classes = np.sort(dataset["rxn_class"].unique())
+    jobs = []
+    for feature_set in feature_sets:
+        for used_classes in class_settings:
+            for reactions_per_class in reaction_settings:
+                class_repetitions = required_repetitions(used_classes, total=50)
+                repetitions = required_repetitions(reactions_per_class, total=1000)
+                for class_set in range(1, class_repetitions):
+                    rng = np.random.default_rng(job_seed(seed, feature_set, used_classes, reactions_per_class, class_set))
+                    chosen_classes = rng.choice(all_classes, size=used_classes, replace=False).tolist()
+                    for repetition in range(repetitions):
+                        jobs.append({
+                            "group": (feature_set, used_classes, reactions_per_class, class_set),
+                            "feature_set": feature_set,
+                            "chosen_classes": chosen_classes,
+                            "used_classes": used_classes,
+                            "reactions_per_class": reactions_per_class,
+                            "repetitions": repetitions,
+                            "class_repetitions": class_repetitions,
+                            "mode": mode,
+                            "random_state": job_seed(seed, feature_set, used_classes, reactions_per_class, class_set, repetition)
+                        })
+    return jobs
+
+def _init_sweep_worker(store_path, columns, pruning, instrument):
+    # Each worker memory-maps the feature store itself instead of receiving the DataFrame pickled,
+    # and prunes it with the vocabularies the parent has persisted in the store.
+    # Without a store the dataset is inherited from the parent process (fork start method).
+    global dataset, dataset_store
+    if store_path is not None:
+        dataset = load_feature_dataframe(store_path, columns=columns)
+        dataset_store = store_path
+        prune_dataset(columns, *pruning)
+    if instrument:
+        instrumentation.reset()
+        instrumentation.enable()
+
+def _run_sweep_job(job):
+    accuracy, f1, precision, recall = run_single_experiment(job["feature_set"], job["chosen_classes"], job["reactions_per_class"], mode=job["mode"], random_state=job["random_state"])
+    return {"accuracy": accuracy, "f1": f1, "precision": precision, "recall": recall}
+
+def _run_sweep_job_in_worker(job):
+    # The timers of a worker are handed back with every result and merged by the parent
+    score = _run_sweep_job(job)
+    report = instrumentation.report() if instrumentation.is_enabled() else None
+    instrumentation.reset()
+    return score, report
+
+def run_sweep(feature_sets:list = FEATURE_SETS, class_settings:list = CLASS_SETTINGS, reaction_settings:list = REACTION_SETTINGS, processes:int = PROCESSES, seed:int = SWEEP_SEED, mode:str = EXPERIMENT_MODE) -> pd.DataFrame:
+    """
+    Runs the whole sweep on a process pool and returns the summary rows of final_dataset.
+
+    Args:
+        feature_sets, class_settings, reaction_settings: Sweep axes, see the configuration variables.
+        processes: Number of worker processes, os.cpu_count() if None. 1 runs in this process.
+        seed: Sweep seed, the per-job seeds are derived from it (see expand_sweep).
+        mode: Training mode, see EXPERIMENT_MODE.
+
+    Returns:
+        pandas DataFrame with one row per class set, as built by run_experiments.
+    """
+    columns = feature_columns(feature_sets)
+    for spec in feature_sets:
+        # Fail before any job runs on invalid specs and on kernels the linear modes cannot represent
+        if mode in ("linear", "sgd") and any(kind == "tanimoto" for _, kind, _ in parse_kernel_spec(spec)):
+            raise ValueError(f"Kernel spec '{spec}': tanimoto has no explicit feature map, use the kernel or precomputed mode")
+    jobs = expand_sweep(feature_sets, class_settings, reaction_settings, seed, mode)
+    print(f"Running {len(jobs)} experiments on {processes or os.cpu_count()} processes.")
+    if mode == "precomputed":
+        # Compute the pool Gram matrices once up front (one per column, shared by all specs), the workers only memory-map them
+        for column in columns:
+            load_pool_gram(column)
+    elif mode == "minhash":
+        # Likewise the signatures, inherited by the workers
+        for column in columns:
+            load_pool_signatures(column)
+
+    if processes == 1:
+        scores = [_run_sweep_job(job) for job in jobs]
+    else:
+        with Pool(processes=processes, initializer=_init_sweep_worker, initargs=(dataset_store, columns, dataset_pruning, instrumentation.is_enabled())) as pool:
+            scores = []
+            for score, report in pool.map(_run_sweep_job_in_worker, jobs, chunksize=1):
+                scores.append(score)
+                if report is not None:
+                    instrumentation.merge(report)
+
+    # Gather the repetitions of every class set into one summary row, in sweep order
+    groups = {}
+    for job, score in zip(jobs, scores):
+        groups.setdefault(job["group"], (job, []))[1].append(score)
+    rows = [summary_row(job["feature_set"], job["chosen_classes"], job["used_classes"], job["reactions_per_class"], job["repetitions"], job["class_repetitions"], group_scores)
+            for job, group_scores in groups.values()]
+    return pd.DataFrame(rows)
 
 def required_repetitions(sample_size:int, total:int, target_coverage:float = 0.95) -> int:
     """
@@ -158,20 +547,71 @@ def required_repetitions(sample_size:int, total:int, target_coverage:float = 0.9
     return ceil(repetitions)
 
 
-# 1st step: Read files and load to dataset DataFrame
-with open("data/combined_data.xlsx", "rb") as f:
-    dataset = pd.read_excel(f)
+def prune_dataset(columns:list, min_df = MIN_DF, max_df = MAX_DF):
+    """
+    Drops the features of the given dataset columns that occur in fewer than min_df or more than max_df reactions.
+
+    The document frequencies come from the vocabulary persisted in the feature store (built on first use,
+    see vocabulary.load_or_build_vocabulary), or from the loaded column without a store. They count the
+    reactions of the whole pool, so train and test rows of every experiment are mapped identically.
+    """
+    global dataset_pruning
+    dataset_pruning = (min_df, max_df)
+    if dataset_pruning == (1, None):
+        return
+    for column in columns:
+        if dataset_store is not None:
+            vocabulary = load_or_build_vocabulary(dataset_store, column)
+        else:
+            vocabulary = Vocabulary.build(parse_feature_sets(dataset[column]))
+        pruned = vocabulary.prune(min_df, max_df)
+        print(f"Feature set '{column}': keeping {len(pruned)} of {len(vocabulary)} features (min_df={min_df}, max_df={max_df}).")
+        dataset[column] = pruned.filter_rows(parse_feature_sets(dataset[column]))
+
+def load_dataset(feature_sets:list = FEATURE_SETS, store:str = FEATURE_STORE, min_df = MIN_DF, max_df = MAX_DF) -> pd.DataFrame:
+    """
+    1st step: Read files and load the dataset DataFrame used by all experiment functions.
+
+    Prefers the binary feature store (see feature_store.py), which only loads the used columns
+    and needs no text parsing, and falls back to data/combined_data.xlsx.
+    The feature columns are pruned by document frequency if min_df or max_df is set, see prune_dataset.
+    """
+    global dataset, dataset_store
+    if is_feature_store(store):
+        dataset = load_feature_dataframe(store, columns=feature_columns(feature_sets))
+        dataset_store = store
+    else:
+        with open("data/combined_data.xlsx", "rb") as f:
+            dataset = pd.read_excel(f)
+        dataset_store = None
+    # Per-column data derived from a previously loaded dataset is stale now
+    for memo in (pool_grams, pool_sizes, design_matrices, pool_signatures):
+        memo.clear()
+    prune_dataset(feature_columns(feature_sets), min_df, max_df)
+    return dataset
+
+def main(feature_sets:list = FEATURE_SETS, class_settings:list = CLASS_SETTINGS, reaction_settings:list = REACTION_SETTINGS,
+         mode:str = EXPERIMENT_MODE, processes:int = PROCESSES, store:str = FEATURE_STORE, output:str = "svm_experiment_results.xlsx",
+         instrument:bool = INSTRUMENTATION, min_df = MIN_DF, max_df = MAX_DF):
+    global final_dataset
+    load_dataset(feature_sets, store, min_df, max_df)
+
+    if instrument:
+        instrumentation.enable()
+
+    # Run the FEATURE_SETS x CLASS_SETTINGS x REACTION_SETTINGS sweep in parallel, see run_sweep
+    final_dataset = run_sweep(feature_sets, class_settings, reaction_settings, processes=processes, mode=mode)
+
+    if instrument:
+        print(instrumentation.format_report())
+        instrumentation.write_report(INSTRUMENTATION_REPORT)
 
-for feature_set in FEATURE_SETS:
-    for used_classes in CLASS_SETTINGS:
-        for reactions_per_class in REACTION_SETTINGS:
-            print(f"Running experiments for feature set '{feature_set}' with {used_classes} classes and {reactions_per_class} reactions per class.")
-            run_experiments(feature_set=feature_set, used_classes=used_classes, reactions_per_class=reactions_per_class)
+    final_dataset.to_excel(output, index=False)
+    return final_dataset
 
-final_dataset.to_excel("svm_experiment_results.xlsx", index=False)
 
-clf.fit(X_train, Y_train)
-score = clf.score(X_test, Y_test)
+if __name__ == "__main__":
+    main()
 
 
 # TODO: Add used classes to compare if it depends on the classes chosen - Carefully! Needs to be evaluated on all combinations
@@ -1,22 +1,5 @@
-
-from sklearn import svm
-from sklearn.model_selection import train_test_split
-import pandas as pd
-import glob
-import random
-
-all_x_lists = []
-
-for file in glob.glob("data/*.xlsx"):
-    data = pd.read_excel(file)
-    print(f"File: {file}, Rows: {len(data)}")
-    all_x_lists.append(data['DRF Nodes'].values)
-
-X = np.concatenate(all_x_lists)
-df=pd.read_csv('schneider50k.tsv', sep='\t')
-Y = df['rxn_class'].values
-
-X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2, random_state=42)
+from kernels import intersection_kernel
+from feature_store import load_feature_column, load_rxn_class, DEFAULT_STORE
 
 def my_kernel(X1, X2):
     """
@@ -29,22 +12,27 @@ def my_kernel(X1, X2):
     Returns:
         K: Kernel matrix of shape (n_samples_X, n_samples_Y).
     """
+    # Evaluated as one sparse product over a shared feature vocabulary, see kernels.py
+    return intersection_kernel(X1, X2)
+
 
-    n_x = len(X1)
-    n_y = len(X2)
+def main(store:str = DEFAULT_STORE, feature_set:str = 'DRF Nodes') -> float:
+    from sklearn import svm
+    from sklearn.model_selection import train_test_split
 
-    K = np.zeros((n_x, n_y))
+    # Features are read from the binary feature store (see feature_store.py), no text parsing needed
+    X = load_feature_column(store, feature_set).to_object_array()
+    Y = load_rxn_class(store)
 
-    for i in range(n_x):
-        for j in range(n_y):
-            # Compute intersection size
-            K[i, j] = len(X1[i].intersection(X2[j]))
+    X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2, random_state=42)
 
-    return K
+    # we create an instance of SVM and fit out data.
+    clf = svm.SVC(kernel=my_kernel)
 
+    clf.fit(X_train, Y_train)
+    score = clf.score(X_test, Y_test)
+    return score
 
-# we create an instance of SVM and fit out data.
-clf = svm.SVC(kernel=my_kernel)
 
-clf.fit(X_train, Y_train)
-score = clf.score(X_test, Y_test)
+if __name__ == "__main__":
+    print(main())
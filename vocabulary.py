@@ -0,0 +1,155 @@
+"""Dataset-wide feature vocabulary: dense column IDs and document frequencies of the hashed features.
+
+The feature IDs of getWL and phi_transformation are open-ended 64-bit hashes, and most of them
+occur in a single reaction. A singleton never contributes to the intersection of two different
+reactions, so it only costs memory and time; features contained in almost every reaction add
+about the same amount to every kernel entry. A Vocabulary is built with one scan over a stored
+feature column and records, for every feature ID, the number of reactions containing it. Its
+dense column ID is its position in the sorted vocabulary, i.e. the layout kernels.build_vocabulary
+uses, so a (pruned) vocabulary can be passed to kernels.to_sparse_matrix as it is.
+
+A vocabulary is persisted next to the store it was built from, so the training rows, the test
+rows and new reactions (see classification_service.py) are all mapped with the same columns:
+    features.npy               uint64, sorted feature IDs
+    document_frequencies.npy   int64,  number of reactions containing features[j]
+
+Usage:
+    python cli.py vocabulary data/feature_store --min-df 2
+"""
+import json
+import os
+import numpy as np
+from feature_store import FeatureColumn, as_feature_column, column_signature, load_feature_column, DEFAULT_STORE
+from kernels import to_sparse_matrix
+from instrumentation import stage, count
+
+
+def df_limit(value, n_rows:int) -> float:
+    """Returns a document-frequency threshold as a count: a float below 1 is a fraction of n_rows."""
+    if isinstance(value, float) and value < 1:
+        return value * n_rows
+    return value
+
+
+class Vocabulary:
+    """
+    Sorted feature IDs of one feature column with the number of reactions containing each of them.
+    """
+    __slots__ = ('features', 'document_frequencies', 'n_rows')
+
+    def __init__(self, features, document_frequencies, n_rows:int):
+        self.features = features
+        self.document_frequencies = document_frequencies
+        self.n_rows = n_rows
+
+    @classmethod
+    def build(cls, column):
+        """
+        Builds the vocabulary of a feature column with one sort of all its feature IDs.
+
+        Args:
+            column: FeatureColumn (plain or sharded) or iterable of per-row feature collections.
+        """
+        column = as_feature_column(column)
+        with stage("vocabulary_build"):
+            # Feature IDs are unique within a row, so the count of an ID is its document frequency
+            features, frequencies = np.unique(np.asarray(column.ids, dtype=np.uint64), return_counts=True)
+        count("vocabulary_features", len(features))
+        return cls(features, frequencies.astype(np.int64), len(column))
+
+    def __len__(self):
+        return len(self.features)
+
+    def column_ids(self, features) -> np.ndarray:
+        """Returns the dense column ID of every passed feature ID, -1 for features not in the vocabulary."""
+        features = np.asarray(features, dtype=np.uint64)
+        positions = np.searchsorted(self.features, features)
+        positions[positions == len(self.features)] = 0
+        found = self.features[positions] == features if len(self.features) else np.zeros(len(features), dtype=bool)
+        return np.where(found, positions, -1)
+
+    def prune(self, min_df = 1, max_df = None):
+        """
+        Returns the vocabulary of the features contained in at least min_df and at most max_df reactions.
+
+        Args:
+            min_df: Minimum document frequency, a count or (float below 1) a fraction of n_rows.
+                2 drops the singletons, which cannot contribute to the kernel between two different reactions.
+            max_df: Maximum document frequency, like min_df. None keeps the most frequent features.
+        """
+        keep = self.document_frequencies >= df_limit(min_df, self.n_rows)
+        if max_df is not None:
+            keep &= self.document_frequencies <= df_limit(max_df, self.n_rows)
+        return Vocabulary(self.features[keep], self.document_frequencies[keep], self.n_rows)
+
+    def filter_column(self, column) -> FeatureColumn:
+        """Returns a new in-memory FeatureColumn holding only the features of every row that are in the vocabulary."""
+        column = as_feature_column(column)
+        ids = np.asarray(column.ids, dtype=np.uint64)
+        keep = self.column_ids(ids) >= 0
+        offsets = np.zeros(len(column) + 1, dtype=np.int64)
+        row_of = np.repeat(np.arange(len(column), dtype=np.int64), column.sizes())
+        np.cumsum(np.bincount(row_of[keep], minlength=len(column)), out=offsets[1:])
+        count("pruned_features", int(len(ids) - keep.sum()))
+        return FeatureColumn(offsets, ids[keep])
+
+    def filter_rows(self, rows) -> np.ndarray:
+        """Like filter_column, returned as an object array of uint64 arrays (the cells of a feature DataFrame)."""
+        return self.filter_column(rows).to_object_array()
+
+    def transform(self, rows):
+        """Returns the binary CSR matrix of rows over the dense column IDs, see kernels.to_sparse_matrix."""
+        return to_sparse_matrix(rows if isinstance(rows, list) else list(rows), self.features)
+
+    def save(self, path:str, signature:str = None):
+        """Writes the vocabulary to a directory, with the column_signature of the column it was built from if known."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "features.npy"), self.features)
+        np.save(os.path.join(path, "document_frequencies.npy"), self.document_frequencies)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"n_rows": int(self.n_rows), "n_features": len(self),
+                       "n_singletons": int((self.document_frequencies == 1).sum()), "signature": signature}, f, indent=2)
+
+    @classmethod
+    def load(cls, path:str, mmap:bool = True):
+        """Loads a vocabulary written by save, memory-mapped unless mmap is False."""
+        mode = 'r' if mmap else None
+        with open(os.path.join(path, "meta.json")) as f:
+            n_rows = json.load(f)["n_rows"]
+        return cls(np.load(os.path.join(path, "features.npy"), mmap_mode=mode),
+                   np.load(os.path.join(path, "document_frequencies.npy"), mmap_mode=mode), n_rows)
+
+
+def vocabulary_path(store:str, column:str) -> str:
+    """Returns the default location of the vocabulary of a store column, inside the store directory."""
+    return os.path.join(store, "vocabulary", column.replace(' ', '_'))
+
+
+def load_or_build_vocabulary(store:str = DEFAULT_STORE, column:str = "DRF Edges", path:str = None) -> Vocabulary:
+    """
+    Loads the persisted (unpruned) vocabulary of a store column, building and saving it on first use
+    or when the column has changed since, e.g. because the store was precomputed again with other settings.
+    """
+    path = path or vocabulary_path(store, column)
+    features = load_feature_column(store, column)
+    signature = column_signature(features)
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f).get("signature") == signature:
+                return Vocabulary.load(path)
+    vocabulary = Vocabulary.build(features)
+    vocabulary.save(path, signature)
+    return vocabulary
+
+
+def vocabulary_summary(vocabulary:Vocabulary, min_df = 1, max_df = None) -> dict:
+    """Returns the size of a vocabulary and the share of its features and postings kept by a pruning."""
+    pruned = vocabulary.prune(min_df, max_df)
+    postings = int(np.sum(vocabulary.document_frequencies))
+    return {
+        "n_rows": int(vocabulary.n_rows), "n_features": len(vocabulary),
+        "n_singletons": int(np.sum(vocabulary.document_frequencies == 1)),
+        "kept_features": len(pruned), "postings": postings,
+        "kept_postings": int(np.sum(pruned.document_frequencies)),
+    }
@@ -1,73 +1,144 @@
-from phi_transformation import *
-from networkx import Graph
+from collections import Counter
 from synkit.IO import rsmi_to_graph
-from multiset import *
+from compact_graph import as_compact_graph
+from shortest_paths import ShortestPathForest
+from feature_ids import get_hash, as_feature_array
+from instrumentation import stage, count
 
-def wfl(graph, h_max, setting):
-  # Initial features
-  ## Call wfl_vertex, wfl_edge or wfl_shortest_path based on setting
+# Hop-layer WL: in iteration h every node is extended by the multiset of the *initial* labels of the
+# nodes at exactly h hops. Every label is propagated on its own (no already extended labels are mixed
+# into the neighbors), so after h iterations the signature of a node lists, hop by hop, how often every
+# element occurs at that distance, e.g. "C|C2N1|O1" for a carbon with two carbons and one nitrogen
+# next to it and one oxygen at two hops.
+# The hop layers of all nodes are computed once per graph (one BFS per node, truncated at h_max) and
+# reused in every iteration and by every setting, instead of a fresh BFS per node and iteration.
 
-  None
+SETTINGS = ("vertex", "edge", "shortest_path")
 
-def wfl_vertex(graph, h_max):
-  feature_set:dict = phi_vertex_dict_graph_no_hash(graph)
+# Computes the settings' features of the passed graph after up to h_max WL iterations
+# setting is "vertex" (node signatures), "edge" (bond order between two node signatures)
+# or "shortest_path" (shortest paths labelled with the node signatures, including their length)
+# Returns a sorted uint64 array of hashed features, like the phi transformations
+def wfl(graph, h_max, setting="vertex"):
+  if setting == "vertex":
+    return wfl_vertex_features(graph, h_max)
+  if setting == "edge":
+    return wfl_edge(graph, h_max)
+  if setting == "shortest_path":
+    return wfl_shortest_path(graph, h_max)
+  raise ValueError(f"Unknown setting '{setting}', expected one of {SETTINGS}")
+
+# Computes the nodes at distance 1..depth from the node at position source, stopping after depth hops
+# Returns a list (per hop) of node positions, shorter than depth if no nodes are left at larger distances
+def _bfs_layers(adjacency, source, depth):
+  seen = {source}
+  frontier = [source]
+  layers = []
+  for _ in range(depth):
+    next_frontier = []
+    for u in frontier:
+      for w in adjacency[u]:
+        if w not in seen:
+          seen.add(w)
+          next_frontier.append(w)
+    if not next_frontier:
+      break
+    layers.append(next_frontier)
+    frontier = next_frontier
+  return layers
 
-  for h in range(h_max):
-    for node in feature_set.keys():
-      neighbors = get_nth_neighbors(graph, node, h) # Calculates the neighbors at h distance, return the nodes (int)
-      neighbor_labels = list()
-      for neighbor in neighbors:
-        neighbor_labels.extend(feature_set[neighbor])
+# Computes the hop layers of every node once per graph (one BFS per node, truncated at depth)
+# Returns a list (per node position) of _bfs_layers results
+def hop_layers(graph, depth):
+  adjacency = as_compact_graph(graph).adjacency_lists()
+  return [_bfs_layers(adjacency, source, depth) for source in range(len(adjacency))]
 
-      # Append labels to current nodes' feature
-      current_labels_of_node = list(feature_set[node])
-      current_labels_of_node.extend(neighbor_labels)
-      # Sort the labels to ensure consistent ordering
-      current_labels_of_node = sorted(current_labels_of_node)
+# Computes the signatures of one node after 0..h_max iterations from its hop layers
+# labels are the initial labels of all nodes (by position), node_layers the node's entry of hop_layers
+# Stops as soon as the node's layers are exhausted, further iterations would not change its partition
+def wfl_vertex_for_node(labels, node_layers, h_max, node):
+  signature = labels[node]
+  signatures = [signature]
+  for layer in node_layers[:h_max]:
+    multiset = Counter(labels[w] for w in layer)
+    signature += "|" + "".join(f"{label}{multiplicity}" for label, multiplicity in sorted(multiset.items()))
+    signatures.append(signature)
+  return signatures
 
-      # Update the feature set
-      feature_set[node] = current_labels_of_node
-      
-  print ("Final Feature Set:", feature_set)
+# Computes the signatures of all nodes after 0..h_max iterations
+# Returns a list (per node position) of signature lists, see wfl_vertex_for_node
+def _node_signatures(graph, h_max):
+  with stage("apsp"):
+    layers = hop_layers(graph, h_max)
+  labels = graph.element_symbols()
+  with stage("wl_iteration"):
+    signatures = [wfl_vertex_for_node(labels, node_layers, h_max, node) for node, node_layers in enumerate(layers)]
+  count("wl_iterations", max((len(s) - 1 for s in signatures), default=0))
+  return signatures
 
-  # TODO: Problem: We've to do wfl for each label separately. Now, we do it simultaneously which is wrong.
+# Returns the signature of every node in iteration h, or its final signature if it stopped earlier
+def _signatures_at(signatures, h):
+  return [node_signatures[min(h, len(node_signatures) - 1)] for node_signatures in signatures]
 
-  return feature_set
+# Runs the vertex WL on the passed graph
+# Returns a dict of node ids with the node's signatures after 0..h_max iterations
+# E.g. {1: ["C", "C|C1O1", "C|C1O1|N2"], 2: ...}
+def wfl_vertex(graph, h_max):
+  graph = as_compact_graph(graph)
+  signatures = _node_signatures(graph, h_max)
+  return dict(zip(graph.node_ids, signatures))
 
-def wfl_vertex_for_node(feature_set, h_max, node):
+# Returns the hashed signatures of all nodes in all iterations as sorted uint64 array
+def wfl_vertex_features(graph, h_max):
+  graph = as_compact_graph(graph)
+  signatures = _node_signatures(graph, h_max)
+  with stage("hashing"):
+    features = {get_hash(signature) for node_signatures in signatures for signature in node_signatures}
+  count("hashed_features", len(features))
+  return as_feature_array(features)
 
+# Returns the hashed edges (bond order between the sorted signatures of both nodes) of all iterations
+# as sorted uint64 array
+def wfl_edge(graph, h_max):
+  graph = as_compact_graph(graph)
+  signatures = _node_signatures(graph, h_max)
+  edges = list(graph.edges())
+  iterations = max((len(s) for s in signatures), default=1)
+  features = set()
+  with stage("hashing"):
+    for h in range(iterations):
+      current = _signatures_at(signatures, h)
+      for u, v, order in edges:
+        a, b = sorted([current[u], current[v]])
+        features.add(get_hash(f"{a}/{order}/{b}"))
+  count("hashed_features", len(features))
+  return as_feature_array(features)
 
-  # Iterate h_max times
-  ## For each node in feature_set, get the set and check for each for neighbors, don't forget to sort
-  ## Extend the feature set by appending neighbor features
-  None
+# Returns the hashed shortest paths (signatures along the path, and signature-distance-signature)
+# of all iterations as sorted uint64 array
+# The BFS trees are built once and relabelled in every iteration (see shortest_paths.py)
+def wfl_shortest_path(graph, h_max):
+  graph = as_compact_graph(graph)
+  signatures = _node_signatures(graph, h_max)
+  with stage("apsp"):
+    forest = ShortestPathForest(graph)
+  iterations = max((len(s) for s in signatures), default=1)
+  features = set()
+  with stage("hashing"):
+    for h in range(iterations):
+      codes = [get_hash(signature) for signature in _signatures_at(signatures, h)]
+      features.update(forest.features(codes, include_distance=True))
+  count("hashed_features", len(features))
+  return as_feature_array(features)
 
 def get_test_graph():
   g, _ = rsmi_to_graph("[CH3:17][S:14](=[O:15])(=[O:16])[N:11]1[CH2:10][CH2:9][N:8](Cc2ccccc2)[CH2:13][CH2:12]1>>[CH3:17][S:14](=[O:15])(=[O:16])[N:11]1[CH2:10][CH2:9][NH:8][CH2:13][CH2:12]1")
   return g
 
+# Returns the ids of the nodes at exactly n hops from the passed node (the direct neighbors for n <= 1),
+# an empty set if the graph has no nodes that far away
 def get_nth_neighbors(graph, node, n):
-  # Initial neighbors
-  seen_neighbors = set() 
-  seen_neighbors.add(node) # Sees itself as seen
-  neighbors = set(graph.neighbors(node))
-  seen_neighbors.update(neighbors) # Add initial neighbors to seen
-  for _ in range(n - 1):
-    # New neighbors are the neighbors of the current neighbors
-    new_neighbors = set()
-    for neighbor in neighbors:
-      # Only consider neighbors that haven't been seen yet
-      for nn in graph.neighbors(neighbor):
-        if nn not in seen_neighbors:
-          new_neighbors.add(nn)
-    
-    # If no unseen neighbors were found, stop
-    if not new_neighbors:
-      print("No more new neighbors found.")
-      break
-
-    # Add to seen neighbors and move frontier forward
-    seen_neighbors.update(new_neighbors)
-    neighbors = new_neighbors
-    
-  return neighbors
\ No newline at end of file
+  graph = as_compact_graph(graph)
+  n = max(n, 1)
+  layers = _bfs_layers(graph.adjacency_lists(), graph.node_ids.index(node), n)
+  return {graph.node_ids[w] for w in layers[n - 1]} if len(layers) == n else set()